@@ -0,0 +1,304 @@
+'''
+Benchmark harness for the indexing pipeline, the index loader, the compression
+stages and query latency. Runs on the Reuters corpus or on a synthetic corpus
+of configurable size, and writes JSON results that can be compared across
+commits with --compare.
+
+    python benchmark.py -i data -o output/benchmark.json
+    python benchmark.py --synthetic --files 10 --docs_per_file 1000 -o output/benchmark.json
+    python benchmark.py -i data --compare output/benchmark_before.json
+'''
+
+import argparse
+import contextlib
+import io
+import os
+import platform
+import random
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+import binary_index
+import compressor
+import indexer
+import instrumentation
+import query
+import utils
+
+REGRESSION_RATIO = 1.2  # new/old timing flagged by compare, below it is mostly noise
+
+
+def init_params():
+    parser = argparse.ArgumentParser(description='Process command line arguments')
+    parser.add_argument('-i', '--input_file', default='data', help='Corpus directory')
+    parser.add_argument('-o', '--output_file', default='output/benchmark.json', help='Output file')
+    parser.add_argument('--synthetic', action='store_true', help='Benchmark a generated corpus instead of <input_file>')
+    parser.add_argument('--files', type=int, default=22, help='Number of .sgm files of the synthetic corpus')
+    parser.add_argument('--docs_per_file', type=int, default=1000, help='Number of documents per synthetic file')
+    parser.add_argument('--words_per_doc', type=int, default=120, help='Average number of words per synthetic document')
+    parser.add_argument('--vocabulary', type=int, default=30000, help='Vocabulary size of the synthetic corpus')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic corpus and of the query sample')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per stage, the median is reported')
+    parser.add_argument('-q', '--queries', type=int, default=2000, help='Number of queries timed')
+    parser.add_argument('--cold_starts', type=int, default=20, help='Number of query.py processes timed from start to exit')
+    parser.add_argument('--compare', default=None, help='Previous results to compare with')
+    args = parser.parse_args()
+
+    return args
+
+
+# ----------------------------------------------------------------------------
+# Synthetic corpus
+# ----------------------------------------------------------------------------
+
+def synthetic_vocabulary(size: int, rng: random.Random) -> List[str]:
+    '''Random words, with some capitalized variants and numbers like in Reuters'''
+    words = set()
+    while len(words) < size:
+        word = ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10)))
+        roll = rng.random()
+        if roll < 0.1:
+            word = word.capitalize()
+        elif roll < 0.13:
+            word = str(rng.randint(0, 99999))
+        words.add(word)
+    return sorted(words)
+
+
+def generate_synthetic_corpus(directory: str, files=22, docs_per_file=1000, words_per_doc=120, vocabulary_size=30000, seed=0) -> None:
+    '''
+    Writes <files> .sgm files in the Reuters 21578 layout into <directory>.
+    Words follow a Zipf distribution over the vocabulary, so postings lengths
+    look like those of natural text.
+    '''
+    rng = random.Random(seed)
+    vocabulary = synthetic_vocabulary(vocabulary_size, rng)
+    rng.shuffle(vocabulary)
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    topics = ['earn', 'acq', 'crude', 'grain', 'trade', 'interest', 'money-fx', 'ship']
+    places = ['usa', 'uk', 'japan', 'canada', 'west-germany', 'france']
+    newid = 0
+
+    utils.ensure_dir_exists(directory)
+    for file_number in range(files):
+        docs = []
+        for _ in range(docs_per_file):
+            newid += 1
+            length = max(1, int(rng.expovariate(1 / words_per_doc)))
+            body = ' '.join(rng.choices(vocabulary, weights, k=length))
+            title = ' '.join(rng.choices(vocabulary, weights, k=rng.randint(3, 10))).upper()
+            doc_topics = ''.join([f'<D>{t}</D>' for t in rng.sample(topics, rng.randint(0, 2))])
+            doc_places = ''.join([f'<D>{p}</D>' for p in rng.sample(places, rng.randint(1, 2))])
+            date = f'{rng.randint(1, 28):2}-{rng.choice(["FEB", "MAR", "APR"])}-1987 {rng.randint(0, 23):02}:{rng.randint(0, 59):02}:{rng.randint(0, 59):02}.{rng.randint(0, 99):02}'
+            docs.append(
+                f'<REUTERS TOPICS="YES" LEWISSPLIT="TRAIN" CGISPLIT="TRAINING-SET" OLDID="{newid + 5000}" NEWID="{newid}">\n'
+                f'<DATE>{date}</DATE>\n<TOPICS>{doc_topics}</TOPICS>\n<PLACES>{doc_places}</PLACES>\n'
+                f'<PEOPLE></PEOPLE>\n<ORGS></ORGS>\n<EXCHANGES></EXCHANGES>\n<COMPANIES></COMPANIES>\n'
+                f'<UNKNOWN> \n&#5;&#5;&#5;F\n&#22;&#22;&#1;f{newid:04}&#31;reute\nr f BC-SYNTHETIC 03-01 0001</UNKNOWN>\n'
+                f'<TEXT>&#2;\n<TITLE>{title}</TITLE>\n<DATELINE>    NEW YORK, March 1 - </DATELINE><BODY>{body}\n Reuter\n&#3;</BODY></TEXT>\n'
+                f'</REUTERS>\n'
+            )
+
+        with open(os.path.join(directory, f'reut2-{file_number:03}.sgm'), mode='w', encoding='UTF-8') as f:
+            f.write('<!DOCTYPE lewis SYSTEM "lewis.dtd">\n' + ''.join(docs))
+
+
+# ----------------------------------------------------------------------------
+# Timing
+# ----------------------------------------------------------------------------
+
+def timed(function: Callable, *args, repeat=1, setup: Callable = None) -> dict:
+    '''
+    Runs function(*args) <repeat> times with the progress output silenced and
+    returns the timings in seconds with the result of the last run. <setup>,
+    if given, builds fresh arguments for every run (for the stages that
+    modify their input).
+    '''
+    times = []
+    result = None
+    for _ in range(repeat):
+        run_args = setup() if setup != None else args
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = function(*run_args)
+            times.append(time.perf_counter() - start)
+
+    return {'median_s': statistics.median(times), 'min_s': min(times), 'runs': len(times), 'result': result}
+
+
+def without_result(timing: dict) -> dict:
+    return {key: value for key, value in timing.items() if key != 'result'}
+
+
+def query_latencies(sample: List[str], index) -> dict:
+    latencies = []
+    for term in sample:
+        start = time.perf_counter()
+        query.exec_query(term, index)
+        latencies.append(time.perf_counter() - start)
+    return instrumentation.latency_summary(latencies)
+
+
+def cold_start_latencies(sample: List[str], index_file: str) -> dict:
+    '''
+    Wall time of a whole query.py process per term of <sample>, interpreter
+    startup and imports included, as scripts calling it once per query see it.
+    '''
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query.py')
+    latencies = []
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = os.path.join(directory, 'queries.json')
+        for term in sample:
+            start = time.perf_counter()
+            subprocess.run([sys.executable, script, '-i', index_file, '-q', term, '-o', output_file],
+                           stdout=subprocess.DEVNULL, check=True, cwd=directory)
+            latencies.append(time.perf_counter() - start)
+    return instrumentation.latency_summary(latencies)
+
+
+def benchmark_pipeline(corpus_dir: str, repeat: int, query_count: int, seed: int, cold_starts=0) -> dict:
+    '''Times every stage, from the corpus files to the query latencies'''
+
+    results: Dict[str, dict] = {}
+
+    # indexing stages, each fed with the output of the previous one
+    timing = timed(indexer.unpack_corpus_step1, corpus_dir, repeat=repeat)
+    lines = timing['result']
+    results['unpack_corpus_step1'] = dict(without_result(timing), items=len(lines), bytes=sum([len(l) for l in lines]))
+
+    timing = timed(indexer.document_extracter, lines, repeat=repeat)
+    docs = timing['result']
+    results['document_extracter'] = dict(without_result(timing), items=len(docs))
+
+    timing = timed(indexer.generate_term_docID_pairs, docs, repeat=repeat)
+    pairs = timing['result']
+    results['generate_term_docID_pairs'] = dict(without_result(timing), items=len(pairs))
+
+    timing = timed(indexer.generate_inverted_index, pairs, repeat=repeat)
+    unsorted_index = timing['result']
+    results['generate_inverted_index'] = dict(without_result(timing), items=len(pairs))
+
+    timing = timed(indexer.sorted_postings, unsorted_index, repeat=repeat)
+    inverted_index = timing['result']
+    results['sorted_postings'] = dict(without_result(timing), items=len(inverted_index))
+
+    for name, result in results.items():
+        result['items_per_s'] = result['items'] / result['median_s'] if result['median_s'] else 0.0
+
+    # loading the index from disk
+    with tempfile.TemporaryDirectory() as directory:
+        index_file = os.path.join(directory, 'index.txt')
+        with contextlib.redirect_stdout(io.StringIO()):
+            utils.save_index_to_disk(inverted_index, index_file)
+        timing = timed(utils.load_index, index_file, repeat=repeat)
+        results['load_index'] = dict(without_result(timing), items=len(inverted_index), bytes=os.path.getsize(index_file))
+
+    # compression stages, each run on a fresh copy because they modify their input
+    with contextlib.redirect_stdout(io.StringIO()):
+        no_numbers = compressor.remove_numbers(dict(inverted_index))
+        case_folded = compressor.case_fold(dict(no_numbers))
+    stages = [
+        ('remove_numbers', compressor.remove_numbers, lambda: (dict(inverted_index),)),
+        ('case_fold', compressor.case_fold, lambda: (dict(no_numbers),)),
+        ('remove_stop_words_30', compressor.remove_stop_words, lambda: (dict(case_folded), compressor.stop_words[:30])),
+        ('remove_stop_words_150', compressor.remove_stop_words, lambda: (dict(case_folded), compressor.stop_words)),
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, function, setup in stages:
+            results[f'compressor.{name}'] = without_result(timed(function, repeat=repeat, setup=setup))
+
+    table = {'unfiltered': {
+        'tokens': {'number': len(inverted_index), 'delta %': 0.0, 'total %': 0.0},
+        'non-positional postings': {'number': sum([inverted_index[t][0] for t in inverted_index]), 'delta %': 0.0, 'total %': 0.0},
+        'compressed postings': compressor.compressed_size(inverted_index, 'vbyte'),
+    }}
+    results['compressor.update_table'] = without_result(timed(compressor.update_table, table, 'unfiltered', 'no numbers', no_numbers, repeat=repeat))
+    with contextlib.redirect_stdout(io.StringIO()):
+        results['compressor.compress'] = without_result(timed(compressor.compress, inverted_index, 'vbyte', repeat=repeat))
+
+    # query latency, terms sampled by document frequency plus some misses
+    rng = random.Random(seed)
+    terms = list(inverted_index)
+    weights = [inverted_index[t][0] for t in terms]
+    sample = rng.choices(terms, weights, k=query_count) if terms else []
+    sample += ['zzzz-missing-term'] * (query_count // 20)
+    rng.shuffle(sample)
+
+    results['exec_query'] = query_latencies(sample, inverted_index)
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_file = os.path.join(directory, 'index.bin')
+        text_index_file = os.path.join(directory, 'index.txt')
+        with contextlib.redirect_stdout(io.StringIO()):
+            utils.save_index_to_disk(inverted_index, index_file, binary=True, codec='vbyte')
+            utils.save_index_to_disk(inverted_index, text_index_file)
+        with binary_index.MmapIndex(index_file) as mapped_index:
+            results['exec_query.binary_vbyte'] = query_latencies(sample, mapped_index)
+
+        # a new query.py process per query
+        if cold_starts > 0:
+            results['query_cold_start'] = cold_start_latencies(sample[:cold_starts], text_index_file)
+            results['query_cold_start.binary_vbyte'] = cold_start_latencies(sample[:cold_starts], index_file)
+
+    return results
+
+
+def compare(old: dict, new: dict, threshold=REGRESSION_RATIO) -> str:
+    '''
+    Table of new / old ratios for every timing found in both results, the
+    ratios above <threshold> being flagged as regressions
+    '''
+
+    lines = [f'{"stage":40}{"metric":12}{"old":>14}{"new":>14}{"new/old":>10}']
+    for stage, metrics in new['stages'].items():
+        previous = old.get('stages', {}).get(stage)
+        if previous == None:
+            continue
+        for metric in ['median_s', 'p50_us', 'p95_us', 'p99_us']:
+            if metric in metrics and metric in previous and previous[metric]:
+                ratio = metrics[metric] / previous[metric]
+                flag = '  regression' if ratio > threshold else ''
+                lines.append(f'{stage:40}{metric:12}{previous[metric]:14.6f}{metrics[metric]:14.6f}{ratio:10.2f}{flag}')
+    return '\n'.join(lines)
+
+
+def run():
+    args = init_params()
+    utils.ensure_dir_exists('output')
+
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        if args.synthetic:
+            print(f'Generating a synthetic corpus of {args.files * args.docs_per_file} documents')
+            generate_synthetic_corpus(synthetic_dir, args.files, args.docs_per_file, args.words_per_doc, args.vocabulary, args.seed)
+            corpus = {'type': 'synthetic', 'files': args.files, 'docs_per_file': args.docs_per_file,
+                      'words_per_doc': args.words_per_doc, 'vocabulary': args.vocabulary, 'seed': args.seed}
+            corpus_dir = synthetic_dir
+        else:
+            corpus = {'type': 'directory', 'path': args.input_file}
+            corpus_dir = args.input_file
+
+        print(f'Benchmarking {corpus_dir}')
+        stages = benchmark_pipeline(corpus_dir, args.repeat, args.queries, args.seed, args.cold_starts)
+
+    results = {
+        'commit': instrumentation.git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'corpus': corpus,
+        'repeat': args.repeat,
+        'stages': stages,
+    }
+    utils.write_json_obj_2_disk(results, args.output_file, indentation=4)
+    print(f'\nResults written into {args.output_file}')
+
+    if args.compare != None:
+        print(compare(utils.load_json_from_disk(args.compare), results))
+
+
+if __name__ == '__main__':
+    run()
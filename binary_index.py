@@ -0,0 +1,185 @@
+'''
+Binary on-disk format for the inverted index. Unlike the JSON lines written by
+utils.write2disk, this file is opened with mmap and only the postings of the
+terms that are looked up get decoded, so opening the index costs the same
+whatever the size of the vocabulary.
+
+Layout of the file (every integer is little endian):
+
+    header              magic, version, codec id, term count, largest docID,
+                        offsets of each section
+    postings            postings of every term in term order, encoded with the
+                        codec of the header (see postings_codec)
+    frequencies         one uint32 per term
+    postings offsets    one uint64 per term + 1, relative to the postings section
+    term offsets        one uint64 per term + 1, relative to the terms section
+    terms               utf-8 bytes of every term, sorted and concatenated
+'''
+
+import mmap
+import struct
+import sys
+import bitset
+import postings_codec
+from array import array
+from collections.abc import Mapping
+from typing import Iterable, Iterator, List, Tuple
+
+MAGIC = b'NIIX'
+VERSION = 3
+
+HEADER = struct.Struct('<4sIIQQQQQQQ')  # magic, version, codec, term count, largest docID, then the offset of each section
+U32 = struct.Struct('<I')
+BIG_ENDIAN_HOST = sys.byteorder == 'big'
+
+
+def is_binary_index(filename: str) -> bool:
+    '''Returns True if <filename> starts with the magic bytes of this format.'''
+    with open(filename, mode='rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _packed(values: Iterable[int], typecode: str) -> bytes:
+    packed = array(typecode, values)
+    if BIG_ENDIAN_HOST:
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def write_binary_index(items: Iterable[Tuple[str, Tuple[int, List[int]]]], outfile: str, codec='raw') -> None:
+    '''
+    Writes <items>, an iterable of (term, (frequency, postings_list)) sorted by
+    term, into <outfile>. Postings are streamed to disk as they come, only the
+    terms and the offset tables are kept in memory until the end. <codec> is
+    one of postings_codec.CODECS.
+    '''
+    encode = postings_codec.CODECS[codec][0]
+    terms: List[bytes] = []
+    frequencies = array('I')
+    postings_offsets = array('Q', [0])
+
+    with open(outfile, mode='wb') as f:
+        f.write(b'\0' * HEADER.size)  # placeholder, rewritten once every section is known
+
+        postings_start = f.tell()
+        previous = None
+        doc_count = 0
+        for term, (frequency, postings_list) in items:
+            assert previous is None or previous < term, f'Terms must be unique and sorted, got {previous} before {term}'
+            previous = term
+
+            terms.append(term.encode('UTF-8'))
+            frequencies.append(frequency)
+            if len(postings_list):
+                last = postings_list[-1]
+                doc_count = max(doc_count, last[0] if isinstance(last, tuple) else last)  # positional postings are (docID, positions)
+            encoded: bytes = encode(postings_list)
+            f.write(encoded)
+            postings_offsets.append(postings_offsets[-1] + len(encoded))
+
+        term_offsets = array('Q', [0])
+        for term in terms:
+            term_offsets.append(term_offsets[-1] + len(term))
+
+        frequencies_start = f.tell()
+        f.write(_packed(frequencies, 'I'))
+        postings_offsets_start = f.tell()
+        f.write(_packed(postings_offsets, 'Q'))
+        term_offsets_start = f.tell()
+        f.write(_packed(term_offsets, 'Q'))
+        terms_start = f.tell()
+        f.write(b''.join(terms))
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, postings_codec.codec_id(codec), len(terms), doc_count, postings_start, frequencies_start,
+                            postings_offsets_start, term_offsets_start, terms_start))
+
+
+class MmapIndex(Mapping):
+    '''
+    Read only view over a file written by write_binary_index. It behaves like
+    the Dict[str, Tuple[int, List[int]]] returned by utils.load_index, so
+    query.exec_query can use it as is.
+    '''
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._file = open(filename, mode='rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, codec, self._count, self.doc_count, self._postings, self._frequencies, self._postings_offsets, \
+            self._term_offsets, self._terms = HEADER.unpack_from(self._mm, 0)
+
+        assert magic == MAGIC, f'{filename} is not a binary inverted index'
+        assert version == VERSION, f'{filename} uses version {version} of the format, expected {VERSION}'
+
+        self.codec: str = postings_codec.codec_name(codec)
+        self._decode = postings_codec.CODECS[self.codec][1]
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _term(self, i: int) -> str:
+        start, end = struct.unpack_from('<QQ', self._mm, self._term_offsets + 8 * i)
+        return self._mm[self._terms + start:self._terms + end].decode('UTF-8')
+
+    def _find(self, term: str) -> int:
+        '''Binary search over the sorted terms, returns the term number or -1.'''
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < self._count and self._term(lo) == term:
+            return lo
+        return -1
+
+    def _entry(self, i: int) -> Tuple[int, List[int]]:
+        frequency: int = U32.unpack_from(self._mm, self._frequencies + 4 * i)[0]
+        start, end = struct.unpack_from('<QQ', self._mm, self._postings_offsets + 8 * i)
+        return (frequency, self._decode(self._mm[self._postings + start:self._postings + end]))
+
+    def __contains__(self, term) -> bool:
+        return isinstance(term, str) and self._find(term) >= 0
+
+    def hybrid_postings(self, term: str) -> bitset.Postings:
+        '''
+        Postings of <term> for boolean_query. With the hybrid codec the dense
+        lists come as a bitset straight from their bytes, without building
+        the list of their docIDs.
+        '''
+        i = self._find(term) if isinstance(term, str) else -1
+        if i < 0:
+            raise KeyError(term)
+        if self.codec != 'hybrid':
+            return self._entry(i)[1]
+
+        start, end = struct.unpack_from('<QQ', self._mm, self._postings_offsets + 8 * i)
+        return postings_codec.hybrid_decode_postings(self._mm[self._postings + start:self._postings + end])
+
+    def __getitem__(self, term: str) -> Tuple[int, List[int]]:
+        i = self._find(term) if isinstance(term, str) else -1
+        if i < 0:
+            raise KeyError(term)
+        return self._entry(i)
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self._count):
+            yield self._term(i)
+
+    def items(self) -> Iterator[Tuple[str, Tuple[int, List[int]]]]:
+        for i in range(self._count):
+            yield self._term(i), self._entry(i)
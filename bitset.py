@@ -0,0 +1,128 @@
+'''
+Hybrid postings, in the spirit of roaring bitmaps. A postings list covering a
+large fraction of the collection (the, of, said...) costs about a byte per
+document as variable byte gaps but a single bit per document of the collection
+as a bitset, so each list is stored as whichever is smaller, chosen per term
+when the index is written (see postings_codec.hybrid_encode). Lists shorter
+than MIN_POSTINGS always stay sparse: a short list at the start of the docID
+range can be smaller as a bitset, but merging it is cheaper than turning the
+other operands of an OR into bitsets.
+
+A bitset is a python int whose bit docID is set for every docID of the list.
+Set operations between two bitsets are single bitwise operations over the
+machine words of the ints, between a bitset and a sorted list they test the
+bits of the list's docIDs, and two lists are still merged by boolean_query.
+'''
+
+from typing import Iterable, Iterator, List, Union
+
+MIN_POSTINGS = 256
+
+# docIDs of the bits set in every byte value, to turn a bitset back into a list a byte at a time
+BYTE_BITS = [[bit for bit in range(8) if byte >> bit & 1] for byte in range(256)]
+
+
+def from_docIDs(docIDs: Iterable[int]) -> int:
+    bits = bytearray()
+    for docID in docIDs:
+        if docID >> 3 >= len(bits):
+            bits += bytes((docID >> 3) - len(bits) + 1)
+        bits[docID >> 3] |= 1 << (docID & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def to_bytes(bits: int) -> bytes:
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def docIDs(bits: int) -> List[int]:
+    '''Sorted docIDs whose bit is set in <bits>'''
+    postings_list = []
+    for i, byte in enumerate(to_bytes(bits)):
+        if byte:
+            base = i * 8
+            postings_list += [base + bit for bit in BYTE_BITS[byte]]
+    return postings_list
+
+
+def filter_postings(postings_list: Iterable[int], bits: int) -> List[int]:
+    '''Postings of <postings_list> whose bit is set in <bits>'''
+    data = to_bytes(bits)
+    return [docID for docID in postings_list if docID >> 3 < len(data) and data[docID >> 3] >> (docID & 7) & 1]
+
+
+class Bitset:
+    '''Postings list held as a bitset, see the module docstring'''
+
+    __slots__ = ('bits',)
+
+    def __init__(self, bits: int):
+        self.bits = bits
+
+    @classmethod
+    def from_postings(cls, postings_list: Iterable[int]) -> 'Bitset':
+        return cls(from_docIDs(postings_list))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Bitset':
+        return cls(int.from_bytes(data, 'little'))
+
+    def to_bytes(self) -> bytes:
+        return to_bytes(self.bits)
+
+    def postings(self) -> List[int]:
+        return docIDs(self.bits)
+
+    def __len__(self) -> int:
+        return bin(self.bits).count('1')
+
+    def __bool__(self) -> bool:
+        return self.bits != 0
+
+    def __contains__(self, docID: int) -> bool:
+        return docID >= 0 and self.bits >> docID & 1 == 1
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.postings())
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Bitset) and self.bits == other.bits
+
+    def __repr__(self) -> str:
+        return f'Bitset({self.postings()})'
+
+
+Postings = Union[List[int], Bitset]
+
+
+def as_list(postings: Postings) -> List[int]:
+    return postings.postings() if isinstance(postings, Bitset) else postings
+
+
+def as_bits(postings: Postings) -> int:
+    return postings.bits if isinstance(postings, Bitset) else from_docIDs(postings)
+
+
+def intersect(p1: Postings, p2: Postings) -> Postings:
+    '''Intersection where at least one operand is a Bitset'''
+    if isinstance(p1, Bitset) and isinstance(p2, Bitset):
+        return Bitset(p1.bits & p2.bits)
+    if isinstance(p1, Bitset):
+        p1, p2 = p2, p1
+    return filter_postings(p1, p2.bits)  # the sparse operand keeps its representation
+
+
+def union(postings_lists: List[Postings]) -> Bitset:
+    '''Union where at least one operand is a Bitset'''
+    bits = 0
+    for postings in postings_lists:
+        bits |= as_bits(postings)
+    return Bitset(bits)
+
+
+def difference(p1: Postings, p2: Postings) -> Postings:
+    '''Postings of <p1> that are not in <p2>, where at least one operand is a Bitset'''
+    if isinstance(p1, Bitset):
+        return Bitset(p1.bits & ~as_bits(p2))
+    data = to_bytes(p2.bits)
+    return [docID for docID in p1 if docID >> 3 >= len(data) or not data[docID >> 3] >> (docID & 7) & 1]
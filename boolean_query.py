@@ -0,0 +1,281 @@
+'''
+Boolean queries over the inverted index, e.g. "oil AND (prices OR rates) AND
+NOT opec". Terms next to each other without an operator are ANDed. Operators
+are upper case so that the lower case words and, or, not can still be queried.
+With a positional index (see positional.py), "interest rates" matches the
+phrase and oil /3 prices matches documents where both words are at most 3
+tokens apart. Filters (topic:grain, place:usa, date:1987-03, see fields.py)
+are operands like terms, e.g. "(oil OR gas) AND NOT place:usa", whose
+documents are given by the doc values of the index.
+
+Conjunctions are evaluated smallest document frequency first and postings are
+intersected with a linear merge that follows skip pointers. Skip pointers sit
+every sqrt(L) postings of a list of length L, so their positions follow from
+the length of the list and nothing more has to be stored per term.
+
+Indexes written with the hybrid codec give the postings of dense terms as
+bitsets (see bitset.py), which are combined with bitwise operations instead.
+'''
+
+import heapq
+import math
+import re
+import bitset
+import fields
+import instrumentation
+import positional
+from typing import Dict, List, Tuple, Union
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+Node = Union[Tuple[str, str], Tuple[str, list]]  # ('term', token) | ('phrase', [tokens]) | ('near', [token, token, k]) | ('filter', [field, value]) | ('and', [nodes]) | ('or', [nodes]) | ('not', [node])
+PROXIMITY = re.compile(r'/(\d+)')
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+def lex(query: str) -> List[str]:
+    '''Splits <query> into parentheses, operators, quoted phrases and terms'''
+    return re.findall(r'"[^"]*"|[()]|[^\s()"]+', query)
+
+
+def parse(query: str) -> Node:
+    '''
+    Recursive descent parser for:
+        expr     := and_expr (OR and_expr)*
+        and_expr := not_expr ([AND] not_expr)*
+        not_expr := NOT not_expr | '(' expr ')' | "phrase" | field:value | term [/k term]
+    '''
+    tokens = lex(query)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def advance():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def expr() -> Node:
+        children = [and_expr()]
+        while peek() == 'OR':
+            advance()
+            children.append(and_expr())
+        return children[0] if len(children) == 1 else ('or', children)
+
+    def and_expr() -> Node:
+        children = [not_expr()]
+        while peek() not in (None, 'OR', ')'):
+            if peek() == 'AND':
+                advance()
+            children.append(not_expr())
+        return children[0] if len(children) == 1 else ('and', children)
+
+    def not_expr() -> Node:
+        token = peek()
+        if token == None:
+            raise QuerySyntaxError(f'Unexpected end of query <{query}>')
+        if token == 'NOT':
+            advance()
+            return ('not', [not_expr()])
+        if token == '(':
+            advance()
+            node = expr()
+            if peek() != ')':
+                raise QuerySyntaxError(f'Missing closing parenthesis in <{query}>')
+            advance()
+            return node
+        if token in OPERATORS or token == ')' or PROXIMITY.fullmatch(token):
+            raise QuerySyntaxError(f'Unexpected {token} in <{query}>')
+        if token.startswith('"'):
+            advance()
+            return ('phrase', token.strip('"').split())
+
+        term = advance()
+        match = fields.FILTER.fullmatch(term)
+        if match:
+            return ('filter', [match.group(1), match.group(2)])
+        if peek() != None and PROXIMITY.fullmatch(peek()):
+            k = int(PROXIMITY.fullmatch(advance()).group(1))
+            other = peek()
+            if other == None or other in OPERATORS or other in '()' or other.startswith('"') or PROXIMITY.fullmatch(other):
+                raise QuerySyntaxError(f'/{k} must be between two terms in <{query}>')
+            return ('near', [term, advance(), k])
+        return ('term', term)
+
+    node = expr()
+    if peek() != None:
+        raise QuerySyntaxError(f'Unexpected {peek()} in <{query}>')
+    return node
+
+
+def skip_length(postings_list: List[int]) -> int:
+    return int(math.sqrt(len(postings_list)))
+
+
+def intersect(p1: bitset.Postings, p2: bitset.Postings) -> bitset.Postings:
+    '''Linear merge intersection of two sorted postings lists using skip pointers'''
+
+    if isinstance(p1, bitset.Bitset) or isinstance(p2, bitset.Bitset):
+        return bitset.intersect(p1, p2)
+
+    answer = []
+    skip1, skip2 = skip_length(p1), skip_length(p2)
+    i = j = 0
+
+    while i < len(p1) and j < len(p2):
+        if p1[i] == p2[j]:
+            answer.append(p1[i])
+            i += 1
+            j += 1
+
+        elif p1[i] < p2[j]:
+            if skip1 > 1 and i % skip1 == 0 and i + skip1 < len(p1) and p1[i + skip1] <= p2[j]:
+                while i % skip1 == 0 and i + skip1 < len(p1) and p1[i + skip1] <= p2[j]:
+                    i += skip1
+            else:
+                i += 1
+
+        else:
+            if skip2 > 1 and j % skip2 == 0 and j + skip2 < len(p2) and p2[j + skip2] <= p1[i]:
+                while j % skip2 == 0 and j + skip2 < len(p2) and p2[j + skip2] <= p1[i]:
+                    j += skip2
+            else:
+                j += 1
+
+    return answer
+
+
+def union(postings_lists: List[bitset.Postings]) -> bitset.Postings:
+    '''Linear k-way merge of sorted postings lists without duplicates'''
+
+    if any([isinstance(postings, bitset.Bitset) for postings in postings_lists]):
+        return bitset.union(postings_lists)
+
+    answer = []
+    for docID in heapq.merge(*postings_lists):
+        if not answer or answer[-1] != docID:
+            answer.append(docID)
+    return answer
+
+
+def difference(p1: bitset.Postings, p2: bitset.Postings) -> bitset.Postings:
+    '''Postings of <p1> that are not in <p2>, with a linear merge'''
+
+    if isinstance(p1, bitset.Bitset) or isinstance(p2, bitset.Bitset):
+        return bitset.difference(p1, p2)
+
+    answer = []
+    j = 0
+    for docID in p1:
+        while j < len(p2) and p2[j] < docID:
+            j += 1
+        if j == len(p2) or p2[j] != docID:
+            answer.append(docID)
+    return answer
+
+
+def all_documents(index, docvalues=None) -> List[int]:
+    '''
+    The docIDs of the collection, needed to negate a postings list. DocIDs are
+    numbered from 1 by the indexer, binary indexes store the largest one,
+    doc values have a row per document and segmented indexes know which
+    documents were deleted.
+    '''
+    if hasattr(index, 'live_documents'):
+        return index.live_documents()
+
+    doc_count = getattr(index, 'doc_count', None)
+    if doc_count == None and docvalues != None:
+        doc_count = docvalues.doc_count
+    if doc_count == None:
+        doc_count = max([postings_list[-1] for _, postings_list in index.values() if postings_list], default=0)
+    return list(range(1, doc_count + 1))
+
+
+def term_postings(token: str, index) -> bitset.Postings:
+    if token not in index:
+        return []
+    if hasattr(index, 'hybrid_postings'):
+        return index.hybrid_postings(token)
+    return list(index[token][1])
+
+
+def estimated_frequency(node: Node, index) -> int:
+    '''Document frequency of a term, as stored in element 0 of its entry, or an upper bound for subqueries'''
+
+    kind, value = node
+    if kind == 'term':
+        return index[value][0] if value in index else 0
+    if kind in ('phrase', 'near'):
+        return min([estimated_frequency(('term', token), index) for token in value if isinstance(token, str)], default=0)
+    if kind == 'and':
+        return min([estimated_frequency(child, index) for child in value if child[0] != 'not'], default=math.inf)
+    if kind == 'or':
+        return sum([estimated_frequency(child, index) for child in value])
+    return math.inf
+
+
+def evaluate(node: Node, index, positional_index=None, docvalues=None) -> bitset.Postings:
+    '''Sorted postings list (or Bitset) matching the parsed query <node>'''
+
+    kind, value = node
+
+    if kind == 'term':
+        return term_postings(value, index)
+
+    if kind == 'filter':
+        if docvalues == None:
+            raise ValueError('No doc values were built next to the index, see indexer.py --fields')
+        return bitset.Bitset(fields.filter_bitmap([tuple(value)], docvalues))
+
+    if kind in ('phrase', 'near'):
+        if getattr(index, 'tombstones', None) != None:  # segments.SegmentedIndex, maybe behind a cache.CachedIndex
+            raise ValueError('Phrase and proximity queries are not supported on a segment directory, its segments carry no positions')
+        if positional_index == None:
+            raise ValueError('Phrase and proximity queries need the positional index, see indexer.py --positional')
+        if kind == 'phrase':
+            return positional.phrase(value, positional_index)
+        return positional.near(value[0], value[1], value[2], positional_index)
+
+    if kind == 'or':
+        return union([evaluate(child, index, positional_index, docvalues) for child in value])
+
+    if kind == 'not':
+        return difference(all_documents(index, docvalues), evaluate(value[0], index, positional_index, docvalues))
+
+    # and: intersect the positive operands smallest first, then remove the negated ones
+    positives = sorted([child for child in value if child[0] != 'not'], key=lambda child: estimated_frequency(child, index))
+    negatives = [child[1][0] for child in value if child[0] == 'not']
+
+    if positives:
+        answer = evaluate(positives[0], index, positional_index, docvalues)
+        for child in positives[1:]:
+            if not answer:
+                break
+            answer = intersect(answer, evaluate(child, index, positional_index, docvalues))
+    else:
+        answer = all_documents(index, docvalues)
+
+    for child in negatives:
+        if not answer:
+            break
+        answer = difference(answer, evaluate(child, index, positional_index, docvalues))
+
+    return answer
+
+
+@instrumentation.instrumented('query.boolean')
+def exec_boolean_query(query: str, index, positional_index=None, docvalues=None) -> Dict[str, dict]:
+    '''Same result format as query.exec_query, <docvalues> (see fields.py) answer the filters of <query>'''
+
+    postings_list = bitset.as_list(evaluate(parse(query), index, positional_index, docvalues))
+
+    return {
+        query: {'frequency': len(postings_list),
+                'postings': postings_list,
+                'message': 'successful' if postings_list else 'unsuccessful'}
+    }
@@ -0,0 +1,230 @@
+'''
+Bounded in-memory caches in front of the index, for the long running server.
+Query traffic is skewed towards a few hundred terms, so keeping their decoded
+postings lists and the results of the compound queries that use them saves
+decoding (or reading from disk) the same postings over and over.
+
+Entries are evicted once the estimated size of the cache goes over its memory
+budget, either the least recently used (lru) or the least frequently used
+(lfu, ties broken by recency). Every cache counts its hits, misses and
+evictions. Caches don't know where the index comes from, the owner clears them
+when <index_mtime> says the index file changed (see server.QueryService).
+Clearing a cache starts a new generation, and values computed from the index
+of an earlier generation are not stored, so a query still running on the
+previous index cannot put its stale result back after the cache was cleared.
+'''
+
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Callable, Dict, Hashable, Iterator, List, Tuple
+import bitset
+
+# Rough cost of the python objects held by an entry, used against the memory budget
+ENTRY_OVERHEAD = 200  # cache slots, key and entry tuple
+POSTING_OVERHEAD = 36  # list slot and boxed int
+
+POLICIES = ['lru', 'lfu']
+MISSING = object()
+
+
+def postings_size(postings_count: int) -> int:
+    '''Estimated size in bytes of an entry holding <postings_count> docIDs'''
+    return ENTRY_OVERHEAD + POSTING_OVERHEAD * postings_count
+
+
+def result_size(result: Dict[str, dict]) -> int:
+    '''Estimated size in bytes of a query result, as returned by query.exec_query'''
+    return sum([postings_size(len(hits['postings'])) for hits in result.values()])
+
+
+def index_mtime(filename: str) -> float:
+    '''
+    Last modification of the index stored in <filename>. A segment directory
+    changes when its manifest or tombstones are rewritten.
+    '''
+    if os.path.isdir(filename):
+        import segments
+        paths = [os.path.join(filename, segments.MANIFEST), os.path.join(filename, segments.TOMBSTONES)]
+        return max([os.stat(path).st_mtime_ns for path in paths if os.path.exists(path)], default=0)
+
+    return os.stat(filename).st_mtime_ns
+
+
+class Cache:
+    '''Thread safe key -> value cache holding at most <memory_budget> bytes of entries'''
+
+    def __init__(self, memory_budget: int, policy='lru'):
+        assert policy in POLICIES, f'Unknown cache policy {policy}'
+        self.memory_budget = memory_budget
+        self.policy = policy
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self.generation = 0  # number of clears, see the module docstring
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, Tuple[object, int]] = {}  # key -> (value, size)
+        self._recency: OrderedDict = OrderedDict()  # lru: keys from the least to the most recently used
+        self._counts: Dict[Hashable, int] = {}  # lfu: key -> number of uses
+        self._buckets: Dict[int, OrderedDict] = {}  # lfu: number of uses -> keys from the least to the most recently used
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        '''Whether <key> is cached, without counting a lookup'''
+        return key in self._entries
+
+    def _touch(self, key: Hashable) -> None:
+        if self.policy == 'lru':
+            self._recency.move_to_end(key)
+            return
+
+        count = self._counts[key]
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+        self._counts[key] = count + 1
+        self._buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+    def _victim(self) -> Hashable:
+        if self.policy == 'lru':
+            return next(iter(self._recency))
+        return next(iter(self._buckets[min(self._buckets)]))
+
+    def _remove(self, key: Hashable) -> None:
+        _, size = self._entries.pop(key)
+        self.size -= size
+
+        if self.policy == 'lru':
+            del self._recency[key]
+            return
+
+        count = self._counts.pop(key)
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+
+    def get(self, key: Hashable, default=MISSING):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._touch(key)
+            return self._entries[key][0]
+
+    def put(self, key: Hashable, value, size: int, generation=None) -> None:
+        '''Stores <value>, unless it was computed in a <generation> before the last clear'''
+        with self._lock:
+            if generation != None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            if size > self.memory_budget:
+                return  # would evict everything and still not fit
+
+            while self.size + size > self.memory_budget:
+                self._remove(self._victim())
+                self.evictions += 1
+
+            self._entries[key] = (value, size)
+            self.size += size
+            if self.policy == 'lru':
+                self._recency[key] = None
+            else:
+                self._counts[key] = 1
+                self._buckets.setdefault(1, OrderedDict())[key] = None
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], object], size: Callable[[object], int], generation=None):
+        '''
+        Cached value of <key>, computed with <compute> and stored on a miss.
+        <generation> is that of the index <compute> reads, the current one
+        when not given.
+        '''
+        if generation == None:
+            generation = self.generation
+        elif generation != self.generation:
+            return compute()  # the index was reloaded since, its entries are gone
+
+        value = self.get(key)
+        if value is MISSING:
+            value = compute()
+            self.put(key, value, size(value), generation)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._recency.clear()
+            self._counts.clear()
+            self._buckets.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'policy': self.policy,
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'memory_budget': self.memory_budget,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class CachedIndex(Mapping):
+    '''
+    Index whose entries go through <cache>, so hot terms are decoded once.
+    Everything else (doc_count, live_documents, close...) is the wrapped
+    index's, so it is used wherever the index is.
+    '''
+
+    def __init__(self, index, cache: Cache):
+        self.index = index
+        self.cache = cache
+        self.generation = cache.generation  # entries of this index are dropped once the cache is cleared
+
+    def __getattr__(self, name: str):
+        return getattr(self.index, name)
+
+    def __getitem__(self, term: str) -> Tuple[int, List[int]]:
+        if self.generation != self.cache.generation:  # the cache holds the entries of a newer index
+            return self.index[term]
+        entry = self.cache.get(term)
+        if entry is MISSING:
+            entry = self.index[term]  # raises KeyError for missing terms, which are not cached
+            self.cache.put(term, entry, postings_size(len(entry[1])), self.generation)
+        return entry
+
+    def hybrid_postings(self, term: str) -> bitset.Postings:
+        '''
+        Postings of <term> for boolean_query (a list or a Bitset, see
+        binary_index.MmapIndex.hybrid_postings), cached next to the entries.
+        Lists are copied out of the cache, boolean_query owns what it gets.
+        '''
+        if not hasattr(self.index, 'hybrid_postings'):
+            return list(self[term][1])
+        if self.generation != self.cache.generation:
+            return self.index.hybrid_postings(term)
+
+        postings = self.cache.get(('hybrid', term))
+        if postings is MISSING:
+            postings = self.index.hybrid_postings(term)  # raises KeyError for missing terms, which are not cached
+            size = ENTRY_OVERHEAD + postings.bits.bit_length() // 8 if isinstance(postings, bitset.Bitset) else postings_size(len(postings))
+            self.cache.put(('hybrid', term), postings, size, self.generation)
+        return postings if isinstance(postings, bitset.Bitset) else list(postings)
+
+    def __contains__(self, term) -> bool:
+        return (self.generation == self.cache.generation and term in self.cache) or term in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
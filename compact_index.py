@@ -0,0 +1,116 @@
+'''
+Compact in-memory inverted index, for the processes that hold the index for a
+long time (server.py, compressor.py). The Dict[str, Tuple[int, List[int]]]
+returned by utils.load_index costs a boxed int (28 bytes) and a list slot (8
+bytes) per posting, CompactIndex stores every docID in 4 bytes:
+
+    terms               sorted list of the terms, the position of a term is its ID
+    term_ids            term -> ID
+    frequencies         array('I'), one per term ID
+    offsets             array('Q'), where the postings of every term ID start
+                        in <postings>, plus the end of the last one
+    postings            array('I') holding the postings lists of all terms
+                        back to back, in term order
+
+It is a MutableMapping returning the same (frequency, postings list) entries as
+the dict, so query.exec_query and the compressor steps use it as is. Entries
+set after the build live in a small dict of arrays until <compact> packs them
+into the buffers.
+'''
+
+import heapq
+from array import array
+from collections.abc import MutableMapping
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+class CompactIndex(MutableMapping):
+
+    def __init__(self, items: Iterable[Tuple[str, Tuple[int, List[int]]]] = ()):
+        '''Builds the index from (term, (frequency, postings list)) <items>, in any order'''
+        self._build(sorted(items, key=lambda item: item[0]))
+
+    @classmethod
+    def from_sorted_items(cls, items: Iterable[Tuple[str, Tuple[int, List[int]]]]):
+        '''Same as the constructor for <items> already sorted by term, which are then streamed'''
+        index = cls.__new__(cls)
+        index._build(items)
+        return index
+
+    def _build(self, items: Iterable[Tuple[str, Tuple[int, List[int]]]]) -> None:
+        self.terms: List[str] = []
+        self.term_ids: Dict[str, int] = {}
+        self.frequencies = array('I')
+        self.offsets = array('Q', [0])
+        self.postings = array('I')
+        self.updates: Dict[str, Tuple[int, array]] = {}  # terms set since the last build, see <compact>
+        self._doc_count = 0  # largest docID in the buffers, None once a term of the buffers was removed
+
+        for term, (frequency, postings_list) in items:
+            assert not self.terms or self.terms[-1] < term, f'terms must be unique and sorted, got {term} after {self.terms[-1]}'
+            self.term_ids[term] = len(self.terms)
+            self.terms.append(term)
+            self.frequencies.append(frequency)
+            self.postings.extend(postings_list)
+            self.offsets.append(len(self.postings))
+            if postings_list:
+                self._doc_count = max(self._doc_count, postings_list[-1])
+
+    def compact(self) -> None:
+        '''Packs the entries set since the last build into the contiguous buffers'''
+        if self.updates or len(self.term_ids) < len(self.terms):
+            self._build([(term, self._entry(term)) for term in self])
+
+    def copy(self):
+        '''Shallow copy, the buffers are never modified in place so they are shared'''
+        index = CompactIndex.__new__(CompactIndex)
+        index.__dict__.update(self.__dict__)
+        index.term_ids = dict(self.term_ids)
+        index.updates = dict(self.updates)
+        return index
+
+    @property
+    def doc_count(self) -> int:
+        '''Largest docID of the terms still in the index, used by boolean_query.all_documents'''
+        if self._doc_count == None:
+            self._doc_count = max([self.postings[self.offsets[i + 1] - 1] for i in self.term_ids.values() if self.offsets[i + 1] > self.offsets[i]], default=0)
+        return max([self._doc_count] + [postings[-1] for _, postings in self.updates.values() if postings])
+
+    def memory_size(self) -> int:
+        '''Bytes held by the postings buffers, the terms themselves excluded'''
+        size = sum(buffer.itemsize * len(buffer) for buffer in (self.frequencies, self.offsets, self.postings))
+        return size + sum(postings.itemsize * len(postings) for _, postings in self.updates.values())
+
+    def _entry(self, term: str) -> Tuple[int, array]:
+        if term in self.updates:
+            return self.updates[term]
+        i = self.term_ids[term]
+        return self.frequencies[i], self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, term: str) -> Tuple[int, List[int]]:
+        frequency, postings = self._entry(term)
+        return frequency, postings.tolist()
+
+    def __setitem__(self, term: str, entry: Tuple[int, List[int]]) -> None:
+        if self.term_ids.pop(term, None) != None:  # its slot in the buffers is dead until the next build
+            self._doc_count = None
+        frequency, postings_list = entry
+        self.updates[term] = (frequency, array('I', postings_list))
+
+    def __delitem__(self, term: str) -> None:
+        if term in self.updates:
+            del self.updates[term]
+        else:
+            del self.term_ids[term]
+            self._doc_count = None
+
+    def __contains__(self, term) -> bool:
+        return term in self.updates or term in self.term_ids
+
+    def __len__(self) -> int:
+        return len(self.term_ids) + len(self.updates)
+
+    def __iter__(self) -> Iterator[str]:
+        '''Terms in sorted order, the ones set since the build merged with the ones of the buffers'''
+        built = (term for i, term in enumerate(self.terms) if self.term_ids.get(term) == i)
+        yield from heapq.merge(built, sorted(self.updates))
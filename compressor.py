@@ -1,14 +1,24 @@
 '''
 This script will compress and optimize the index.
 DISCLAIMER: these functions will modify the argument index so pass a deep copy if you wish to maintain. The
-reason being that performing a copy at each step is very inefficient.
+reason being that performing a copy at each step is very inefficient. <compress>,
+used by run(), does all the steps in a single pass and leaves its argument as is.
 '''
 
 import utils
+import binary_index
+import cache
+import instrumentation
+import postings_codec
 import re
 import argparse
-from typing import Tuple
+import heapq
+import itertools
+import os
+import tempfile
+from typing import Dict, Iterable, List, Tuple
 import json
+from tqdm import tqdm
 
 
 stop_words = ('the', 'be', 'of', 'and', 'a', 'to', 'in', 'he', 'have', 'it', 'that', 'for', 'they', 'I', 'with', 'as', 'not', 'on', 'she', 'at', 'by', 'this', 'we', 'you', 'do', 'but', 'from', 'or', 'which', 'one', 'would', 'all', 'will', 'there', 'say', 'who', 'make', 'when', 'can', 'more', 'if', 'no', 'man', 'out', 'other', 'so', 'what', 'time', 'up', 'go', 'about', 'than', 'into', 'could', 'state', 'only', 'new', 'year', 'some', 'take', 'come', 'these', 'know', 'see', 'use', 'get', 'like', 'then', 'first', 'any', 'work', 'now', 'may', 'such', 'give', 'over', 'think', 'most', 'even', 'find', 'day',
@@ -21,11 +31,18 @@ def init_params():
     parser = argparse.ArgumentParser(description='Process command line arguments')
     parser.add_argument('-i', '--input_file', default='output/inverted_index.txt', help='Input file')
     parser.add_argument('-o', '--output_file', default='output/compressed_index.txt', help='Output file')  # Does not include any directory names, strictly the filenames
+    parser.add_argument('-b', '--binary', action='store_true', help='Write the index in the memory mapped binary format')
+    parser.add_argument('--compact', action='store_true', help='Hold the index in the compact array based representation')
+    parser.add_argument('--stream', action='store_true', help='Stream the index from disk through sorted runs instead of loading it, for indexes that do not fit in memory')
+    parser.add_argument('--memory_budget', type=int, default=64, help='With --stream, size of the case variants buffered before writing a sorted run, in MB')
+    parser.add_argument('-c', '--codec', default='vbyte', choices=postings_codec.DOCID_CODECS, help='Postings codec used for the size columns and the binary format')
+    instrumentation.add_arguments(parser)
     args = parser.parse_args()
 
     return args
 
 
+@instrumentation.instrumented('compressor.remove_numbers')
 def remove_numbers(index: dict) -> dict:
     '''Removes all tokens that are numbers.'''
 
@@ -44,6 +61,18 @@ def remove_numbers(index: dict) -> dict:
     return index
 
 
+def merge_postings(postings_lists: Iterable[List[int]]) -> List[int]:
+    '''Linear k-way merge of sorted postings lists, without duplicates'''
+
+    merged: List[int] = []
+    for docID in heapq.merge(*postings_lists):
+        if not merged or merged[-1] != docID:
+            merged.append(docID)
+
+    return merged
+
+
+@instrumentation.instrumented('compressor.case_fold')
 def case_fold(index: dict) -> dict:
     '''Lower cases all tokens'''
 
@@ -57,7 +86,7 @@ def case_fold(index: dict) -> dict:
             postings_list1 = index[token.lower()][1]
             postings_list2 = index[token][1]
 
-            merged_postings_list = sorted(list(set(postings_list1).union(set(postings_list2))))
+            merged_postings_list = merge_postings([postings_list1, postings_list2])
             freq = len(merged_postings_list)
             index[token.lower()] = (freq, merged_postings_list)
 
@@ -69,11 +98,12 @@ def case_fold(index: dict) -> dict:
     return index
 
 
+@instrumentation.instrumented('compressor.remove_stop_words')
 def remove_stop_words(index: dict, stopwords: Tuple[str]) -> dict:
     '''This function removes stopwords from the index'''
 
     print(f'\nRemoving {len(stopwords)} from the index...')
-    to_remove = [t for t in index if t in stop_words]
+    to_remove = [t for t in index if t in stopwords]
 
     for token in to_remove:
         del index[token]
@@ -81,7 +111,44 @@ def remove_stop_words(index: dict, stopwords: Tuple[str]) -> dict:
     return index
 
 
-def update_table(table: dict, oldname: str, newname: str, newindex: dict) -> dict:
+def number_filter(token: str):
+    '''Token normalizer of <remove_numbers>, see pipeline.py'''
+    return None if token.isnumeric() else token
+
+
+def stop_word_filter(stopwords: Tuple[str]):
+    '''Token normalizer of <remove_stop_words>, see pipeline.py'''
+    stopwords = frozenset(stopwords)
+
+    def stop_word_filter(token: str):
+        return None if token in stopwords else token
+
+    return stop_word_filter
+
+
+# Token level versions of the steps of <run>, applied while indexing with indexer.py --normalize
+NORMALIZERS = {
+    'numbers': number_filter,
+    'case_fold': str.lower,
+    'stop_words_30': stop_word_filter(stop_words[:30]),
+    'stop_words_150': stop_word_filter(stop_words),
+}
+
+
+def compressed_size(index: dict, codec: str) -> dict:
+    '''Size of the postings of <index> once encoded with <codec>'''
+
+    encode = postings_codec.CODECS[codec][0]
+    total_bytes = sum([len(encode(index[token][1])) for token in index])
+    total_postings = sum([index[token][0] for token in index])
+
+    return {
+        'bytes': total_bytes,
+        'bytes/posting': round(total_bytes / total_postings, 2) if total_postings else 0.0,
+    }
+
+
+def update_table(table: dict, oldname: str, newname: str, newindex: dict, codec='vbyte') -> dict:
 
     def percent(p: float): return round(p, 2)  # display floats in percentage format
 
@@ -114,20 +181,231 @@ def update_table(table: dict, oldname: str, newname: str, newindex: dict) -> dic
         'total %': totalDiff
     }
 
+    table[newname]['compressed postings'] = compressed_size(newindex, codec)
+
+    return table
+
+
+STAGES = ('unfiltered', 'no numbers', 'case folding', '30 stop words', '150 stop words')
+STOP_WORDS_30 = frozenset(stop_words[:30])
+STOP_WORDS_150 = frozenset(stop_words)
+
+
+def new_stats() -> Dict[str, dict]:
+    return {stage: {'tokens': 0, 'postings': 0, 'bytes': 0} for stage in STAGES}
+
+
+def count(stats: Dict[str, dict], stage: str, frequency: int, size: int) -> None:
+    stats[stage]['tokens'] += 1
+    stats[stage]['postings'] += frequency
+    stats[stage]['bytes'] += size
+
+
+def fold(folded: str, variants: List[Tuple[Tuple[int, List[int]], int]], encode, stats: Dict[str, dict]):
+    '''
+    The steps after numbers removal for the (entry, encoded size) <variants>
+    of the case folded term <folded>: their postings are merged, then the stop
+    words are removed. Returns the final entry, None for a stop word.
+    '''
+    if len(variants) == 1:
+        entry, size = variants[0]
+    else:
+        merged = merge_postings([entry[1] for entry, _ in variants])
+        entry, size = (len(merged), merged), len(encode(merged))
+    count(stats, 'case folding', entry[0], size)
+
+    if folded not in STOP_WORDS_30:
+        count(stats, '30 stop words', entry[0], size)
+
+    if folded not in STOP_WORDS_150:
+        count(stats, '150 stop words', entry[0], size)
+        return (entry[0], list(entry[1]))
+    return None
+
+
+@instrumentation.instrumented('compressor.compress')
+def compress(index, codec='vbyte') -> Tuple[Dict[str, Tuple[int, List[int]]], dict]:
+    '''
+    Fused version of the steps of the compression table: numbers removal, case
+    folding and stop words removal are applied to each term in the same pass,
+    which reads and encodes every postings list once. The variants of a case
+    folded term are merged with a linear k-way merge. <index> can be any
+    mapping returned by utils.open_index, it is not modified. Returns the
+    final index and the compression table.
+    '''
+
+    encode = postings_codec.CODECS[codec][0]
+    stats = new_stats()
+    final: Dict[str, Tuple[int, List[int]]] = {}
+
+    groups: Dict[str, List[str]] = {}  # case folded term -> its variants in the index
+    for token in index:
+        groups.setdefault(token.lower(), []).append(token)
+
+    print('\nCompressing in a single pass...')
+    for folded in tqdm(sorted(groups)):
+        variants = []
+        for token in groups[folded]:
+            entry = index[token]
+            size = len(encode(entry[1]))
+            count(stats, 'unfiltered', entry[0], size)
+
+            if not token.isnumeric():
+                count(stats, 'no numbers', entry[0], size)
+                variants.append((entry, size))
+
+        if variants:
+            entry = fold(folded, variants, encode, stats)
+            if entry != None:
+                final[folded] = entry
+
+    return final, stats_table(stats)
+
+
+def write_run(entries: List[list], directory: str, number: int) -> str:
+    '''Writes the [folded term, frequency, encoded size, postings] <entries>, sorted by folded term, into a run file'''
+
+    filename = os.path.join(directory, f'run{number:05}.txt')
+    with open(filename, mode='w', encoding='UTF-8') as f:
+        for entry in entries:
+            print(json.dumps(entry), file=f)
+    return filename
+
+
+def read_run(filename: str) -> Iterable[list]:
+    with open(filename, mode='r', encoding='UTF-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def sorted_runs(entries: Iterable[Tuple[str, Tuple[int, List[int]]]], directory: str, memory_budget: int, encode, stats: Dict[str, dict]) -> List[str]:
+    '''
+    First pass of <compress_stream>: counts the unfiltered and numbers removal
+    stages and spreads the other entries of <entries>, sorted by term, into
+    runs sorted by case folded term. Lower case terms are already in that
+    order and go straight to the first run, the others are buffered and
+    sorted by folded term every <memory_budget> bytes.
+    '''
+
+    lower_run = os.path.join(directory, 'run_lower.txt')
+    runs = [lower_run]
+    buffer: List[list] = []
+    buffer_size = 0
+
+    with open(lower_run, mode='w', encoding='UTF-8') as lower:
+        for token, (frequency, postings_list) in entries:
+            size = len(encode(postings_list))
+            count(stats, 'unfiltered', frequency, size)
+            if token.isnumeric():
+                continue
+            count(stats, 'no numbers', frequency, size)
+
+            folded = token.lower()
+            if folded == token:
+                print(json.dumps([folded, frequency, size, postings_list]), file=lower)
+                continue
+
+            buffer.append([folded, frequency, size, postings_list])
+            buffer_size += cache.postings_size(frequency)
+            if buffer_size >= memory_budget:
+                buffer.sort(key=lambda entry: entry[0])
+                runs.append(write_run(buffer, directory, len(runs)))
+                buffer, buffer_size = [], 0
+
+    if buffer:
+        buffer.sort(key=lambda entry: entry[0])
+        runs.append(write_run(buffer, directory, len(runs)))
+
+    return runs
+
+
+def merge_runs(runs: List[str], encode, stats: Dict[str, dict]) -> Iterable[Tuple[str, Tuple[int, List[int]]]]:
+    '''Second pass of <compress_stream>: k-way merge of the runs, folding the variants of every term on the way'''
+
+    merged = heapq.merge(*[read_run(run) for run in runs], key=lambda entry: entry[0])
+    for folded, group in itertools.groupby(merged, key=lambda entry: entry[0]):
+        variants = [((frequency, postings_list), size) for _, frequency, size, postings_list in group]
+        entry = fold(folded, variants, encode, stats)
+        if entry != None:
+            yield folded, entry
+
+
+@instrumentation.instrumented('compressor.compress_stream')
+def compress_stream(entries: Iterable[Tuple[str, Tuple[int, List[int]]]], outfile: str, memory_budget: int, codec='vbyte', binary=False) -> dict:
+    '''
+    Out of core version of <compress> for indexes that don't fit in memory.
+    <entries> are read once, in term order (see utils.iter_index_file), into
+    runs sorted by case folded term (see <sorted_runs>), which are merged back
+    while the final index is written into <outfile> as it comes. Only the
+    buffered case variants, one postings list per run and the terms of a
+    binary output are held in memory. Returns the compression table.
+    '''
+
+    encode = postings_codec.CODECS[codec][0]
+    stats = new_stats()
+
+    output_dir = os.path.dirname(outfile) or '.'
+    with tempfile.TemporaryDirectory(dir=output_dir, prefix='compressor_runs_') as directory:
+        print('\nSorting the index by case folded term...')
+        runs = sorted_runs(tqdm(entries), directory, memory_budget, encode, stats)
+        print(f'{len(runs)} runs written')
+
+        final = merge_runs(runs, encode, stats)
+        if binary:
+            print(f'\nWriting binary index into file {outfile}')
+            binary_index.write_binary_index(tqdm(final), outfile, codec=codec)
+        else:
+            utils.write2disk(final, outfile)
+
+    return stats_table(stats)
+
+
+def stats_table(stats: Dict[str, dict]) -> dict:
+    '''Compression table, as built by <update_table>, from the totals of every stage'''
+
+    def percent(p: float): return round(p, 2)  # display floats in percentage format
+
+    def change(old: int, new: int): return percent((old - new) / old * 100) if old else 0.0
+
+    table = {}
+    first = previous = stats[STAGES[0]]
+
+    for stage in STAGES:
+        current = stats[stage]
+        table[stage] = {
+            'tokens': {
+                'number': current['tokens'],
+                'delta %': change(previous['tokens'], current['tokens']),
+                'total %': change(first['tokens'], current['tokens']),
+            },
+            'non-positional postings': {
+                'number': current['postings'],
+                'delta %': change(previous['postings'], current['postings']),
+                'total %': change(first['postings'], current['postings']),
+            },
+            'compressed postings': {
+                'bytes': current['bytes'],
+                'bytes/posting': round(current['bytes'] / current['postings'], 2) if current['postings'] else 0.0,
+            },
+        }
+        previous = current
+
     return table
 
 
 def display_table(table: dict) -> str:
     '''Returns a properly formatted string of the compression table'''
     
-    display = '\noperations\t\t\tterms\t\t\t\t\tpostings\n'
-    display += '\t\t\tnumber\t∆%\tT%'*2 + '\n\n'
+    display = '\noperations\t\t\tterms\t\t\t\t\tpostings\t\t\t\tcompressed\n'
+    display += '\t\t\tnumber\t∆%\tT%'*2 + '\t\tbytes\t\tB/posting' + '\n\n'
 
     for index_type in table:
         display += index_type+'\t'
         for i in ['tokens', 'non-positional postings']:
             x = table[index_type][i]
             display += f"\t{x['number']}\t{x['delta %']}\t{x['total %']}\t\t"
+        x = table[index_type]['compressed postings']
+        display += f"\t{x['bytes']}\t{x['bytes/posting']}"
         display += '\n'
 
     return display
@@ -135,45 +413,23 @@ def display_table(table: dict) -> str:
 
 def run():
     args = init_params()
+    instrumentation.setup(args)
 
     print(f'\nCompression performed on {args.input_file} and stored in {args.output_file}')
 
-    unfiltered: dict = utils.load_index(args.input_file)
+    if args.stream:
+        table = compress_stream(utils.iter_index_file(args.input_file), args.output_file, args.memory_budget * 2**20, args.codec, args.binary)
+    else:
+        unfiltered = utils.open_index(args.input_file, args.compact)
+        final, table = compress(unfiltered, args.codec)
 
-    table = {
-        'unfiltered': {
-            'tokens': {
-                'number': len(unfiltered),
-                'delta %': round(0.0, 2),
-                'total %': round(0.0, 2)
-            },
-            'non-positional postings': {
-                'number': sum([unfiltered[token][0] for token in unfiltered]),
-                'delta %': round(0.0, 2),
-                'total %': round(0.0, 2)
-            }
-        }
-    }
-
-    no_numbers: dict = remove_numbers(unfiltered.copy())
-    table = update_table(table, 'unfiltered', 'no numbers', no_numbers)
-
-    case_folding: dict = case_fold(no_numbers)
-    table = update_table(table, 'no numbers', 'case folding', case_folding)
-
-    remove30 = remove_stop_words(case_folding, stop_words[:30])
-    table = update_table(table, 'case folding', '30 stop words', remove30)
-
-    remove150 = remove_stop_words(case_folding, stop_words)
-    table = update_table(table, '30 stop words', '150 stop words', remove150)
-
-    final = remove150
-
-    utils.save_index_to_disk(final, args.output_file)
+        utils.save_index_to_disk(final, args.output_file, binary=args.binary, codec=args.codec)
 
     print(f'\nCompression Table:')
     print(display_table(table))
 
+    instrumentation.finish(args)
+
 
 if __name__ == '__main__':
     run()
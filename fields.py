@@ -0,0 +1,364 @@
+'''
+Field aware indexing and metadata filters. indexer.py --fields writes two more
+files next to the index:
+
+    <index file>.fields      index of the TITLE and BODY of the documents kept
+                             apart, its terms are field:term (title:oil,
+                             body:oil), in the format of the index
+    <index file>.docvalues   columns of the TOPICS, PLACES and DATE of every
+                             document
+
+Field terms can be used wherever a term can, e.g. with query.py -q title:oil or
+-m boolean -q "title:oil AND body:prices". Filters (topic:grain, place:usa,
+date:1987-03-01..1987-03-31) restrict the documents of a query: every filter
+gives a bitmap of the documents it keeps (a python int whose bit docID is set,
+see bitset.py) computed from its column, the bitmaps are ANDed and the
+postings of the rest of the query are checked against the result.
+
+Layout of the .docvalues file (every integer is little endian):
+
+    header              magic, version, document count
+    dates               one uint32 yyyymmdd per document, 0 when unknown
+    then for the topics and the places columns:
+        values          uint32 byte length, then the distinct values joined with \\n
+        offsets         one uint32 per document + 1 into the value IDs
+        value IDs       one uint32 per value of every document, in docID order
+'''
+
+import os
+import re
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import bitset
+import instrumentation
+import utils
+
+MAGIC = b'NIDV'
+VERSION = 1
+
+HEADER = struct.Struct('<4sII')  # magic, version, document count
+U32 = struct.Struct('<I')
+BIG_ENDIAN_HOST = sys.byteorder == 'big'
+
+TEXT_FIELDS = ('title', 'body')
+COLUMNS = ('topic', 'place')  # multi valued columns, from <TOPICS> and <PLACES>
+FILTER = re.compile(r'(?<!\S)(topic|place|date):([^\s()]+)')
+REUTERS_DATE = re.compile(r'(\d{1,2})-([A-Za-z]{3})-(\d{4})')  # 26-FEB-1987 15:01:01.79
+QUERY_DATE = re.compile(r'(\d{4})(?:-(\d{2}))?(?:-(\d{2}))?')  # 1987, 1987-02 or 1987-02-26
+MONTHS = {month: number for number, month in enumerate(['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC'], 1)}
+
+
+class FilterSyntaxError(ValueError):
+    pass
+
+
+def fields_filename(index_file: str) -> str:
+    return f'{index_file}.fields'
+
+
+def docvalues_filename(index_file: str) -> str:
+    return f'{index_file}.docvalues'
+
+
+def parse_date(date: str) -> int:
+    '''yyyymmdd of the Reuters <DATE> <date>, 0 when it cannot be read'''
+    match = REUTERS_DATE.match(date)
+    if match == None or match.group(2).upper() not in MONTHS:
+        return 0
+    day, month, year = match.groups()
+    return int(year) * 10000 + MONTHS[month.upper()] * 100 + int(day)
+
+
+def parse_query_date(date: str, end=False) -> int:
+    '''
+    yyyymmdd of the query date <date>. A year or a month stands for its first
+    day, or with <end> for (past) its last one, so 1987-03..1987-04 covers
+    March and April.
+    '''
+    match = QUERY_DATE.fullmatch(date)
+    if match == None:
+        raise FilterSyntaxError(f'Dates are written 1987, 1987-02 or 1987-02-26, got {date}')
+    year, month, day = match.groups()
+    fill = '99' if end else '00'
+    return int(year + (month or fill) + (day or fill))
+
+
+def date_range(value: str) -> Tuple[int, int]:
+    '''First and last yyyymmdd of the date filter <value>: a date, or a range FROM..TO where either side can be left out'''
+    first, last = value.split('..', 1) if '..' in value else (value, value)
+    return (parse_query_date(first) if first else 0,
+            parse_query_date(last, end=True) if last else 99999999)
+
+
+# ----------------------------------------------------------------------------
+# Doc values
+# ----------------------------------------------------------------------------
+
+def _packed(values: array) -> bytes:
+    if BIG_ENDIAN_HOST:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpacked(data: bytes, count: int, offset: int) -> Tuple[array, int]:
+    '''<count> uint32 of <data> from <offset>, and the offset after them'''
+    values = array('I')
+    values.frombytes(data[offset:offset + 4 * count])
+    if BIG_ENDIAN_HOST:
+        values.byteswap()
+    return values, offset + 4 * count
+
+
+class DocValues:
+    '''
+    Topics, places and date of every document, as columns indexed by docID - 1.
+    A multi valued column is its distinct <values>, and the IDs of the values
+    of every document, those of docID being value_ids[offsets[docID - 1]:offsets[docID]].
+    The documents of every value are inverted from them the first time the
+    column is filtered on.
+    '''
+
+    def __init__(self, dates: array, columns: Dict[str, Tuple[List[str], array, array]]):
+        self.doc_count = len(dates)
+        self.dates = dates
+        self.columns = columns
+        self._value_ids = {column: {value: i for i, value in enumerate(values)} for column, (values, _, _) in columns.items()}
+        self._postings: Dict[str, List[List[int]]] = {}
+
+    @classmethod
+    def build(cls, records: Iterable) -> 'DocValues':
+        '''Columns of <records> (pipeline.ReutersRecord), which come in docID order from 1'''
+        dates = array('I')
+        columns = {column: ([], array('I', [0]), array('I')) for column in COLUMNS}
+        value_ids = {column: {} for column in COLUMNS}
+
+        for record in records:
+            dates.append(parse_date(record.date))
+            for column, values in (('topic', record.topics), ('place', record.places)):
+                distinct, offsets, ids = columns[column]
+                for value in values:
+                    if value not in value_ids[column]:
+                        value_ids[column][value] = len(distinct)
+                        distinct.append(value)
+                    ids.append(value_ids[column][value])
+                offsets.append(len(ids))
+
+        return cls(dates, columns)
+
+    def values(self, column: str, docID: int) -> List[str]:
+        values, offsets, value_ids = self.columns[column]
+        return [values[i] for i in value_ids[offsets[docID - 1]:offsets[docID]]]
+
+    def date(self, docID: int) -> int:
+        return self.dates[docID - 1]
+
+    def postings(self, column: str) -> List[List[int]]:
+        '''Sorted docIDs of every value of <column>, by value ID'''
+        if column not in self._postings:
+            values, offsets, value_ids = self.columns[column]
+            postings: List[List[int]] = [[] for _ in values]
+            for docID in range(1, self.doc_count + 1):
+                for value_id in value_ids[offsets[docID - 1]:offsets[docID]]:
+                    postings[value_id].append(docID)
+            self._postings[column] = postings
+        return self._postings[column]
+
+    def column_bitmap(self, column: str, value: str) -> int:
+        '''Documents having <value> in <column>'''
+        value_id = self._value_ids[column].get(value)
+        if value_id == None:
+            return 0
+        return bitset.from_docIDs(self.postings(column)[value_id])
+
+    def date_bitmap(self, first: int, last: int) -> int:
+        '''Documents dated between the yyyymmdd <first> and <last> included'''
+        bits = bytearray(self.doc_count // 8 + 1)
+        for docID, date in enumerate(self.dates, 1):
+            if first <= date <= last:
+                bits[docID >> 3] |= 1 << (docID & 7)
+        return int.from_bytes(bits, 'little')
+
+    def save(self, outfile: str) -> None:
+        with open(outfile, mode='wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.doc_count))
+            f.write(_packed(self.dates))
+            for column in COLUMNS:
+                values, offsets, value_ids = self.columns[column]
+                joined = '\n'.join(values).encode('UTF-8')
+                f.write(U32.pack(len(joined)) + joined)
+                f.write(_packed(offsets))
+                f.write(_packed(value_ids))
+
+    @classmethod
+    def load(cls, filename: str) -> 'DocValues':
+        with open(filename, mode='rb') as f:
+            data = f.read()
+
+        magic, version, doc_count = HEADER.unpack_from(data, 0)
+        assert magic == MAGIC, f'{filename} is not a doc values file'
+        assert version == VERSION, f'{filename} uses version {version} of the format, expected {VERSION}'
+
+        dates, offset = _unpacked(data, doc_count, HEADER.size)
+        columns = {}
+        for column in COLUMNS:
+            length = U32.unpack_from(data, offset)[0]
+            offset += U32.size
+            values = data[offset:offset + length].decode('UTF-8').split('\n') if length else []
+            offsets, offset = _unpacked(data, doc_count + 1, offset + length)
+            value_ids, offset = _unpacked(data, offsets[-1], offset)
+            columns[column] = (values, offsets, value_ids)
+
+        return cls(dates, columns)
+
+
+# ----------------------------------------------------------------------------
+# Building
+# ----------------------------------------------------------------------------
+
+def build_field_index(input_dir: str, index_file: str, binary=False, codec='raw', normalizers: List[str] = ()) -> None:
+    '''
+    Writes the .fields index and the .docvalues columns of the corpus in
+    <input_dir> next to <index_file>, in a single pass over the documents.
+    Terms are normalized like those of the index.
+    '''
+    import indexer  # only needed to build the files
+    import pipeline
+    from tqdm import tqdm
+
+    normalizer_functions = indexer.normalizer_functions(normalizers)
+    postings: Dict[str, List[int]] = {}
+    records = []
+
+    def field_records():
+        for record in pipeline.extract_records(pipeline.read_files(input_dir)):
+            records.append(record._replace(title='', dateline='', body='', text=''))  # the doc values only need the metadata
+            yield record
+
+    print('Indexing the title and body of the documents')
+    for record in tqdm(field_records()):
+        for field, text in zip(TEXT_FIELDS, (record.title, record.body)):
+            for token in pipeline.unique_terms(pipeline.clean_reccuring_patterns(text)):
+                token = pipeline.normalize_token(token, normalizer_functions)
+                if token == None:
+                    continue
+                postings_list = postings.setdefault(f'{field}:{token}', [])
+                if not postings_list or postings_list[-1] != record.docID:  # normalized tokens can collide
+                    postings_list.append(record.docID)
+
+    field_index = {term: (len(postings_list), postings_list) for term, postings_list in postings.items()}
+    utils.save_index_to_disk(field_index, fields_filename(index_file), binary=binary, codec=codec)
+
+    outfile = docvalues_filename(index_file)
+    print(f'\nWriting the topics, places and dates of {len(records)} documents into file {outfile}')
+    DocValues.build(records).save(outfile)
+
+
+# ----------------------------------------------------------------------------
+# Querying
+# ----------------------------------------------------------------------------
+
+class FieldedIndex(Mapping):
+    '''
+    <index> whose field terms (title:oil) are looked up in <field_index>.
+    Everything else is the wrapped index's, like cache.CachedIndex.
+    '''
+
+    def __init__(self, index, field_index):
+        self.index = index
+        self.field_index = field_index
+
+    def __getattr__(self, name: str):
+        return getattr(self.index, name)
+
+    def _index_of(self, term) -> Mapping:
+        if isinstance(term, str) and term.split(':', 1)[0] in TEXT_FIELDS and ':' in term:
+            return self.field_index
+        return self.index
+
+    def __getitem__(self, term: str) -> Tuple[int, List[int]]:
+        return self._index_of(term)[term]
+
+    def __contains__(self, term) -> bool:
+        return term in self._index_of(term)
+
+    def hybrid_postings(self, term: str) -> bitset.Postings:
+        index = self._index_of(term)
+        if hasattr(index, 'hybrid_postings'):
+            return index.hybrid_postings(term)
+        return list(index[term][1])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+def open_fielded_index(index, index_file: str):
+    '''<index> with the field terms of <index_file>, <index> alone if --fields was not used'''
+    filename = fields_filename(index_file)
+    if not os.path.isfile(filename):
+        return index
+    return FieldedIndex(index, utils.open_index(filename, on_disk=True))
+
+
+def open_docvalues(index_file: str) -> Optional[DocValues]:
+    '''Doc values of <index_file>, None if they were not built'''
+    filename = docvalues_filename(index_file)
+    if not os.path.isfile(filename):
+        return None
+    return DocValues.load(filename)
+
+
+def split_filters(query: str) -> Tuple[str, List[Tuple[str, str]]]:
+    '''
+    The rest of <query> and its (field, value) filters, e.g.
+    'oil topic:crude date:1987-03' gives ('oil', [('topic', 'crude'), ('date', '1987-03')]).
+    Only for the term, ranked and wildcard modes, whose filters are all
+    ANDed: boolean queries parse theirs as operands (see boolean_query.parse).
+    '''
+    filters = FILTER.findall(query)
+    if not filters:
+        return query, []
+    return ' '.join(FILTER.sub(' ', query).split()), filters
+
+
+def filter_bitmap(filters: List[Tuple[str, str]], docvalues: DocValues) -> int:
+    '''Documents matching every filter of <filters>'''
+    bitmap = None
+    for field, value in filters:
+        if field == 'date':
+            bits = docvalues.date_bitmap(*date_range(value))
+        else:
+            bits = docvalues.column_bitmap(field, value)
+        bitmap = bits if bitmap == None else bitmap & bits
+    return bitmap
+
+
+@instrumentation.instrumented('query.filter')
+def apply_filters(result: Dict[str, dict], query: str, filters: List[Tuple[str, str]], docvalues: Optional[DocValues]) -> Dict[str, dict]:
+    '''
+    <result> of the rest of <query> (as returned by query.exec_query, the
+    other modes or an empty dict when the query is only filters) restricted to
+    the documents matching <filters>, under <query>.
+    '''
+    if docvalues == None:
+        raise ValueError('No doc values were built next to the index, see indexer.py --fields')
+
+    bitmap = filter_bitmap(filters, docvalues)
+    if not result:
+        hits = {'postings': bitset.docIDs(bitmap)}
+    else:
+        hits = dict(next(iter(result.values())))
+        kept = set(bitset.filter_postings(hits['postings'], bitmap))
+        if 'scores' in hits:  # ranked results keep their order and scores
+            hits['scores'] = [score for docID, score in zip(hits['postings'], hits['scores']) if docID in kept]
+        hits['postings'] = [docID for docID in hits['postings'] if docID in kept]
+
+    hits['frequency'] = len(hits['postings'])
+    hits['message'] = 'successful' if hits['postings'] else 'unsuccessful'
+    return {query: {'frequency': hits.pop('frequency'), **hits}}
@@ -3,11 +3,14 @@ This block will convert the corpus into an inverted index and write the output i
 '''
 
 import argparse
-import os
-import sys
-from typing import Iterable, List, Tuple, Dict, Set
+import functools
+import multiprocessing
+from typing import List, Tuple, Dict
 import utils
-import nltk
+import compressor
+import instrumentation
+import pipeline
+import postings_codec
 from tqdm import tqdm
 
 
@@ -15,22 +18,33 @@ def init_params():
     parser = argparse.ArgumentParser(description='Process command line arguments')
     parser.add_argument('-i', '--input_file', default='data', help='Input file')
     parser.add_argument('-o', '--output_file', default='output/inverted_index.txt', help='Output file')  # Does not include any directory names, strictly the filenames
+    parser.add_argument('-b', '--binary', action='store_true', help='Write the index in the memory mapped binary format')
+    parser.add_argument('-c', '--codec', default='raw', choices=postings_codec.DOCID_CODECS, help='Postings codec of the binary format')
+    parser.add_argument('--spimi', action='store_true', help='Build the index with SPIMI blocks instead of in memory')
+    parser.add_argument('--memory_budget', type=int, default=64, help='Size of a SPIMI block in MB')
+    parser.add_argument('-r', '--ranked', action='store_true', help='Also write the BM25 ranked index into <output_file>.ranked')
+    parser.add_argument('-p', '--positional', action='store_true', help='Also write the positional index into <output_file>.pos')
+    parser.add_argument('-d', '--dictionary', action='store_true', help='Also write the front coded term dictionary into <output_file>.dict, for wildcard queries')
+    parser.add_argument('-f', '--fields', action='store_true', help='Also write the title and body index into <output_file>.fields and the topics, places and dates into <output_file>.docvalues, for field terms and filters')
+    parser.add_argument('-n', '--normalize', nargs='+', default=[], choices=list(compressor.NORMALIZERS), help='Token normalizations applied while indexing, in the given order')
+    parser.add_argument('-s', '--shards', type=int, default=1, help='Number of document shards, written into <output_file>.shard<n> with the manifest <output_file>.shards')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of processes indexing .sgm files in parallel')
+    instrumentation.add_arguments(parser)
     args = parser.parse_args()
 
+    if args.shards > 1 and (args.spimi or args.ranked or args.dictionary or args.positional or args.fields):
+        parser.error('--shards only builds plain inverted indexes, without --spimi, --ranked, --dictionary, --positional or --fields')
+    if args.ranked and args.workers > 1:
+        parser.error('--ranked builds the term frequencies in a single process, not with --workers')
+    if args.spimi and (args.ranked or args.workers > 1):
+        parser.error('--spimi builds the index in a single process without term frequencies, not with --ranked or --workers')
+
     return args
 
 
 def unpack_corpus_step1(path: str) -> List[str]:
     '''Given corpus <path>, returns a list where element is the full str content of a file'''
-
-    sgmfiles: List[str] = sorted([fname for fname in os.listdir(path) if '.sgm' in fname])
-    files_contents = []
-
-    for filename in sgmfiles:
-        with open(f'{path}/{filename}', mode='r', encoding='UTF-8', errors='ignore') as file:
-            files_contents += [file.read()]
-
-    return files_contents
+    return list(pipeline.read_files(path))
 
 
 def document_extracter(lines: List[str]):
@@ -43,27 +57,7 @@ def document_extracter(lines: List[str]):
     print("Extracting documents from .sgm file contents")
     docs: List[str] = []
     for line in tqdm(lines):
-        still_looking = True
-        start_idx = end_idx = 0
-
-        while still_looking:
-            start_idx = line.find('<REUTERS', start_idx)
-
-            if start_idx >= 0:  # means that the file still contains the substring
-
-                end_idx = line[start_idx:].find('</REUTERS>') + start_idx + len('</REUTERS>')
-                assert end_idx > 0, f"The end Index is negative {end_idx}"
-
-                document: str = line[start_idx:end_idx]
-
-                clean_doc = clean_reccuring_patterns(remove_tags(extract_text_contents(document)))
-                docs.append(clean_doc)
-
-                start_idx = end_idx
-                end_idx = start_idx + 1
-
-            else:
-                still_looking = False
+        docs += [record.text for record in pipeline.iter_reuters_records(line)]
 
     return docs
 
@@ -76,68 +70,30 @@ def remove_tags(doc: str) -> str:
     '''
     Removes any tags inside of doc. Should only be applied to a string that
     starts and ends with <TEXT> </TEXT> (output of extract_text_tag_contents
-    func).
+    func). The text between the tags is collected and joined once.
     '''
-    doc_content = doc
-    tag_start = doc_content.find('<')
+    pieces: List[str] = []
+    position = 0
 
-    while tag_start >= 0:  # implies the substring exists
+    for match in pipeline.TAG.finditer(doc):
+        pieces.append(doc[position:match.start()])
+        position = match.end()
+        if match.group(1) == '/TEXT':  # must have reached end of document content
+            break
+    else:
+        pieces.append(doc[position:])
 
-        tag_end: int = doc_content.find('>', tag_start)
-        tag_type: str = doc_content[tag_start+1:tag_end]
-
-        if tag_type != '/TEXT':
-            '''
-            Implications: 
-                1. Tag must be TITLE or BODY or DATE and needs to be
-                removed. 
-                2. Add a space so that two words surrounding the tags
-                don't get merged into a single one during tokenization purposes.
-            '''
-            doc_content = doc_content[:tag_start] + doc_content[tag_end+1:]
-
-        else:  # must have reached end of document content
-            doc_content = doc_content[:tag_start]
-
-        tag_start = doc_content.find('<')
-
-    return doc_content
-
-
-def clean_reccuring_patterns(doc: str) -> str:
-    '''
-    ['&#2;', '&#3;'] are two patterns that occur very often at the begining and
-    end of documents respectively. Filter them out of documents before create
-    the term-docID pairs reduces the number of pairs from 4.5M to 3M pairs and
-    from 17 to 12 seconds of processing.
-    '''
-    for pattern in ['&#2;', '&#3;']:
-        start = doc.find(pattern)
-        end = start + len(pattern) + 1
-        doc = doc[:start] + ' ' + doc[end:]
-
-    return doc
+    return ''.join(pieces)
 
 
 def generate_term_docID_pairs(docs: List[str]) -> Tuple[str, int]:
-    '''Generate term-docID tuples'''
+    '''Generate term-docID tuples, a single one per term of a document'''
 
     print('Generating term-docID pairs')
     pairs = []
-    # tokenizer = nltk.RegexpTokenizer(r"\b(\w[-']\w)\b+|\b\w[']\b|\b\w\b")
-    # tokenizer = nltk.RegexpTokenizer(r"(?:\w|['-]\w|\w['])+")
-    # tokenizer = nltk.RegexpTokenizer(r"'?[a-zA-Z]+([-'][a-zA-Z]+['])*'?")
-    tokenizer = nltk.RegexpTokenizer(r"[a-zA-Z]+[-']{0,1}[a-zA-Z]*[']{0,1}")
-    
 
     for id in tqdm(range(len(docs))):
-        tokenized = tokenizer.tokenize(docs[id])
-        for token in tokenized:
-            if token == "":
-                continue
-            while token[-1] == "-" or token[-1] =="'":
-                token = token[:-1]
-            pairs.append((token, id+1))
+        pairs += [(token, id+1) for token in pipeline.unique_terms(docs[id])]
 
     return pairs
 
@@ -177,31 +133,147 @@ def sorted_postings(inverted_index: Dict[str, Tuple[int, set]]) -> Dict[str, Tup
     return sorted_index
 
 
-def from_scratch_index_creation(input_dir=None) -> Dict[str, Tuple[int, set]]:
+def normalizer_functions(normalizers: List[str]) -> list:
+    '''Token normalizers of compressor.NORMALIZERS named in <normalizers>'''
+    return [compressor.NORMALIZERS[name] for name in normalizers]
+
+
+def from_scratch_index_creation(input_dir=None, normalizers: List[str] = (), positions=None) -> Dict[str, Tuple[int, set]]:
     '''
     Created the inverted index from scratch, i.e from the corpus file
-    collection to the dict struct.
+    collection to the dict struct. The corpus is streamed through the stages
+    of pipeline.py, only one file is held in memory at a time. The documents
+    are also added to <positions> (see positional.PositionalIndexBuilder).
     '''
     indir = input_dir if input_dir != None else init_params().input_file
-    lines: List[str] = unpack_corpus_step1(indir)
-    docs: List[str] = document_extracter(lines)
-    pairs: Tuple[str, int] = generate_term_docID_pairs(docs)
-    inverted_index: Dict[str, Tuple[int, List[int]]] = sorted_postings(generate_inverted_index(pairs))
+    print('Generating the inverted index')
+    pairs = pipeline.term_docID_pairs(indir, normalizer_functions(normalizers), unique=True, positions=positions)
+    with instrumentation.stage('invert') as stage:
+        inverted_index: Dict[str, Tuple[int, List[int]]] = pipeline.accumulate_postings(tqdm(pairs))
+        stage.items = len(inverted_index)
+    return inverted_index
+
+
+def from_scratch_ranked_index_creation(input_dir=None, normalizers: List[str] = (), positions=None):
+    '''
+    Same as <from_scratch_index_creation> but also keeps what ranked retrieval
+    needs. Returns the inverted index, the same index with (docID, term
+    frequency) postings and the length of every document.
+    '''
+    indir = input_dir if input_dir != None else init_params().input_file
+    print('Generating the inverted index')
+    pairs = pipeline.term_docID_pairs(indir, normalizer_functions(normalizers), positions=positions)
+    with instrumentation.stage('invert') as stage:
+        tf_index, doc_lengths = pipeline.accumulate_tf_postings(tqdm(pairs))
+        stage.items = len(tf_index)
+    inverted_index: Dict[str, Tuple[int, List[int]]] = {token: (frequency, [docID for docID, _ in tf_postings]) for token, (frequency, tf_postings) in tf_index.items()}
+    return inverted_index, tf_index, doc_lengths
+
+
+def index_corpus_file(filename: str, normalizers: List[str] = (), with_positions=False) -> Tuple[int, List[Tuple[str, Tuple[int, List[int]]]], list]:
+    '''
+    Worker of <parallel_index_creation>. Builds the partial index of a single
+    .sgm file, with docIDs local to that file (starting at 1). Returns the
+    number of documents of the file, the partial index sorted by term and,
+    with <with_positions>, the partial positional index sorted by term.
+    '''
+    with open(filename, mode='r', encoding='UTF-8', errors='ignore') as file:
+        contents = file.read()
+
+    docs = list(pipeline.extract_documents([contents]))
+    pairs = pipeline.tokenize_documents(docs, unique=True)
+    partial_index = pipeline.accumulate_postings(pipeline.normalize(pairs, normalizer_functions(normalizers)))
+
+    partial_positions = []
+    if with_positions:
+        import positional
+        partial_positions = sorted(positional.generate_positional_index(docs, normalizers).items())
+
+    return len(docs), sorted(partial_index.items()), partial_positions
+
+
+def parallel_index_creation(input_dir: str, workers: int, normalizers: List[str] = (), positions=None) -> Dict[str, Tuple[int, List[int]]]:
+    '''
+    Same as <from_scratch_index_creation> but the .sgm files are indexed by a
+    pool of <workers> processes. Partial indexes come back in file order, so
+    shifting their local docIDs by the number of documents of the previous
+    files gives the same global docIDs as the sequential build, and the
+    postings of a term are merged by concatenation. The workers also build
+    the positional index of their file when there are <positions> to add to.
+    '''
+    filenames: List[str] = pipeline.corpus_files(input_dir)
+    inverted_index: Dict[str, Tuple[int, List[int]]] = {}
+    docs_so_far = 0
+
+    print(f'Indexing {len(filenames)} files with {workers} workers')
+    with multiprocessing.Pool(workers) as pool:
+        worker = functools.partial(index_corpus_file, normalizers=tuple(normalizers), with_positions=positions != None)
+        for doc_count, partial_index, partial_positions in tqdm(pool.imap(worker, filenames), total=len(filenames)):
+            for token, (frequency, postings_list) in partial_index:
+                shifted = [docId + docs_so_far for docId in postings_list]
+                if token in inverted_index:
+                    previous_frequency, previous_postings = inverted_index[token]
+                    previous_postings += shifted
+                    inverted_index[token] = (previous_frequency + frequency, previous_postings)
+                else:
+                    inverted_index[token] = (frequency, shifted)
+
+            if positions != None:
+                positions.add_partial(partial_positions, docs_so_far)
+            docs_so_far += doc_count
+
     return inverted_index
 
 
-def save_index_to_disk(inverted_index: Dict[str, Tuple[int, set]], outfile=None) -> None:
-    printable: Tuple[str, Tuple[int, List[int]]] = sorted(inverted_index.items(), key=lambda token: token[0])
+def save_index_to_disk(inverted_index: Dict[str, Tuple[int, set]], outfile=None, binary=False, codec='raw') -> None:
     output_file = outfile if outfile != None else init_params().output_file
-    utils.write2disk(printable, output_file)
+    utils.save_index_to_disk(inverted_index, output_file, binary=binary, codec=codec)
 
 
 def run_one_shot():
     '''Runs the creation of the index and stores it to disk.'''
     utils.ensure_dir_exists('output')
     utils.ensure_dir_exists('data')
-    inverted_index: Dict[str, Tuple[int, set]] = from_scratch_index_creation()
-    save_index_to_disk(inverted_index, outfile=init_params().output_file)
+    args = init_params()
+    instrumentation.setup(args)
+
+    if args.shards > 1:
+        import sharding
+        sharding.build_shards(args.input_file, args.output_file, args.shards, binary=args.binary, codec=args.codec, normalizers=args.normalize)
+
+    elif args.spimi:
+        import spimi
+        spimi.build_index(args.input_file, args.output_file, args.memory_budget * 2**20, binary=args.binary, codec=args.codec,
+                          normalizers=args.normalize, with_positions=args.positional)
+
+    else:
+        positions = None
+        if args.positional:  # built from the same pass over the corpus as the index
+            import positional
+            positions = positional.PositionalIndexBuilder(args.normalize)
+
+        if args.ranked:
+            import ranking
+            inverted_index, tf_index, doc_lengths = from_scratch_ranked_index_creation(args.input_file, args.normalize, positions)
+            ranking.save_ranked_index(ranking.RankedIndex.build(tf_index, doc_lengths), ranking.ranked_index_filename(args.output_file))
+        elif args.workers > 1:
+            inverted_index: Dict[str, Tuple[int, List[int]]] = parallel_index_creation(args.input_file, args.workers, args.normalize, positions)
+        else:
+            inverted_index: Dict[str, Tuple[int, set]] = from_scratch_index_creation(args.input_file, args.normalize, positions)
+
+        save_index_to_disk(inverted_index, outfile=args.output_file, binary=args.binary, codec=args.codec)
+        if positions != None:
+            positions.write(args.output_file)
+
+    if args.dictionary:
+        import term_dictionary
+        term_dictionary.build_term_dictionary(args.output_file)
+
+    if args.fields:
+        import fields
+        fields.build_field_index(args.input_file, args.output_file, binary=args.binary, codec=args.codec, normalizers=args.normalize)
+
+    instrumentation.finish(args)
 
 # def run_intermediate_steps():
 #     utils.ensure_dir_exists('output')
@@ -0,0 +1,336 @@
+'''
+Per stage metrics of the indexing and query pipelines: wall time, CPU time,
+resident memory, items and bytes in and out, exported as JSON or Prometheus
+text. The resident memory of a stage is sampled when it starts and ends (and
+when its nested stages do), the largest sample is kept.
+
+Stages are named blocks of code, measured with the <stage> context manager,
+the <instrumented> decorator, or <iterate> for the lazy stages of pipeline.py,
+where only the time spent producing the items is counted. Stages can nest; the
+time of a stage includes its nested stages (wall_seconds) and also excludes
+them (self_seconds), so the self times of a streaming pipeline add up to its
+total. Calls of the same stage are aggregated.
+
+Nothing is recorded until <enable> is called, so the hooks cost a boolean test
+when the metrics are not wanted. With profile=True every stage also runs under
+cProfile, whose stats are written next to the metrics file
+(<metrics file>.<stage>.prof, to read with pstats or snakeviz). With
+trace_memory=True the peak of python allocations during the stage is recorded
+with tracemalloc. Both are only imported when asked for, as this module is on
+the startup path of every script.
+'''
+
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List
+
+PROMETHEUS_PREFIX = 'niix_stage'
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class StageMetrics:
+    '''Totals of every call of a stage'''
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.self_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.items = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.peak_rss_bytes = 0
+        self.traced_peak_bytes = 0
+        self.profile = None
+
+    def as_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'wall_seconds': round(self.wall_seconds, 6),
+            'self_seconds': round(self.self_seconds, 6),
+            'cpu_seconds': round(self.cpu_seconds, 6),
+            'items': self.items,
+            'items_per_second': round(self.items / self.wall_seconds, 2) if self.wall_seconds else 0.0,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'peak_rss_bytes': self.peak_rss_bytes,
+            'traced_peak_bytes': self.traced_peak_bytes,
+        }
+
+
+class Frame:
+    '''A running stage. Its items and bytes can be set while it runs.'''
+
+    def __init__(self):
+        self.items = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.child_seconds = 0.0  # wall time of the nested stages
+        self.traced_peak = 0
+        self.rss = 0  # largest resident memory sampled so far
+
+
+class Recorder:
+
+    def __init__(self):
+        self.enabled = False
+        self.profile = False
+        self.trace_memory = False
+        self.stages: Dict[str, StageMetrics] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()  # stack of the running frames of each thread
+
+    def _stack(self) -> List[Frame]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def metrics(self, name: str) -> StageMetrics:
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = StageMetrics(name)
+            return self.stages[name]
+
+    def record(self, name: str, frame: Frame, wall: float, cpu: float) -> None:
+        metrics = self.metrics(name)
+        with self._lock:
+            metrics.calls += 1
+            metrics.wall_seconds += wall
+            metrics.self_seconds += wall - frame.child_seconds
+            metrics.cpu_seconds += cpu
+            metrics.items += frame.items
+            metrics.bytes_in += frame.bytes_in
+            metrics.bytes_out += frame.bytes_out
+            metrics.peak_rss_bytes = max(metrics.peak_rss_bytes, frame.rss)
+            metrics.traced_peak_bytes = max(metrics.traced_peak_bytes, frame.traced_peak)
+
+    @contextmanager
+    def stage(self, name: str, items=0, bytes_in=0, bytes_out=0) -> Iterator[Frame]:
+        frame = Frame()
+        frame.items, frame.bytes_in, frame.bytes_out = items, bytes_in, bytes_out
+        if not self.enabled:
+            yield frame
+            return
+
+        stack = self._stack()
+        if self.trace_memory:  # the peak is reset for this stage, the running ones keep the peak so far
+            import tracemalloc
+            peak = tracemalloc.get_traced_memory()[1]
+            for running in stack:
+                running.traced_peak = max(running.traced_peak, peak)
+            tracemalloc.reset_peak()
+
+        profile = None
+        if self.profile and not getattr(self._local, 'profiling', False):  # nested stages are part of the running profile
+            import cProfile
+            metrics = self.metrics(name)
+            profile = metrics.profile = metrics.profile or cProfile.Profile()
+            try:
+                profile.enable()
+                self._local.profiling = True
+            except ValueError:  # another profiler is active in this process
+                profile = None
+
+        frame.rss = current_rss()
+        stack.append(frame)
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield frame
+        finally:
+            wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+            if profile != None:
+                profile.disable()
+                self._local.profiling = False
+            stack.pop()
+
+            if self.trace_memory:
+                import tracemalloc
+                frame.traced_peak = max(frame.traced_peak, tracemalloc.get_traced_memory()[1])
+            frame.rss = max(frame.rss, current_rss())
+            if stack:
+                stack[-1].child_seconds += wall
+                stack[-1].traced_peak = max(stack[-1].traced_peak, frame.traced_peak)
+                stack[-1].rss = max(stack[-1].rss, frame.rss)
+            self.record(name, frame, wall, cpu)
+
+    def iterate(self, name: str, iterable: Iterable, item_size=None) -> Iterable:
+        '''
+        Yields the items of <iterable>, counting them and the time spent
+        producing them as stage <name>. <item_size> gives the bytes of an item.
+        '''
+        if not self.enabled:
+            return iterable
+        return self._iterate(name, iterable, item_size)
+
+    def _iterate(self, name: str, iterable: Iterable, item_size) -> Iterator:
+        iterator = iter(iterable)
+        frame = Frame()
+        stack = self._stack()
+        wall = cpu = 0.0
+        frame.rss = current_rss()  # not sampled for every item, reading /proc costs more than most items
+
+        try:
+            while True:
+                stack.append(frame)
+                start_wall, start_cpu = time.perf_counter(), time.process_time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed = time.perf_counter() - start_wall
+                    wall += elapsed
+                    cpu += time.process_time() - start_cpu
+                    stack.pop()
+                    if stack:
+                        stack[-1].child_seconds += elapsed
+
+                frame.items += 1
+                if item_size != None:
+                    frame.bytes_out += item_size(item)
+                yield item
+        finally:
+            frame.rss = max(frame.rss, current_rss())
+            if stack:
+                stack[-1].rss = max(stack[-1].rss, frame.rss)
+            self.record(name, frame, wall, cpu)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages = {}
+
+    def as_dict(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: metrics.as_dict() for name, metrics in self.stages.items()}
+
+    def prometheus(self) -> str:
+        '''Prometheus text exposition of the stages'''
+        stages = self.as_dict()
+        lines = []
+        for field, kind, help in [('calls', 'counter', 'Number of runs of the stage'),
+                                  ('wall_seconds', 'counter', 'Wall time of the stage, nested stages included'),
+                                  ('self_seconds', 'counter', 'Wall time of the stage, nested stages excluded'),
+                                  ('cpu_seconds', 'counter', 'CPU time of the process during the stage'),
+                                  ('items', 'counter', 'Items processed by the stage'),
+                                  ('bytes_in', 'counter', 'Bytes read by the stage'),
+                                  ('bytes_out', 'counter', 'Bytes written by the stage'),
+                                  ('peak_rss_bytes', 'gauge', 'Largest resident memory of the process sampled at the start and end of the stage and of its nested stages'),
+                                  ('traced_peak_bytes', 'gauge', 'Peak python allocations during the stage')]:
+            metric = f'{PROMETHEUS_PREFIX}_{field}' + ('_total' if kind == 'counter' else '')
+            lines.append(f'# HELP {metric} {help}')
+            lines.append(f'# TYPE {metric} {kind}')
+            for name, values in stages.items():
+                lines.append(f'{metric}{{stage="{name}"}} {values[field]}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, filename: str) -> None:
+        '''Writes the metrics into <filename>, in Prometheus text when it ends with .prom, JSON otherwise'''
+
+        if filename.endswith('.prom'):
+            with open(filename, mode='w', encoding='UTF-8') as f:
+                f.write(self.prometheus())
+        else:
+            with open(filename, mode='w', encoding='UTF-8') as f:
+                json.dump(self.as_dict(), f, indent=4)
+
+        if self.profile:
+            for name, metrics in self.stages.items():
+                if metrics.profile != None:
+                    metrics.profile.dump_stats(f'{filename}.{name}.prof')
+
+        print(f'\nStage metrics written into {filename}')
+
+
+def current_rss(pid='self') -> int:
+    '''Current resident memory of process <pid> in bytes, 0 where /proc is not available or the process is gone'''
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    '''Nearest rank percentile of already sorted values'''
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    '''Count, mean, percentiles and max of <latencies> in seconds, reported in microseconds'''
+    import statistics
+
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'mean_us': statistics.mean(latencies) * 1e6 if latencies else 0.0,
+        'p50_us': percentile(latencies, 50) * 1e6,
+        'p95_us': percentile(latencies, 95) * 1e6,
+        'p99_us': percentile(latencies, 99) * 1e6,
+        'max_us': latencies[-1] * 1e6 if latencies else 0.0,
+    }
+
+
+def git_commit() -> str:
+    '''Commit the measures were taken at, for the benchmark and load test reports'''
+    import subprocess
+
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+RECORDER = Recorder()
+stage = RECORDER.stage
+iterate = RECORDER.iterate
+
+
+def enable(profile=False, trace_memory=False) -> None:
+    RECORDER.enabled = True
+    RECORDER.profile = profile
+    RECORDER.trace_memory = trace_memory
+    if trace_memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def instrumented(name: str):
+    '''Decorator measuring every call of the function as stage <name>'''
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not RECORDER.enabled:
+                return function(*args, **kwargs)
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def add_arguments(parser) -> None:
+    '''Command line flags of the scripts that can export their metrics'''
+    parser.add_argument('--metrics', default=None, help='Write the metrics of every stage into this file, Prometheus text if it ends with .prom, JSON otherwise')
+    parser.add_argument('--profile', action='store_true', help='With --metrics, also run every stage under cProfile, written into <metrics>.<stage>.prof')
+    parser.add_argument('--trace_memory', action='store_true', help='With --metrics, also record the peak python allocations of every stage')
+
+
+def setup(args) -> None:
+    '''Enables the recorder when the script was asked for metrics'''
+    if args.metrics != None:
+        enable(args.profile, args.trace_memory)
+
+
+def finish(args) -> None:
+    if args.metrics != None:
+        RECORDER.export(args.metrics)
@@ -0,0 +1,593 @@
+'''
+Load generator. Replays a query log, or a synthetic workload drawn from the
+vocabulary of an index, against the query modes of server.QueryService in this
+process or against a running server.py, and reports the throughput, latency
+percentiles and histogram, and memory over time.
+
+    python loadgen.py -i output/inverted_index.txt -n 10000 --concurrency 8
+    python loadgen.py --log output/queryLog.jsonl --target http://127.0.0.1:8080 --concurrency 32 --model asyncio
+    python loadgen.py --target unix:/tmp/niix.sock --duration 60 --qps 500 --server_pid 1234
+
+Workloads:
+    --log       queries of a server.py log (JSON lines, with their mode) or of
+                the JSON object query.py writes (its keys, in --mode), in order
+    otherwise   the terms of the index ranked by decreasing document frequency,
+                the term of rank r drawn with a probability proportional to
+                1 / r^--zipf, which is the skew of real query traffic. Boolean
+                and ranked queries are made of --terms_per_query terms.
+The workload is cycled until -n queries were sent or --duration elapsed.
+
+Concurrency (--model, with --concurrency clients):
+    threads     threads sharing the workload
+    processes   worker processes, each with its own copy of the index or its
+                own connection, which is what uses several cores for local queries
+    asyncio     coroutines on one event loop, the HTTP requests are made by the
+                loop itself and local queries run in a pool of --concurrency
+                threads, as server.py runs them
+
+Without --qps the clients are closed loop: each one sends its next query as
+soon as the previous one is answered. With --qps the queries are due at a fixed
+rate and the latency of a query counts from the time it was due, so a stalled
+target shows up as latency instead of as fewer queries sent.
+
+The report (-o) holds the QPS, the latency percentiles overall and per mode, a
+histogram of the latencies in power of two buckets of microseconds, and a
+timeline with the queries, QPS, percentiles and resident memory (of the load
+generator, its worker processes and the server given by --server_pid) of every
+--interval seconds. --compare prints the new/old ratios against a previous report.
+'''
+
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import multiprocessing
+import queue
+import random
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+import instrumentation
+import utils
+
+MODELS = ['threads', 'processes', 'asyncio']
+MODES = ['term', 'boolean', 'ranked', 'wildcard']
+WORKER_START_TIMEOUT = 600.0  # seconds given to the worker processes to open their target
+
+Query = Tuple[str, str]  # mode, query string
+Record = Tuple[float, float, str, bool]  # time sent, latency in seconds, mode, answered without error
+
+
+def init_params():
+    parser = argparse.ArgumentParser(description='Process command line arguments')
+    parser.add_argument('-i', '--input_file', default='output/inverted_index.txt', help='Index queried, and whose vocabulary the synthetic workload is drawn from')
+    parser.add_argument('-o', '--output_file', default='output/loadgen.json', help='Report file')
+    parser.add_argument('--log', default=None, help='Query log to replay, output/queryLog.jsonl or output/sampleQueries.json, instead of a synthetic workload')
+    parser.add_argument('-m', '--mode', default='term', choices=MODES, help='Query mode of the synthetic workload and of the queries of query.py')
+    parser.add_argument('-k', type=int, default=10, help='Number of results of ranked queries')
+    parser.add_argument('--zipf', type=float, default=1.0, help='Exponent of the Zipf distribution of the synthetic terms')
+    parser.add_argument('--terms_per_query', type=int, default=2, help='Number of terms of the synthetic boolean and ranked queries')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic workload')
+    parser.add_argument('--target', default=None, help='Server to query, http://host:port or unix:<socket path>, instead of querying the index in this process')
+    parser.add_argument('--server_pid', type=int, default=None, help='Process of the server whose memory is sampled')
+    parser.add_argument('--model', default='threads', choices=MODELS, help='How the clients run concurrently')
+    parser.add_argument('--concurrency', type=int, default=4, help='Number of concurrent clients')
+    parser.add_argument('-n', '--queries', type=int, default=10000, help='Number of queries sent')
+    parser.add_argument('--duration', type=float, default=None, help='Send queries for this many seconds instead of -n queries')
+    parser.add_argument('--qps', type=float, default=None, help='Rate the queries are due at, as fast as possible when not given')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between two points of the timeline')
+    parser.add_argument('--cache_size', type=int, default=0, help='Memory budget in MB of the caches of the local query service')
+    parser.add_argument('--cache_policy', default='lru', help='Eviction policy of the caches of the local query service')
+    parser.add_argument('--compare', default=None, help='Previous report to compare with')
+    args = parser.parse_args()
+
+    return args
+
+
+# ----------------------------------------------------------------------------
+# Workloads
+# ----------------------------------------------------------------------------
+
+def read_query_log(filename: str, mode='term') -> List[Query]:
+    '''
+    Queries of a server.py log, JSON lines with their mode, or of the JSON
+    object query.py writes, whose keys are the queries, all in <mode>.
+    '''
+    with open(filename, mode='r', encoding='UTF-8') as f:
+        if filename.endswith('.jsonl'):
+            entries = [json.loads(line) for line in f if line.strip()]
+            return [(entry.get('mode', mode), entry['query']) for entry in entries]
+        return [(mode, query_string) for query_string in json.load(f)]
+
+
+def zipf_workload(index_file: str, count: int, exponent=1.0, mode='term', terms_per_query=2, seed=0) -> List[Query]:
+    '''
+    <count> queries whose terms are drawn from the vocabulary of <index_file>
+    ranked by decreasing document frequency, the term of rank r with a
+    probability proportional to 1 / r^<exponent>.
+    '''
+    print(f'Ranking the terms of {index_file} by document frequency')
+    ranked = sorted([(-frequency, term) for term, (frequency, _) in utils.iter_index_file(index_file)])
+    terms = [term for _, term in ranked]
+
+    cum_weights = []
+    total = 0.0
+    for rank in range(1, len(terms) + 1):
+        total += rank ** -exponent
+        cum_weights.append(total)
+
+    per_query = terms_per_query if mode in ('boolean', 'ranked') else 1
+    drawn = random.Random(seed).choices(terms, cum_weights=cum_weights, k=count * per_query)
+    separator = ' AND ' if mode == 'boolean' else ' '
+
+    return [(mode, separator.join(drawn[i:i + per_query])) for i in range(0, len(drawn), per_query)]
+
+
+class Schedule:
+    '''
+    Hands out the queries of <workload>, cycled, to the clients. A schedule
+    covers the queries offset, offset + step, offset + 2 * step... so that
+    worker processes can split a workload without talking to each other.
+    '''
+
+    def __init__(self, workload: List[Query], start: float, count=None, duration=None, qps=None, offset=0, step=1):
+        self.workload = workload
+        self.start = start
+        self.count = count
+        self.end = start + duration if duration != None else None
+        self.qps = qps
+        self.step = step
+        self._next = offset
+        self._lock = threading.Lock()
+
+    def next(self) -> Optional[Tuple[Optional[float], Query]]:
+        '''(time the query is due at, None without a rate; query) of the next query, None when the run is over'''
+        with self._lock:
+            i = self._next
+            self._next += self.step
+
+        if self.count != None and i >= self.count:
+            return None
+        if self.end != None and time.time() >= self.end:
+            return None
+        due = self.start + i / self.qps if self.qps != None else None
+        return due, self.workload[i % len(self.workload)]
+
+
+# ----------------------------------------------------------------------------
+# Targets
+# ----------------------------------------------------------------------------
+
+class LocalTarget:
+    '''Queries answered in this process by the query service of server.py'''
+
+    def __init__(self, index_file: str, cache_size=0, cache_policy='lru'):
+        import server  # loads the query modules, which an HTTP target doesn't need
+        self.service = server.QueryService(index_file, None, False, cache_size * 2**20, cache_policy)
+
+    def query(self, mode: str, query_string: str, k: int) -> None:
+        self.service.exec_query(query_string, mode, k)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path: str):
+        super().__init__('localhost')
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def query_path(mode: str, query_string: str, k: int) -> str:
+    return '/query?' + urlencode({'q': query_string, 'mode': mode, 'k': k})
+
+
+class HttpTarget:
+    '''
+    A running server.py at <address>, http://host:port or unix:<socket path>.
+    Every thread keeps its own keep-alive connection.
+    '''
+
+    def __init__(self, address: str):
+        if address.startswith('unix:'):
+            self.host, self.port, self.socket_path = 'localhost', None, address[len('unix:'):]
+        else:
+            url = urlsplit(address)
+            self.host, self.port, self.socket_path = url.hostname, url.port or 80, None
+        self._local = threading.local()
+
+    def connection(self) -> http.client.HTTPConnection:
+        if getattr(self._local, 'connection', None) == None:
+            if self.socket_path != None:
+                self._local.connection = UnixHTTPConnection(self.socket_path)
+            else:
+                self._local.connection = http.client.HTTPConnection(self.host, self.port)
+        return self._local.connection
+
+    def query(self, mode: str, query_string: str, k: int) -> None:
+        connection = self.connection()
+        try:
+            connection.request('GET', query_path(mode, query_string, k))
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None  # reconnects for the next query
+            raise
+        if response.status != 200:
+            raise ValueError(f'{response.status} {response.reason} for {query_string}')
+
+    async def open_connection(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        if self.socket_path != None:
+            return await asyncio.open_unix_connection(self.socket_path)
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def async_query(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, mode: str, query_string: str, k: int) -> None:
+        '''Same as <query> over a connection of the event loop'''
+        writer.write(f'GET {query_path(mode, query_string, k)} HTTP/1.1\r\nHost: {self.host}\r\n\r\n'.encode('latin-1'))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('server closed the connection')
+        status = int(status_line.split()[1])
+
+        length = 0
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        await reader.readexactly(length)
+
+        if status != 200:
+            raise ValueError(f'{status} for {query_string}')
+
+
+def open_target(address=None, index_file=None, cache_size=0, cache_policy='lru'):
+    if address != None:
+        return HttpTarget(address)
+    return LocalTarget(index_file, cache_size, cache_policy)
+
+
+# ----------------------------------------------------------------------------
+# Clients
+# ----------------------------------------------------------------------------
+
+def wait_until(due: Optional[float]) -> None:
+    if due != None and due > time.time():
+        time.sleep(due - time.time())
+
+
+def latency_since(due: Optional[float], sent: float, start: float) -> float:
+    '''Time the query took, plus how late it was sent when it had a due time'''
+    latency = time.perf_counter() - start
+    return latency + max(0.0, sent - due) if due != None else latency
+
+
+def client(target, schedule: Schedule, k: int, records: List[Record]) -> None:
+    '''Sends the queries of <schedule> one after the other'''
+    while True:
+        task = schedule.next()
+        if task == None:
+            return
+        due, (mode, query_string) = task
+        wait_until(due)
+
+        sent, start = time.time(), time.perf_counter()
+        try:
+            target.query(mode, query_string, k)
+            ok = True
+        except Exception:
+            ok = False
+        records.append((sent, latency_since(due, sent, start), mode, ok))
+
+
+def run_threads(target, schedule: Schedule, k: int, concurrency: int) -> List[Record]:
+    records: List[Record] = []
+    threads = [threading.Thread(target=client, args=(target, schedule, k, records)) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records
+
+
+async def async_client(target, schedule: Schedule, k: int, records: List[Record], executor: ThreadPoolExecutor) -> None:
+    '''<client> on the event loop, with its own connection to an HTTP target'''
+    loop = asyncio.get_running_loop()
+    connection = None
+
+    while True:
+        task = schedule.next()
+        if task == None:
+            break
+        due, (mode, query_string) = task
+        if due != None and due > time.time():
+            await asyncio.sleep(due - time.time())
+
+        sent, start = time.time(), time.perf_counter()
+        try:
+            if isinstance(target, HttpTarget):
+                if connection == None:
+                    connection = await target.open_connection()
+                await target.async_query(*connection, mode, query_string, k)
+            else:
+                await loop.run_in_executor(executor, target.query, mode, query_string, k)
+            ok = True
+        except Exception:
+            if connection != None:
+                connection[1].close()
+                connection = None  # reconnects for the next query
+            ok = False
+        records.append((sent, latency_since(due, sent, start), mode, ok))
+
+    if connection != None:
+        connection[1].close()
+
+
+def run_asyncio(target, schedule: Schedule, k: int, concurrency: int) -> List[Record]:
+    records: List[Record] = []
+
+    async def clients():
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            await asyncio.gather(*[async_client(target, schedule, k, records, executor) for _ in range(concurrency)])
+
+    asyncio.run(clients())
+    return records
+
+
+def _process_client(target_args: tuple, workload: List[Query], schedule_args: dict, k: int, ready, go, start, results) -> None:
+    '''
+    Worker process: opens its own target, waits for the others, then runs its
+    part of the schedule. A worker that cannot open its target reports why and
+    breaks the barrier, so that nobody waits for it.
+    '''
+    try:
+        target = open_target(*target_args)
+    except Exception as e:
+        results.put(f'worker {schedule_args["offset"]} could not open its target: {e!r}')
+        ready.abort()
+        return
+
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        return  # another worker failed, the run is aborted
+    go.wait()
+
+    records: List[Record] = []
+    client(target, Schedule(workload, start.value, **schedule_args), k, records)
+    results.put(records)
+
+
+def run_processes(target_args: tuple, workload: List[Query], schedule_args: dict, k: int, concurrency: int, sampler) -> Tuple[float, List[Record]]:
+    '''
+    Runs <concurrency> worker processes, the queries being dealt round robin,
+    and returns the time they started at with their records. <sampler> is
+    started once the workers exist, with their memory.
+    '''
+    context = multiprocessing.get_context()
+    ready, go = context.Barrier(concurrency + 1), context.Event()
+    start, results = context.Value('d', 0.0), context.Queue()
+
+    count = schedule_args.pop('count')
+    processes = []
+    for worker in range(concurrency):
+        worker_args = dict(schedule_args, count=count, offset=worker, step=concurrency)
+        process = context.Process(target=_process_client, args=(target_args, workload, worker_args, k, ready, go, start, results))
+        process.start()
+        processes.append(process)
+        sampler.pids[f'worker{worker}'] = process.pid
+    sampler.start()  # once the workers are forked
+
+    try:
+        ready.wait(WORKER_START_TIMEOUT)  # every worker has opened its target
+    except threading.BrokenBarrierError:
+        errors = []
+        try:
+            while True:
+                errors.append(results.get(timeout=1.0))
+        except queue.Empty:
+            pass
+        for process in processes:
+            process.terminate()
+            process.join()
+        raise RuntimeError('; '.join(errors) or f'the workers did not open their target within {WORKER_START_TIMEOUT}s')
+    start.value = time.time()
+    go.set()
+
+    records: List[Record] = []
+    for _ in processes:
+        records += results.get()
+    for process in processes:
+        process.join()
+
+    return start.value, records
+
+
+# ----------------------------------------------------------------------------
+# Report
+# ----------------------------------------------------------------------------
+
+class MemorySampler(threading.Thread):
+    '''Samples the resident memory of the processes of <pids> every <interval> seconds'''
+
+    def __init__(self, interval: float, pids: Dict[str, object]):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.pids = pids
+        self.samples: List[Tuple[float, Dict[str, int]]] = []
+        self._stopped = threading.Event()
+
+    def sample(self) -> None:
+        self.samples.append((time.time(), {name: instrumentation.current_rss(pid) for name, pid in list(self.pids.items())}))
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+        self.sample()
+
+
+def histogram(latencies: List[float]) -> List[dict]:
+    '''Number of latencies in every power of two bucket of microseconds, from the first to the last non empty one'''
+    counts: Dict[int, int] = {}
+    for latency in latencies:
+        bucket = (max(1, math.ceil(latency * 1e6)) - 1).bit_length()  # bucket b holds (2^(b-1), 2^b] us
+        counts[bucket] = counts.get(bucket, 0) + 1
+
+    if not counts:
+        return []
+    return [{'le_us': 2**bucket, 'count': counts.get(bucket, 0)} for bucket in range(min(counts), max(counts) + 1)]
+
+
+def timeline(records: List[Record], samples: List[Tuple[float, Dict[str, int]]], start: float, interval: float) -> List[dict]:
+    '''Queries answered, QPS and latency percentiles of every <interval>, with the memory sampled at its end'''
+    latencies: Dict[int, List[float]] = {}
+    errors: Dict[int, int] = {}
+    for sent, latency, _, ok in records:
+        point = int((sent + latency - start) / interval)
+        if ok:
+            latencies.setdefault(point, []).append(latency)
+        else:
+            errors[point] = errors.get(point, 0) + 1
+
+    points = max(list(latencies) + list(errors) + [-1]) + 1
+    rows = []
+    for point in range(points):
+        answered = sorted(latencies.get(point, []))
+        end = start + (point + 1) * interval
+        rss = [memory for when, memory in samples if when <= end]
+        rows.append({
+            'time_s': round((point + 1) * interval, 3),
+            'queries': len(answered),
+            'errors': errors.get(point, 0),
+            'qps': round(len(answered) / interval, 2),
+            'p50_us': instrumentation.percentile(answered, 50) * 1e6,
+            'p99_us': instrumentation.percentile(answered, 99) * 1e6,
+            'rss_bytes': rss[-1] if rss else {},
+        })
+    return rows
+
+
+def summarize(records: List[Record], samples: List[Tuple[float, Dict[str, int]]], start: float, interval: float) -> dict:
+    answered = [latency for _, latency, _, ok in records if ok]
+    elapsed = max([sent + latency for sent, latency, _, _ in records], default=start) - start
+
+    modes: Dict[str, List[float]] = {}
+    for _, latency, mode, ok in records:
+        if ok:
+            modes.setdefault(mode, []).append(latency)
+
+    peak_rss: Dict[str, int] = {}
+    for _, memory in samples:
+        for name, rss in memory.items():
+            peak_rss[name] = max(peak_rss.get(name, 0), rss)
+
+    return {
+        'queries': len(records),
+        'errors': len(records) - len(answered),
+        'elapsed_s': round(elapsed, 6),
+        'qps': round(len(answered) / elapsed, 2) if elapsed else 0.0,
+        'latency': instrumentation.latency_summary(answered),
+        'modes': {mode: instrumentation.latency_summary(latencies) for mode, latencies in sorted(modes.items())},
+        'histogram': histogram(answered),
+        'peak_rss_bytes': peak_rss,
+        'timeline': timeline(records, samples, start, interval),
+    }
+
+
+def format_report(report: dict) -> str:
+    latency = report['latency']
+    lines = [f'{report["queries"]} queries, {report["errors"]} errors in {report["elapsed_s"]:.2f}s: {report["qps"]:.1f} queries/s',
+             f'latency us   mean {latency["mean_us"]:.0f}   p50 {latency["p50_us"]:.0f}   p95 {latency["p95_us"]:.0f}   p99 {latency["p99_us"]:.0f}   max {latency["max_us"]:.0f}']
+
+    top = max([bucket['count'] for bucket in report['histogram']], default=0)
+    for bucket in report['histogram']:
+        lines.append(f'<= {bucket["le_us"]:>9} us {bucket["count"]:>9} {"#" * round(50 * bucket["count"] / top)}')
+
+    for name, rss in report['peak_rss_bytes'].items():
+        lines.append(f'peak rss {name:12}{rss / 2**20:10.1f} MB')
+    return '\n'.join(lines)
+
+
+def compare(old: dict, new: dict) -> str:
+    '''Table of new / old ratios of the throughput and latency percentiles, overall and per mode'''
+
+    lines = [f'{"":12}{"metric":12}{"old":>14}{"new":>14}{"new/old":>10}']
+    rows = [('all', 'qps', old.get('qps'), new['qps'])]
+    for name, previous, latency in [('all', old.get('latency', {}), new['latency'])] + \
+                                   [(mode, old.get('modes', {}).get(mode, {}), latency) for mode, latency in new['modes'].items()]:
+        rows += [(name, metric, previous.get(metric), latency[metric]) for metric in ['p50_us', 'p95_us', 'p99_us']]
+
+    for name, metric, previous, value in rows:
+        if previous:
+            lines.append(f'{name:12}{metric:12}{previous:14.2f}{value:14.2f}{value / previous:10.2f}')
+    return '\n'.join(lines)
+
+
+def run():
+    args = init_params()
+    utils.ensure_dir_exists('output')
+
+    if args.log != None:
+        workload = read_query_log(args.log, args.mode)
+    else:
+        workload = zipf_workload(args.input_file, args.queries, args.zipf, args.mode, args.terms_per_query, args.seed)
+    if not workload:
+        sys.exit(f'No queries to send in {args.log or args.input_file}')
+
+    count = args.queries if args.duration == None else None
+    schedule_args = {'count': count, 'duration': args.duration, 'qps': args.qps}
+    target_args = (args.target, args.input_file, args.cache_size, args.cache_policy)
+
+    pids: Dict[str, object] = {'loadgen': 'self'}
+    if args.server_pid != None:
+        pids['server'] = args.server_pid
+    sampler = MemorySampler(args.interval, pids)
+
+    amount = f'{count} queries' if count != None else f'queries for {args.duration}s'
+    print(f'Sending {amount} from {args.concurrency} {args.model} to {args.target or args.input_file}, the workload has {len(workload)} queries')
+
+    if args.model == 'processes':
+        try:
+            start, records = run_processes(target_args, workload, schedule_args, args.k, args.concurrency, sampler)
+        except RuntimeError as e:
+            sys.exit(str(e))
+    else:
+        target = open_target(*target_args)
+        sampler.start()
+        start = time.time()
+        schedule = Schedule(workload, start, **schedule_args)
+        run_model = run_threads if args.model == 'threads' else run_asyncio
+        records = run_model(target, schedule, args.k, args.concurrency)
+    sampler.stop()
+
+    report = summarize(records, sampler.samples, start, args.interval)
+    report['config'] = {'workload': args.log or f'zipf({args.zipf}) over {args.input_file}', 'mode': args.mode, 'target': args.target or 'local',
+                        'model': args.model, 'concurrency': args.concurrency, 'qps': args.qps, 'duration': args.duration, 'queries': count,
+                        'commit': instrumentation.git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    print(format_report(report))
+    utils.write_json_obj_2_disk(report, args.output_file, indentation=4)
+    print(f'\nReport written into {args.output_file}')
+
+    if args.compare != None:
+        print(compare(utils.load_json_from_disk(args.compare), report))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,197 @@
+'''
+Positional index, used by phrase ("interest rates") and proximity (oil /3
+prices) queries. It lives in its own file next to the inverted index
+(<index file>.pos), in the binary index format with the 'positions' codec, so
+queries that don't need positions never read it.
+
+Every postings list is [(docID, [positions])] where positions are the token
+numbers of the term in the document, counted from 0.
+'''
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from tqdm import tqdm
+import os
+import sys
+import binary_index
+
+PositionalPostings = List[Tuple[int, List[int]]]
+
+
+def positional_index_filename(index_file: str) -> str:
+    return f'{index_file}.pos'
+
+
+# Rough cost of the python objects held by the builder, used to decide when to flush a block
+TERM_OVERHEAD = 200  # dict slot, key str and postings list
+DOC_OVERHEAD = 120  # list slot, (docID, positions) tuple, boxed docID and positions list
+POSITION_OVERHEAD = 36  # list slot and boxed int
+
+
+class PositionalIndexBuilder:
+    '''
+    Positional index built from the documents the inverted index is built
+    from, in the same pass over the corpus (see <observe>). Tokens go through
+    the compressor.NORMALIZERS named in <normalizers>, the positions of the
+    dropped tokens are kept so that the other ones keep their distances.
+
+    With a <memory_budget> in bytes, the positions are flushed into sorted
+    blocks of <directory> whenever they reach it, and the blocks are merged
+    when the index is written, like spimi.py does for the postings.
+    '''
+
+    def __init__(self, normalizers: List[str] = (), memory_budget=None, directory=None):
+        import indexer  # only needed to build the index
+
+        self.normalizer_functions = indexer.normalizer_functions(normalizers)
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.positions: Dict[str, PositionalPostings] = {}
+        self.size = 0
+        self.blocks: List[str] = []
+
+    def add(self, docID: int, doc: str) -> None:
+        '''Adds the positions of <doc>, docIDs must be given in increasing order'''
+        import pipeline
+
+        doc_positions: Dict[str, List[int]] = {}
+        for position, token in enumerate(pipeline.tokenize(doc)):
+            token = pipeline.normalize_token(token, self.normalizer_functions)
+            if token == None:
+                continue
+            doc_positions.setdefault(token, []).append(position)
+
+        for token, positions in doc_positions.items():
+            self._append(token, docID, positions)
+
+    def add_partial(self, items: Iterable[Tuple[str, Tuple[int, PositionalPostings]]], docs_so_far: int) -> None:
+        '''Adds the positional index of a single file, its docIDs shifted by <docs_so_far>'''
+        for token, (_, postings) in items:
+            for docID, positions in postings:
+                self._append(token, docID + docs_so_far, positions)
+
+    def _append(self, token: str, docID: int, positions: List[int]) -> None:
+        postings = self.positions.get(token)
+        if postings == None:
+            postings = self.positions[token] = []
+            self.size += TERM_OVERHEAD + sys.getsizeof(token)
+        postings.append((docID, positions))
+        self.size += DOC_OVERHEAD + POSITION_OVERHEAD * len(positions)
+
+        if self.memory_budget != None and self.size >= self.memory_budget:
+            self.flush()
+
+    def observe(self, docs: Iterable[Tuple[int, str]]) -> Iterable[Tuple[int, str]]:
+        '''Passes the (docID, doc) stream <docs> through, adding every document on the way'''
+        for docID, doc in docs:
+            self.add(docID, doc)
+            yield docID, doc
+
+    def flush(self) -> None:
+        import spimi
+
+        if self.positions:
+            self.blocks.append(spimi.write_block(self.positions, self.directory, len(self.blocks), prefix='positions'))
+        self.positions = {}
+        self.size = 0
+
+    def items(self) -> Iterable[Tuple[str, Tuple[int, PositionalPostings]]]:
+        '''Positional index sorted by term, merged from the blocks when some were flushed'''
+        if not self.blocks:
+            return ((token, (len(postings), postings)) for token, postings in sorted(self.positions.items()))
+
+        import spimi
+
+        self.flush()
+        return ((token, (frequency, [(docID, positions) for docID, positions in postings]))
+                for token, (frequency, postings) in spimi.merge_blocks(self.blocks))
+
+    def write(self, index_file: str) -> None:
+        '''Writes the positional index next to <index_file>'''
+        outfile = positional_index_filename(index_file)
+        print(f'\nWriting positional index into file {outfile}')
+        binary_index.write_binary_index(tqdm(self.items()), outfile, codec='positions')
+
+
+def generate_positional_index(docs: Iterable[Tuple[int, str]], normalizers: List[str] = ()) -> Dict[str, Tuple[int, PositionalPostings]]:
+    '''
+    Positional index of <docs>, an iterable of (docID, doc) in increasing
+    docID order as yielded by pipeline.extract_documents, held in memory.
+    '''
+
+    builder = PositionalIndexBuilder(normalizers)
+    for docID, doc in docs:
+        builder.add(docID, doc)
+    return dict(builder.items())
+
+
+def open_positional_index(index_file: str) -> Optional[binary_index.MmapIndex]:
+    '''
+    Memory maps the positional index of <index_file>, None if it was not
+    built. A segment directory (see segments.py) has none, the delta segments
+    carry no positions.
+    '''
+
+    filename = positional_index_filename(index_file)
+    if os.path.isdir(index_file) or not os.path.isfile(filename):
+        return None
+    return binary_index.MmapIndex(filename)
+
+
+def _positional_postings(token: str, positional_index) -> PositionalPostings:
+    return positional_index[token][1] if token in positional_index else []
+
+
+def _intersect_documents(p1: PositionalPostings, p2: PositionalPostings) -> List[Tuple[int, List[int], List[int]]]:
+    '''Linear merge of two positional postings lists, (docID, positions1, positions2) of the common docs'''
+
+    common = []
+    i = j = 0
+    while i < len(p1) and j < len(p2):
+        if p1[i][0] == p2[j][0]:
+            common.append((p1[i][0], p1[i][1], p2[j][1]))
+            i += 1
+            j += 1
+        elif p1[i][0] < p2[j][0]:
+            i += 1
+        else:
+            j += 1
+    return common
+
+
+def phrase(tokens: List[str], positional_index) -> List[int]:
+    '''
+    Documents where <tokens> appear next to each other in that order. The
+    candidates are the start positions of the phrase, narrowed down one token
+    at a time with a positional intersection.
+    '''
+
+    if not tokens:
+        return []
+
+    candidates: PositionalPostings = _positional_postings(tokens[0], positional_index)
+
+    for offset, token in enumerate(tokens[1:], start=1):
+        narrowed = []
+        for docID, starts, positions in _intersect_documents(candidates, _positional_postings(token, positional_index)):
+            wanted = set(positions)
+            kept = [start for start in starts if start + offset in wanted]
+            if kept:
+                narrowed.append((docID, kept))
+        candidates = narrowed
+
+    return [docID for docID, _ in candidates]
+
+
+def near(token1: str, token2: str, k: int, positional_index) -> List[int]:
+    '''Documents where <token1> and <token2> are at most <k> tokens apart, in any order'''
+
+    answer = []
+    for docID, positions1, positions2 in _intersect_documents(_positional_postings(token1, positional_index), _positional_postings(token2, positional_index)):
+        j = 0
+        for position in positions1:  # both lists are sorted, slide a window over positions2
+            while j < len(positions2) and positions2[j] < position - k:
+                j += 1
+            if j < len(positions2) and positions2[j] <= position + k:
+                answer.append(docID)
+                break
+    return answer
@@ -0,0 +1,326 @@
+'''
+Postings compression. Every codec stores the gaps between consecutive docIDs
+of a sorted postings list instead of the docIDs themselves, which keeps the
+numbers small for frequent terms. The first gap is counted from -1 so that
+every gap is >= 1, which the Elias codes require.
+
+Every encoded list, except for the raw and hybrid ones, starts with the
+variable-byte encoded number of postings, which tells the decoders where to
+stop.
+'''
+
+import sys
+from array import array
+from typing import Callable, Dict, Iterable, List, Tuple
+import bitset
+
+BIG_ENDIAN_HOST = sys.byteorder == 'big'
+PFOR_BLOCK_SIZE = 128
+
+
+def to_gaps(postings_list: Iterable[int]) -> List[int]:
+    '''Turns a sorted postings list into its gaps'''
+    gaps = []
+    previous = -1
+    for docID in postings_list:
+        gaps.append(docID - previous)
+        previous = docID
+    return gaps
+
+
+def from_gaps(gaps: Iterable[int]) -> List[int]:
+    '''Inverse of <to_gaps>'''
+    postings_list = []
+    docID = -1
+    for gap in gaps:
+        docID += gap
+        postings_list.append(docID)
+    return postings_list
+
+
+# ----------------------------------------------------------------------------
+# Variable byte
+# ----------------------------------------------------------------------------
+
+def vbyte_encode_number(n: int) -> bytearray:
+    '''7 bits per byte, the high bit marks the last byte of the number'''
+    encoded = bytearray()
+    while True:
+        encoded.insert(0, n & 0x7f)
+        if n < 128:
+            break
+        n >>= 7
+    encoded[-1] |= 0x80
+    return encoded
+
+
+def vbyte_encode_numbers(numbers: Iterable[int]) -> bytes:
+    encoded = bytearray()
+    for n in numbers:
+        encoded += vbyte_encode_number(n)
+    return bytes(encoded)
+
+
+def vbyte_decode_numbers(data: bytes, count: int = -1, start: int = 0) -> Tuple[List[int], int]:
+    '''
+    Decodes <count> numbers (all of them when <count> is negative) starting at
+    byte <start>. Returns the numbers and the position right after the last one.
+    '''
+    numbers = []
+    n = 0
+    i = start
+    end = len(data)
+    while i < end and count != len(numbers):
+        byte = data[i]
+        i += 1
+        if byte < 128:
+            n = (n << 7) | byte
+        else:
+            numbers.append((n << 7) | (byte & 0x7f))
+            n = 0
+    return numbers, i
+
+
+def vbyte_encode(postings_list: List[int]) -> bytes:
+    return vbyte_encode_numbers([len(postings_list)] + to_gaps(postings_list))
+
+
+def vbyte_decode(data: bytes) -> List[int]:
+    (count,), start = vbyte_decode_numbers(data, 1)
+    gaps, _ = vbyte_decode_numbers(data, count, start)
+    return from_gaps(gaps)
+
+
+# ----------------------------------------------------------------------------
+# Elias gamma and delta, written as a string of bits then packed into bytes
+# ----------------------------------------------------------------------------
+
+def _bits_to_bytes(bits: str) -> bytes:
+    if not bits:
+        return b''
+    padding = -len(bits) % 8
+    return int(bits + '0' * padding, 2).to_bytes((len(bits) + padding) // 8, 'big')
+
+
+def _bytes_to_bits(data: bytes) -> str:
+    if not data:
+        return ''
+    return bin(int.from_bytes(data, 'big'))[2:].zfill(8 * len(data))
+
+
+def _gamma_bits(n: int) -> str:
+    binary = bin(n)[2:]
+    return '0' * (len(binary) - 1) + binary
+
+
+def _delta_bits(n: int) -> str:
+    binary = bin(n)[2:]
+    return _gamma_bits(len(binary)) + binary[1:]
+
+
+def _read_gamma(bits: str, i: int) -> Tuple[int, int]:
+    zeros = bits.index('1', i) - i
+    end = i + 2 * zeros + 1
+    return int(bits[i + zeros:end], 2), end
+
+
+def _read_delta(bits: str, i: int) -> Tuple[int, int]:
+    length, i = _read_gamma(bits, i)
+    end = i + length - 1
+    return int('1' + bits[i:end], 2), end
+
+
+def _elias_encode(postings_list: List[int], code: Callable[[int], str]) -> bytes:
+    header = vbyte_encode_number(len(postings_list))
+    return bytes(header) + _bits_to_bytes(''.join(code(gap) for gap in to_gaps(postings_list)))
+
+
+def _elias_decode(data: bytes, read: Callable[[str, int], Tuple[int, int]]) -> List[int]:
+    (count,), start = vbyte_decode_numbers(data, 1)
+    bits = _bytes_to_bits(data[start:])
+    gaps = []
+    i = 0
+    for _ in range(count):
+        gap, i = read(bits, i)
+        gaps.append(gap)
+    return from_gaps(gaps)
+
+
+def gamma_encode(postings_list: List[int]) -> bytes:
+    return _elias_encode(postings_list, _gamma_bits)
+
+
+def gamma_decode(data: bytes) -> List[int]:
+    return _elias_decode(data, _read_gamma)
+
+
+def delta_encode(postings_list: List[int]) -> bytes:
+    return _elias_encode(postings_list, _delta_bits)
+
+
+def delta_decode(data: bytes) -> List[int]:
+    return _elias_decode(data, _read_delta)
+
+
+# ----------------------------------------------------------------------------
+# PForDelta: blocks of gaps packed with a fixed bit width, the few gaps that
+# don't fit are stored apart as exceptions
+# ----------------------------------------------------------------------------
+
+def _pfor_bit_width(block: List[int]) -> int:
+    '''Smallest width that fits at least 90% of the gaps of the block'''
+    widths = sorted(gap.bit_length() for gap in block)
+    return widths[max(0, (len(widths) * 9 + 9) // 10 - 1)]
+
+
+def pfor_encode(postings_list: List[int]) -> bytes:
+    gaps = to_gaps(postings_list)
+    encoded = bytearray(vbyte_encode_number(len(gaps)))
+
+    for block_start in range(0, len(gaps), PFOR_BLOCK_SIZE):
+        block = gaps[block_start:block_start + PFOR_BLOCK_SIZE]
+        width = _pfor_bit_width(block)
+        limit = 1 << width
+
+        packed = 0
+        exceptions = []
+        for i, gap in enumerate(block):
+            if gap < limit:
+                packed |= gap << (i * width)
+            else:
+                exceptions += [i, gap]
+
+        encoded.append(width)
+        encoded += vbyte_encode_number(len(exceptions) // 2)
+        encoded += packed.to_bytes((len(block) * width + 7) // 8, 'little')
+        encoded += vbyte_encode_numbers(exceptions)
+
+    return bytes(encoded)
+
+
+def pfor_decode(data: bytes) -> List[int]:
+    (count,), i = vbyte_decode_numbers(data, 1)
+    gaps = []
+
+    while len(gaps) < count:
+        size = min(PFOR_BLOCK_SIZE, count - len(gaps))
+        width = data[i]
+        (exception_count,), i = vbyte_decode_numbers(data, 1, i + 1)
+
+        packed_size = (size * width + 7) // 8
+        packed = int.from_bytes(data[i:i + packed_size], 'little')
+        i += packed_size
+        mask = (1 << width) - 1
+        block = [(packed >> (j * width)) & mask for j in range(size)]
+
+        exceptions, i = vbyte_decode_numbers(data, 2 * exception_count, i)
+        for j in range(0, len(exceptions), 2):
+            block[exceptions[j]] = exceptions[j + 1]
+
+        gaps += block
+
+    return from_gaps(gaps)
+
+
+# ----------------------------------------------------------------------------
+# Raw: plain uint32 docIDs, no gaps
+# ----------------------------------------------------------------------------
+
+def raw_encode(postings_list: List[int]) -> bytes:
+    packed = array('I', postings_list)
+    if BIG_ENDIAN_HOST:
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def raw_decode(data: bytes) -> List[int]:
+    packed = array('I')
+    packed.frombytes(data)
+    if BIG_ENDIAN_HOST:
+        packed.byteswap()
+    return packed.tolist()
+
+
+# ----------------------------------------------------------------------------
+# Hybrid: every list is stored as a bitset or variable bytes, whichever is
+# smaller (see bitset.py), after a byte telling which one it is
+# ----------------------------------------------------------------------------
+
+HYBRID_SPARSE = 0
+HYBRID_BITSET = 1
+
+
+def hybrid_encode(postings_list: List[int]) -> bytes:
+    sparse = vbyte_encode(postings_list)
+    if len(postings_list) >= bitset.MIN_POSTINGS and postings_list[-1] // 8 + 1 < len(sparse):
+        return bytes([HYBRID_BITSET]) + bitset.Bitset.from_postings(postings_list).to_bytes()
+    return bytes([HYBRID_SPARSE]) + sparse
+
+
+def hybrid_decode_postings(data: bytes) -> bitset.Postings:
+    '''The Bitset of a dense list, the list of a sparse one'''
+    if data[0] == HYBRID_BITSET:
+        return bitset.Bitset.from_bytes(data[1:])
+    return vbyte_decode(data[1:])
+
+
+def hybrid_decode(data: bytes) -> List[int]:
+    return bitset.as_list(hybrid_decode_postings(data))
+
+
+# ----------------------------------------------------------------------------
+# Positions: postings of a positional index, [(docID, [positions])], with the
+# docIDs and the positions within each document gap encoded as variable bytes
+# ----------------------------------------------------------------------------
+
+def positions_encode(positional_postings: List[Tuple[int, List[int]]]) -> bytes:
+    numbers = [len(positional_postings)]
+    previous = -1
+    for docID, positions in positional_postings:
+        numbers += [docID - previous, len(positions)] + to_gaps(positions)
+        previous = docID
+    return vbyte_encode_numbers(numbers)
+
+
+def positions_decode(data: bytes) -> List[Tuple[int, List[int]]]:
+    (count,), i = vbyte_decode_numbers(data, 1)
+    positional_postings = []
+    docID = -1
+    for _ in range(count):
+        (gap, position_count), i = vbyte_decode_numbers(data, 2, i)
+        position_gaps, i = vbyte_decode_numbers(data, position_count, i)
+        docID += gap
+        positional_postings.append((docID, from_gaps(position_gaps)))
+    return positional_postings
+
+
+# The position of a codec in this dict is its id in the binary index header,
+# so new codecs must be appended at the end.
+CODECS: Dict[str, Tuple[Callable[[List[int]], bytes], Callable[[bytes], List[int]]]] = {
+    'raw': (raw_encode, raw_decode),
+    'vbyte': (vbyte_encode, vbyte_decode),
+    'gamma': (gamma_encode, gamma_decode),
+    'delta': (delta_encode, delta_decode),
+    'pfor': (pfor_encode, pfor_decode),
+    'positions': (positions_encode, positions_decode),
+    'hybrid': (hybrid_encode, hybrid_decode),
+}
+
+# Codecs of plain docID postings lists, the others encode richer postings
+DOCID_CODECS = ['raw', 'vbyte', 'gamma', 'delta', 'pfor', 'hybrid']
+
+
+def codec_id(codec: str) -> int:
+    return list(CODECS).index(codec)
+
+
+def codec_name(id: int) -> str:
+    return list(CODECS)[id]
+
+
+def encode(postings_list: List[int], codec: str) -> bytes:
+    return CODECS[codec][0](postings_list)
+
+
+def decode(data: bytes, codec: str) -> List[int]:
+    return CODECS[codec][1](data)
@@ -1,28 +1,53 @@
-'''This file will allow you to query the inverted index created by the indexer'''
+'''
+This file will allow you to query the inverted index created by the indexer.
+
+Scripts call it once per query, so its startup time matters more than anything
+else: only the modules of the lookup path are imported up front, those of the
+other modes (boolean, ranked, wildcard, shards, fields) are imported by the
+mode that needs them, and a single term is looked up on disk (see
+utils.IndexFile) instead of loading the whole index.
+
+Queries can use field terms (title:oil) and filters (topic:grain, place:usa,
+date:1987-03-01..1987-03-31) when the index was built with --fields, see
+fields.py.
+'''
 
 import argparse
-import sys
 import os
 from typing import Tuple, List, Dict
-import json
-from tqdm import tqdm
 import utils
-from utils import ensure_dir_exists
+import instrumentation
+from utils import ensure_dir_exists, load_index  # test_index_loader.py loads the index with query.load_index
 
 
-def init_params():
+def argument_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description='Process command line arguments')
     parser.add_argument('-i', '--input_file', default='output/inverted_index.txt', help='Input file')
     parser.add_argument('-q', '--query_string', default=None, help='Input file')
+    parser.add_argument('-m', '--mode', default='term', choices=['term', 'boolean', 'ranked', 'wildcard'], help='single term lookup, boolean query with AND, OR, NOT, parentheses, "phrases" and /k proximity, BM25 ranking or wildcard terms like oil* and o*l')
+    parser.add_argument('-k', '--top_k', type=int, default=10, help='Number of documents returned by ranked queries')
     parser.add_argument('-o', '--output_file', default='output/sampleQueries.json', help='Output file')  # Does not include any directory names, strictly the filenames
-    args = parser.parse_args()
+    instrumentation.add_arguments(parser)
+    return parser
 
-    return args
 
+def init_params():
+    parser = argument_parser()
+    args = parser.parse_args()
 
+    if args.input_file.endswith('.shards'):
+        import sharding
+        if args.mode not in sharding.MODES:
+            parser.error(f'a shard manifest answers {" and ".join(sharding.MODES)} queries, not {args.mode} queries')
+        if args.query_string != None and ':' in args.query_string:
+            import fields
+            if fields.FILTER.search(args.query_string):  # indexer.py builds no doc values for shards
+                parser.error('a shard manifest has no doc values, its queries take no filters')
 
+    return args
 
 
+@instrumentation.instrumented('query.term')
 def exec_query(query: str, index: Dict[str, Tuple[int, List[int]]]) -> Dict[str, dict]:
     # query_file = 'sampleQueries.json'
 
@@ -63,9 +88,57 @@ def ensure_query_file(qfile: str):
         f.write("{}")  # because we want utils.load_json_from_disk to load an empty dict instead of raising an exception
 
 
-if __name__ == '__main__':
+def answer(args, query_string: str, filters: List[Tuple[str, str]], index_file: str) -> Dict[str, dict]:
+    '''
+    Result of <query_string> in the mode of <args>, keyed by the full query of
+    <args>, restricted to the documents matching <filters>.
+    '''
 
+    if filters or ':' in query_string:
+        import fields
+    if not query_string:
+        result: dict = {}  # only filters
+    elif args.input_file.endswith('.shards'):  # sharding starts worker processes, only imported for a manifest
+        import sharding
+        with sharding.QueryCoordinator(args.input_file) as coordinator:
+            result: dict = coordinator.exec_query(query_string, args.mode)
+    elif args.mode == 'ranked':
+        import ranking
+        ranked_index = ranking.load_ranked_index(ranking.ranked_index_filename(args.input_file), on_disk=True)
+        docvalues = fields.open_docvalues(index_file) if filters else None
+        filter_bits = fields.filter_bitmap(filters, docvalues) if docvalues != None else None  # filtered during the top k search, not after it
+        result: dict = ranking.exec_ranked_query(query_string, ranked_index, args.top_k, filter_bits)
+        if filter_bits != None:  # already filtered, keyed by the query with its filters like apply_filters does
+            return {args.query_string: result[query_string]}
+    elif args.mode == 'boolean':
+        import boolean_query
+        import positional
+        inv_index: Dict[str, Tuple[int, List[int]]] = utils.open_index(args.input_file)
+        if ':' in query_string:
+            inv_index = fields.open_fielded_index(inv_index, args.input_file)
+        positional_index = positional.open_positional_index(args.input_file)
+        docvalues = fields.open_docvalues(args.input_file) if ':' in query_string else None
+        result: dict = boolean_query.exec_boolean_query(query_string, inv_index, positional_index, docvalues)
+    elif args.mode == 'wildcard':
+        import term_dictionary
+        inv_index = utils.open_index(args.input_file, on_disk=True)
+        dictionary = term_dictionary.open_term_dictionary(args.input_file)
+        result: dict = term_dictionary.exec_wildcard_query(query_string, inv_index, dictionary)
+    else:
+        inv_index = utils.open_index(args.input_file, on_disk=True)
+        if ':' in query_string:
+            inv_index = fields.open_fielded_index(inv_index, args.input_file)
+        result: dict = exec_query(query_string, inv_index)
+
+    if filters:
+        result = fields.apply_filters(result, args.query_string, filters, fields.open_docvalues(index_file))
+
+    return result
+
+
+def run():
     args = init_params()
+    instrumentation.setup(args)
     utils.ensure_dir_exists('output')
     ensure_query_file(args.output_file)
 
@@ -73,9 +146,22 @@ if __name__ == '__main__':
         print("Please provide a query str with flag -q")
         exit()
 
-    inv_index: Dict[str, Tuple[int, List[int]]] = utils.load_index(args.input_file)
+    query_string, filters = args.query_string, []
+    if ':' in query_string:
+        import fields
+        if args.mode != 'boolean':  # boolean queries keep their filters as operands, see boolean_query.parse
+            query_string, filters = fields.split_filters(query_string)
+
+    if args.input_file.endswith('.shards'):
+        index_file = args.input_file[:-len('.shards')]
+    else:
+        index_file = args.input_file
+
+    try:
+        result = answer(args, query_string, filters, index_file)
+    except (ValueError, OSError) as e:  # bad query or filter syntax, sidecar files that were not built
+        argument_parser().error(str(e))
 
-    result: dict = exec_query(args.query_string, inv_index)
     x = result[args.query_string]
     print(f'<{args.query_string}> query was {x["message"]}: {x["frequency"]} hits found')
 
@@ -86,3 +172,9 @@ if __name__ == '__main__':
     queries.update(result)
 
     utils.write_json_obj_2_disk(queries, args.output_file, indentation=4)
+
+    instrumentation.finish(args)
+
+
+if __name__ == '__main__':
+    run()
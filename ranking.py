@@ -0,0 +1,264 @@
+'''
+Ranked retrieval with BM25. The ranked index is written next to the inverted
+index (<index file>.ranked) and holds, for every term, its (docID, term
+frequency) postings and the highest BM25 score any of its postings can reach.
+Those upper bounds let the WAND top-k search skip the documents that cannot
+make it into the results, so most postings of frequent terms never get scored.
+
+The first line of the file holds the collection statistics, the following ones
+are [term, [document frequency, max score, [[docID, tf], ...]]] sorted by term,
+so query.py looks up the few terms of its query on disk (see
+RankedPostingsFile) instead of decoding the whole file.
+'''
+
+import bisect
+import heapq
+import json
+import math
+import operator
+from typing import Dict, Iterator, List, Tuple
+from tqdm import tqdm
+import bitset
+import instrumentation
+import utils
+
+K1 = 1.2
+B = 0.75
+
+
+def ranked_index_filename(index_file: str) -> str:
+    return f'{index_file}.ranked'
+
+
+def idf(document_frequency: int, doc_count: int) -> float:
+    return math.log(1 + (doc_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def bm25(tf: int, doc_length: int, term_idf: float, avgdl: float, k1=K1, b=B) -> float:
+    return term_idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_length / avgdl))
+
+
+class RankedIndex:
+    '''Term frequencies, document lengths and per term score upper bounds'''
+
+    def __init__(self, postings: Dict[str, Tuple[int, float, List[Tuple[int, int]]]], doc_lengths: Dict[int, int], k1=K1, b=B):
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.doc_count = len(doc_lengths)
+        self.avgdl = sum(doc_lengths.values()) / self.doc_count if self.doc_count else 0.0
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, tf_index: Dict[str, Tuple[int, List[Tuple[int, int]]]], doc_lengths: Dict[int, int], k1=K1, b=B):
+        '''Precomputes the max score of every term of <tf_index>, as returned by pipeline.accumulate_tf_postings'''
+
+        ranked = cls({}, doc_lengths, k1, b)
+        for token, (frequency, tf_postings) in tqdm(tf_index.items()):
+            term_idf = idf(frequency, ranked.doc_count)
+            max_score = max([bm25(tf, doc_lengths.get(docId, 0), term_idf, ranked.avgdl, k1, b) for docId, tf in tf_postings], default=0.0)
+            ranked.postings[token] = (frequency, max_score, tf_postings)
+
+        return ranked
+
+    def idf(self, token: str) -> float:
+        return idf(self.postings[token][0], self.doc_count)
+
+    def score(self, token: str, docId: int, tf: int) -> float:
+        return bm25(tf, self.doc_lengths.get(docId, 0), self.idf(token), self.avgdl, self.k1, self.b)
+
+
+def save_ranked_index(ranked: RankedIndex, outfile: str) -> None:
+
+    header = {
+        'k1': ranked.k1,
+        'b': ranked.b,
+        'doc_lengths': sorted(ranked.doc_lengths.items()),
+    }
+    lines = [header] + sorted(ranked.postings.items(), key=lambda token: token[0])
+    utils.write2disk(lines, outfile)
+
+
+class RankedPostingsFile(utils.IndexFile):
+    '''
+    Postings of a .ranked file looked up on disk, after its header line (see
+    utils.IndexFile). A term is decoded once, as it is read for every score.
+    '''
+
+    def __init__(self, filename: str, start: int):
+        super().__init__(filename, start)
+        self._decoded: Dict[str, Tuple[int, float, List[Tuple[int, int]]]] = {}
+
+    def __getitem__(self, term: str) -> Tuple[int, float, List[Tuple[int, int]]]:
+        if term not in self._decoded:
+            line = self.get_line(term) if isinstance(term, str) else None
+            if line == None:
+                raise KeyError(term)
+            _, self._decoded[term] = json.loads(line)
+        return self._decoded[term]
+
+    def __iter__(self) -> Iterator[str]:
+        with open(self.filename, mode='rb') as file:
+            file.seek(self.start)
+            for line in file:
+                yield self._term(line)
+
+    def __len__(self) -> int:
+        return sum([1 for _ in self])
+
+
+def load_ranked_index(filename: str, on_disk=False) -> RankedIndex:
+    '''
+    Ranked index stored in <filename>, its postings fully loaded or looked up
+    on disk with <on_disk>
+    '''
+
+    print(f"\nLoading ranked index from {filename}")
+
+    with open(filename, mode='rb') as file:
+        header_line = file.readline()
+        header: dict = json.loads(header_line)
+        postings: Dict[str, Tuple[int, float, List[Tuple[int, int]]]] = {}
+
+        if on_disk:
+            postings = RankedPostingsFile(filename, len(header_line))
+        else:
+            for line in tqdm(file):
+                token, (frequency, max_score, tf_postings) = json.loads(line)
+                postings[token] = (frequency, max_score, [tuple(p) for p in tf_postings])
+
+    return RankedIndex(postings, dict(header['doc_lengths']), header['k1'], header['b'])
+
+
+class Cursor:
+    '''Position in the (docID, tf) postings list of a query term, read in place'''
+
+    def __init__(self, token: str, ranked: RankedIndex):
+        frequency, self.max_score, self.tf_postings = ranked.postings[token]
+        self.token = token
+        self.position = 0
+
+    def doc(self) -> float:
+        return self.tf_postings[self.position][0] if self.position < len(self.tf_postings) else math.inf
+
+    def tf(self) -> int:
+        return self.tf_postings[self.position][1]
+
+    def next(self) -> None:
+        self.position += 1
+
+    def advance_to(self, docId: int) -> None:
+        '''Moves to the first posting >= docId'''
+        self.position = bisect.bisect_left(self.tf_postings, docId, self.position, key=operator.itemgetter(0))
+
+
+def _push(heap: List[Tuple[float, int]], k: int, score: float, docId: int) -> None:
+    if len(heap) < k:
+        heapq.heappush(heap, (score, -docId))
+    elif (score, -docId) > heap[0]:
+        heapq.heapreplace(heap, (score, -docId))
+
+
+def _ranked(heap: List[Tuple[float, int]]) -> List[Tuple[int, float]]:
+    return [(-negative_docId, score) for score, negative_docId in sorted(heap, reverse=True)]
+
+
+def _accepted(filter_bits: int):
+    '''Test of the docIDs whose bit is set in <filter_bits>, every docID when it is None'''
+    if filter_bits == None:
+        return lambda docId: True
+    data = bitset.to_bytes(filter_bits)
+    return lambda docId: docId >> 3 < len(data) and data[docId >> 3] >> (docId & 7) & 1 == 1
+
+
+def top_k_exhaustive(query_terms: List[str], ranked: RankedIndex, k: int, filter_bits: int = None) -> List[Tuple[int, float]]:
+    '''Scores every posting of the query terms, mostly useful to check <top_k_wand>'''
+
+    if k <= 0:
+        return []
+
+    accepted = _accepted(filter_bits)
+    scores: Dict[int, float] = {}
+    for token in sorted(set(query_terms)):
+        if token in ranked.postings:
+            for docId, tf in ranked.postings[token][2]:
+                if accepted(docId):
+                    scores[docId] = scores.get(docId, 0.0) + ranked.score(token, docId, tf)
+
+    heap: List[Tuple[float, int]] = []
+    for docId, score in scores.items():
+        _push(heap, k, score, docId)
+    return _ranked(heap)
+
+
+def top_k_wand(query_terms: List[str], ranked: RankedIndex, k: int, filter_bits: int = None) -> List[Tuple[int, float]]:
+    '''
+    Top <k> (docID, score) for the disjunction of <query_terms> with the WAND
+    algorithm. Cursors are kept sorted by current docID and the pivot is the
+    first cursor at which the summed max scores beat the score of the k-th
+    best document so far. Documents before the pivot cannot beat it and are
+    skipped without being scored, and so are the documents whose bit is not
+    set in <filter_bits> (see fields.filter_bitmap) when it is given.
+    '''
+
+    if k <= 0:
+        return []
+
+    accepted = _accepted(filter_bits)
+    cursors = [Cursor(token, ranked) for token in sorted(set(query_terms)) if token in ranked.postings]
+    heap: List[Tuple[float, int]] = []
+
+    while True:
+        cursors.sort(key=Cursor.doc)
+        threshold = heap[0][0] if len(heap) == k else 0.0
+
+        pivot = None
+        upper_bound = 0.0
+        for i, cursor in enumerate(cursors):
+            if cursor.doc() == math.inf:
+                break
+            upper_bound += cursor.max_score
+            if upper_bound >= threshold:  # ties can still win on docID
+                pivot = i
+                break
+
+        if pivot == None:
+            break
+
+        pivot_doc = cursors[pivot].doc()
+
+        if cursors[0].doc() == pivot_doc:
+            matching = [cursor for cursor in cursors if cursor.doc() == pivot_doc]
+            if not accepted(pivot_doc):
+                for cursor in matching:
+                    cursor.next()
+                continue
+            score = 0.0
+            for cursor in sorted(matching, key=lambda cursor: cursor.token):  # same summation order as top_k_exhaustive
+                score += ranked.score(cursor.token, pivot_doc, cursor.tf())
+                cursor.next()
+            _push(heap, k, score, pivot_doc)
+
+        else:
+            for cursor in cursors[:pivot]:
+                cursor.advance_to(pivot_doc)
+
+    return _ranked(heap)
+
+
+@instrumentation.instrumented('query.ranked')
+def exec_ranked_query(query: str, ranked: RankedIndex, k=10, filter_bits: int = None) -> Dict[str, dict]:
+    '''
+    BM25 top <k> for the words of <query>, among the documents of
+    <filter_bits> when given. Same result format as query.exec_query, with the
+    postings ordered by decreasing score.
+    '''
+
+    results = top_k_wand(query.split(), ranked, k, filter_bits)
+
+    return {
+        query: {'frequency': len(results),
+                'postings': [docId for docId, _ in results],
+                'scores': [round(score, 4) for _, score in results],
+                'message': 'successful' if results else 'unsuccessful'}
+    }
@@ -0,0 +1,378 @@
+'''
+Incremental index updates. Instead of rebuilding the whole index with
+indexer.run_one_shot, new documents are indexed into small delta segments and
+deleted documents are recorded in a tombstone bitmap. A segment directory
+holds:
+
+    manifest.json       the main index, its normalizers, the segments and the number of docIDs given so far
+    tombstones.bin      one bit per docID, set when the document was deleted
+    segNNNNN.bin        delta segments, in the binary index format
+
+New documents get the docIDs following the last one given, so the main index
+and the segments hold increasing docID ranges and the postings of a term are
+merged by concatenation. Segments are compacted with logarithmic merging: a
+new segment has level 0 and whenever the two newest segments have the same
+level they are merged into one segment of the next level, so every posting is
+rewritten O(log n) times.
+
+Queries read a snapshot of the main index and segments taken under the lock.
+A merge or a reload retires the files it replaces, and a retired file is only
+closed (and a merged away segment deleted) once the last query reading it is
+done, so queries keep being answered while segments are merged.
+
+utils.open_index opens a segment directory like any other index.
+'''
+
+import argparse
+import heapq
+import json
+import os
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Tuple
+import binary_index
+import compressor
+import indexer
+import pipeline
+import utils
+
+MANIFEST = 'manifest.json'
+TOMBSTONES = 'tombstones.bin'
+SEGMENT_CODEC = 'vbyte'
+
+
+def init_params():
+    parser = argparse.ArgumentParser(description='Process command line arguments')
+    parser.add_argument('-d', '--directory', default='output/segments', help='Segment directory')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    init = subparsers.add_parser('init', help='Create the segment directory on top of a main index')
+    init.add_argument('-i', '--input_file', default='output/inverted_index.txt', help='Main index')
+    init.add_argument('-n', '--normalize', nargs='+', default=[], choices=list(compressor.NORMALIZERS), help='Token normalizations the main index was built with, applied to the added documents')
+
+    add = subparsers.add_parser('add', help='Index .sgm files into a new segment')
+    add.add_argument('files', nargs='+', help='.sgm files')
+    add.add_argument('--no_merge', action='store_true', help='Do not merge segments after adding')
+
+    delete = subparsers.add_parser('delete', help='Delete documents by docID')
+    delete.add_argument('docIDs', nargs='+', type=int, help='docIDs')
+
+    subparsers.add_parser('merge', help='Merge segments of the same level')
+    subparsers.add_parser('status', help='Print the manifest')
+
+    args = parser.parse_args()
+
+    return args
+
+
+def _largest_docID(index) -> int:
+    doc_count = getattr(index, 'doc_count', None)
+    if doc_count != None:
+        return doc_count
+    return max([postings_list[-1] for _, postings_list in index.values() if postings_list], default=0)
+
+
+def create_segment_directory(directory: str, main_index_file: str, normalizers: List[str] = ()) -> None:
+    '''
+    Starts tracking updates on top of <main_index_file>, built with the
+    compressor.NORMALIZERS named in <normalizers>
+    '''
+
+    utils.ensure_dir_exists(directory)
+    index = utils.open_index(main_index_file)
+    manifest = {
+        'main': os.path.abspath(main_index_file),
+        'doc_count': _largest_docID(index),
+        'normalizers': list(normalizers),
+        'next_segment': 0,
+        'segments': [],
+    }
+    _write_manifest(directory, manifest)
+    with open(os.path.join(directory, TOMBSTONES), mode='wb') as f:
+        f.write(bytearray((manifest['doc_count'] + 8) // 8))
+
+
+def _write_manifest(directory: str, manifest: dict) -> None:
+    '''Atomic replace, so readers never see a half written manifest'''
+    tmp = os.path.join(directory, MANIFEST + '.tmp')
+    utils.write_json_obj_2_disk(manifest, tmp, indentation=4)
+    os.replace(tmp, os.path.join(directory, MANIFEST))
+
+
+class Tombstones:
+    '''Bitmap of the deleted docIDs'''
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, mode='rb') as f:
+            self.bits = bytearray(f.read())
+
+    def __contains__(self, docID: int) -> bool:
+        byte = docID >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (docID & 7)))
+
+    def __len__(self) -> int:
+        return sum([bin(byte).count('1') for byte in self.bits])
+
+    def add(self, docID: int) -> None:
+        if docID < 1:
+            raise ValueError(f'docIDs start at 1, got {docID}')
+        byte = docID >> 3
+        if byte >= len(self.bits):
+            self.bits += bytearray(byte + 1 - len(self.bits))
+        self.bits[byte] |= 1 << (docID & 7)
+
+    def save(self) -> None:
+        tmp = self.filename + '.tmp'
+        with open(tmp, mode='wb') as f:
+            f.write(self.bits)
+        os.replace(tmp, self.filename)
+
+
+class SegmentedIndex(Mapping):
+    '''
+    Main index + delta segments - tombstones, with the same interface as the
+    dict returned by utils.load_index.
+    '''
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._merging = None
+        self._merge_lock = threading.Lock()  # one merge at a time, merge and merge_in_background can race for the same pair
+        self._readers: Dict[int, int] = {}  # id of a part -> number of snapshots holding it
+        self._retired: Dict[int, Tuple[object, Optional[str]]] = {}  # id of a part -> (part, file deleted once closed)
+        self.main = None
+        self.segments = []
+        self.reload()
+
+    def reload(self) -> None:
+        '''Rereads the manifest, the tombstones and the segments written by other processes'''
+        with self._lock:
+            retired = [self.main] + self.segments if self.main != None else []
+            self.manifest: dict = utils.load_json_from_disk(os.path.join(self.directory, MANIFEST))
+            self.tombstones = Tombstones(os.path.join(self.directory, TOMBSTONES))
+            self.main = utils.open_index(self.manifest['main'])
+            self.segments = [binary_index.MmapIndex(os.path.join(self.directory, s['file'])) for s in self.manifest['segments']]
+            for part in retired:
+                self._retire(part)
+
+    def close(self) -> None:
+        with self._lock:
+            for part in [self.main] + self.segments:
+                self._retire(part)
+            self.main, self.segments = None, []
+
+    def _acquire(self) -> list:
+        '''Snapshot of the main index and the segments, kept open until it is given back to <_release>'''
+        with self._lock:
+            parts = [self.main] + self.segments
+            for part in parts:
+                self._readers[id(part)] = self._readers.get(id(part), 0) + 1
+        return parts
+
+    def _release(self, parts: list) -> None:
+        with self._lock:
+            for part in parts:
+                self._readers[id(part)] -= 1
+                if self._readers[id(part)] == 0:
+                    del self._readers[id(part)]
+                    if id(part) in self._retired:
+                        self._close(*self._retired.pop(id(part)))
+
+    def _retire(self, part, filename=None) -> None:
+        '''Closes <part> and deletes <filename> now, or when the last snapshot holding <part> is released'''
+        with self._lock:
+            if id(part) in self._readers:
+                self._retired[id(part)] = (part, filename)
+            else:
+                self._close(part, filename)
+
+    @staticmethod
+    def _close(part, filename: Optional[str]) -> None:
+        if hasattr(part, 'close'):  # a text main index is a dict
+            part.close()
+        if filename != None:
+            os.remove(filename)
+
+    @property
+    def doc_count(self) -> int:
+        return self.manifest['doc_count']
+
+    def live_documents(self) -> List[int]:
+        return [docID for docID in range(1, self.doc_count + 1) if docID not in self.tombstones]
+
+    def _postings(self, term: str) -> List[int]:
+        with self._lock:
+            parts = self._acquire()
+            tombstones = self.tombstones
+
+        postings_list: List[int] = []
+        try:
+            for part in parts:  # increasing docID ranges, concatenation keeps the list sorted
+                if term in part:
+                    postings_list += part[term][1]
+        finally:
+            self._release(parts)
+
+        return [docID for docID in postings_list if docID not in tombstones]
+
+    def __getitem__(self, term: str) -> Tuple[int, List[int]]:
+        postings_list = self._postings(term)
+        if not postings_list:
+            raise KeyError(term)
+        return (len(postings_list), postings_list)
+
+    def __contains__(self, term) -> bool:
+        return isinstance(term, str) and len(self._postings(term)) > 0
+
+    def __iter__(self) -> Iterator[str]:
+        parts = self._acquire()
+        try:
+            previous = None
+            for term in heapq.merge(*[sorted(part) if isinstance(part, dict) else iter(part) for part in parts]):
+                if term != previous and term in self:
+                    yield term
+                previous = term
+        finally:
+            self._release(parts)
+
+    def __len__(self) -> int:
+        return sum([1 for _ in self])
+
+    # ------------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------------
+
+    def add_documents(self, docs: List[str]) -> List[int]:
+        '''Indexes the cleaned text of <docs> into a new segment, returns their docIDs'''
+
+        with self._lock:
+            first_docID = self.manifest['doc_count'] + 1
+            normalizers = indexer.normalizer_functions(self.manifest.get('normalizers', []))
+            pairs = pipeline.normalize([(token, first_docID + i) for i, doc in enumerate(docs) for token in pipeline.unique_terms(doc)], normalizers)
+            segment_index = indexer.sorted_postings(indexer.generate_inverted_index(pairs))
+
+            filename = f"seg{self.manifest['next_segment']:05}.bin"
+            utils.save_index_to_disk(segment_index, os.path.join(self.directory, filename), binary=True, codec=SEGMENT_CODEC)
+
+            self.manifest['next_segment'] += 1
+            self.manifest['doc_count'] += len(docs)
+            self.manifest['segments'].append({'file': filename, 'level': 0, 'first_doc': first_docID, 'last_doc': self.manifest['doc_count']})
+            _write_manifest(self.directory, self.manifest)
+            self.segments.append(binary_index.MmapIndex(os.path.join(self.directory, filename)))
+
+        return list(range(first_docID, first_docID + len(docs)))
+
+    def add_files(self, filenames: List[str]) -> List[int]:
+        '''Indexes the documents of .sgm files into a new segment'''
+
+        contents: List[str] = []
+        for filename in filenames:
+            with open(filename, mode='r', encoding='UTF-8', errors='ignore') as file:
+                contents.append(file.read())
+
+        return self.add_documents(indexer.document_extracter(contents))
+
+    def delete(self, docIDs: List[int]) -> None:
+        with self._lock:
+            unknown = [docID for docID in docIDs if not 1 <= docID <= self.doc_count]
+            if unknown:
+                raise ValueError(f'No documents with docIDs {unknown}, docIDs go from 1 to {self.doc_count}')
+            for docID in docIDs:
+                self.tombstones.add(docID)
+            self.tombstones.save()
+
+    def _merge_pair(self) -> bool:
+        '''Merges the two newest segments if they have the same level, returns whether it did'''
+
+        with self._merge_lock:
+            return self._merge_newest_pair()
+
+    def _merge_newest_pair(self) -> bool:
+        with self._lock:
+            segments: List[dict] = self.manifest['segments']
+            if len(segments) < 2 or segments[-1]['level'] != segments[-2]['level']:
+                return False
+
+            older, newer = segments[-2], segments[-1]
+            snapshot = self._acquire()
+            parts = snapshot[-2:]
+            filename = f"seg{self.manifest['next_segment']:05}.bin"
+            self.manifest['next_segment'] += 1
+
+        try:
+            merged: Dict[str, Tuple[int, List[int]]] = {}
+            for part in parts:  # older first, so concatenation keeps postings sorted
+                for term, (_, postings_list) in part.items():
+                    live = [docID for docID in postings_list if docID not in self.tombstones]
+                    if live:
+                        previous = merged.get(term, (0, []))[1]
+                        merged[term] = (len(previous) + len(live), previous + live)
+
+            utils.save_index_to_disk(merged, os.path.join(self.directory, filename), binary=True, codec=SEGMENT_CODEC)
+        except BaseException:
+            self._release(snapshot)
+            raise
+
+        with self._lock:
+            merged_segment = {'file': filename, 'level': newer['level'] + 1, 'first_doc': older['first_doc'], 'last_doc': newer['last_doc']}
+            position = self.manifest['segments'].index(older)
+            self.manifest['segments'][position:position + 2] = [merged_segment]
+            _write_manifest(self.directory, self.manifest)
+
+            self.segments[position:position + 2] = [binary_index.MmapIndex(os.path.join(self.directory, filename))]
+            for part, segment in zip(parts, [older, newer]):
+                self._retire(part, os.path.join(self.directory, segment['file']))
+            self._release(snapshot)
+
+        return True
+
+    def merge(self) -> None:
+        '''Logarithmic merging: merge the newest segments while they have the same level'''
+        while self._merge_pair():
+            pass
+
+    def merge_in_background(self) -> threading.Thread:
+        '''Runs <merge> in a thread, queries keep being answered meanwhile'''
+
+        if self._merging != None and self._merging.is_alive():
+            return self._merging
+
+        self._merging = threading.Thread(target=self.merge, daemon=True)
+        self._merging.start()
+        return self._merging
+
+
+def run():
+    args = init_params()
+
+    if args.command == 'init':
+        create_segment_directory(args.directory, args.input_file, args.normalize)
+        print(f'Tracking updates of {args.input_file} in {args.directory}')
+        return
+
+    index = SegmentedIndex(args.directory)
+
+    if args.command == 'add':
+        docIDs = index.add_files(args.files)
+        print(f'Added {len(docIDs)} documents, docIDs {docIDs[0] if docIDs else "-"} to {docIDs[-1] if docIDs else "-"}')
+        if not args.no_merge:
+            index.merge()
+
+    elif args.command == 'delete':
+        try:
+            index.delete(args.docIDs)
+        except ValueError as e:
+            print(e)
+            exit()
+        print(f'Deleted {len(args.docIDs)} documents, {len(index.tombstones)} deleted in total')
+
+    elif args.command == 'merge':
+        index.merge()
+
+    print(json.dumps(index.manifest, indent=4))
+
+
+if __name__ == '__main__':
+    run()
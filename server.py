@@ -0,0 +1,347 @@
+'''
+Long running query server. The index is loaded once and queries are answered
+over HTTP, on a TCP port or a Unix socket, with the result format of
+query.exec_query:
+
+    GET  /query?q=oil&mode=term         single query, mode is term, boolean, ranked (with &k=10) or wildcard
+    POST /batch                         {"queries": ["oil", "grain"], "mode": "term"}, results of all queries
+    GET  /health                        number of terms of the loaded index
+    GET  /stats                         hit, miss and eviction counters of the caches
+    GET  /metrics                       time spent per query mode and loading, in Prometheus text (see instrumentation.py)
+
+Queries run in a thread pool so that slow ones don't block the event loop, and
+every answered query is appended to a JSON lines log instead of rewriting a
+JSON file per query like query.py does. The log lines are queued and written by
+a thread of their own, so the event loop never waits on the disk.
+
+With --cache_size, decoded postings lists and query results are kept in
+bounded caches (see cache.py). The index file is checked for changes at most
+once per second and everything is reloaded, caches emptied, when it changed.
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+import boolean_query
+import cache
+import instrumentation
+import query
+import ranking
+import positional
+import term_dictionary
+import utils
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def init_params():
+    parser = argparse.ArgumentParser(description='Process command line arguments')
+    parser.add_argument('-i', '--input_file', default='output/inverted_index.txt', help='Input file')
+    parser.add_argument('-o', '--output_file', default='output/queryLog.jsonl', help='Append only log of the answered queries')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='TCP port to listen on')
+    parser.add_argument('-s', '--socket', default=None, help='Listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--compact', action='store_true', help='Hold a text index in the compact array based representation')
+    parser.add_argument('--cache_size', type=int, default=0, help='Memory budget in MB of the postings and query result caches, 0 disables them')
+    parser.add_argument('--cache_policy', default='lru', choices=cache.POLICIES, help='Eviction policy of the caches')
+    parser.add_argument('-t', '--threads', type=int, default=4, help='Number of threads executing queries')
+    args = parser.parse_args()
+
+    return args
+
+
+def close_all(files: list) -> None:
+    '''Closes the memory mapped indexes of <files>, the loaded ones (dicts) and None have nothing to close'''
+    for file in files:
+        if hasattr(file, 'close'):
+            file.close()
+
+
+class QueryLog:
+    '''
+    Append only JSON lines log written by a thread of its own: <append> only
+    queues the line, and the writer appends every line queued meanwhile with a
+    single open of the file.
+    '''
+
+    def __init__(self, log_file: str):
+        self.log_file = log_file
+        self._lines: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    def append(self, obj: dict) -> None:
+        self._lines.put(obj)
+
+    def _write(self) -> None:
+        closed = False
+        while not closed:
+            lines = [self._lines.get()]
+            while not self._lines.empty():
+                lines.append(self._lines.get())
+            if lines[-1] == None:  # close() was called, nothing can be queued after it
+                lines.pop()
+                closed = True
+            with open(self.log_file, mode='a', encoding='UTF-8') as f:
+                for obj in lines:
+                    print(json.dumps(obj), file=f)
+
+    def close(self) -> None:
+        '''Writes the queued lines and stops the writer'''
+        self._lines.put(None)
+        self._writer.join()
+
+
+class QueryService:
+    '''Resident index and the query modes it can answer'''
+
+    CHECK_INTERVAL = 1.0  # seconds between two checks of the index file for changes
+
+    def __init__(self, index_file: str, log_file=None, compact=False, cache_size=0, cache_policy='lru'):
+        self.index_file = index_file
+        self.query_log = QueryLog(log_file) if log_file != None else None
+        self.compact = compact
+
+        # half of the budget for each cache, both are emptied when the index is reloaded
+        self.postings_cache = cache.Cache(cache_size // 2, cache_policy) if cache_size else None
+        self.results_cache = cache.Cache(cache_size - cache_size // 2, cache_policy) if cache_size else None
+        self._reload_lock = threading.Lock()
+
+        # every load is a generation, the files of a generation are closed once its last query is done
+        self._queries_lock = threading.Lock()
+        self.generation = 0
+        self._running: Dict[int, int] = {}  # generation -> number of queries running on it
+        self._retired: Dict[int, list] = {}  # generation -> files to close when its queries are done
+        self.index = self.positional_index = self.dictionary = self.ranked_index = None
+        self.load()
+
+    def load(self) -> None:
+        '''(Re)opens the index and its sidecar files, the previous ones are closed once the queries using them are done'''
+        self.mtime = cache.index_mtime(self.index_file)
+        self.checked = time.monotonic()
+
+        index = utils.open_index(self.index_file, self.compact)
+        positional_index = positional.open_positional_index(self.index_file)
+        dictionary = term_dictionary.open_term_dictionary(self.index_file)
+
+        ranked_file = ranking.ranked_index_filename(self.index_file)
+        ranked_index = ranking.load_ranked_index(ranked_file) if os.path.isfile(ranked_file) else None
+
+        with self._queries_lock:
+            retired = [self.index, self.positional_index, self.dictionary]
+            for query_cache in (self.postings_cache, self.results_cache):
+                if query_cache != None:
+                    query_cache.clear()
+
+            self.index = cache.CachedIndex(index, self.postings_cache) if self.postings_cache != None else index
+            self.positional_index, self.dictionary, self.ranked_index = positional_index, dictionary, ranked_index
+
+            if self._running.get(self.generation):
+                self._retired[self.generation] = retired
+            else:
+                close_all(retired)
+            self.generation += 1
+
+    def close(self) -> None:
+        with self._queries_lock:
+            close_all([self.index, self.positional_index, self.dictionary])
+            self.index = self.positional_index = self.dictionary = self.ranked_index = None
+        if self.query_log != None:
+            self.query_log.close()
+
+    def refresh(self) -> None:
+        '''Reloads everything if the index file changed since it was loaded'''
+        if time.monotonic() - self.checked < self.CHECK_INTERVAL:
+            return
+
+        with self._reload_lock:
+            self.checked = time.monotonic()
+            if cache.index_mtime(self.index_file) != self.mtime:
+                print(f'\n{self.index_file} changed, reloading')
+                self.load()
+
+    def cache_stats(self) -> Dict[str, dict]:
+        if self.postings_cache == None:
+            return {}
+        return {'postings': self.postings_cache.stats(), 'results': self.results_cache.stats()}
+
+    def exec_query(self, query_string: str, mode='term', k=10) -> Dict[str, dict]:
+        self.refresh()
+        generation, cache_generation = self._start_query()
+        try:
+            if self.results_cache == None:
+                return self._exec_query(query_string, mode, k)
+            return self.results_cache.get_or_compute((mode, query_string, k if mode == 'ranked' else None),
+                                                     lambda: self._exec_query(query_string, mode, k), cache.result_size, cache_generation)
+        finally:
+            self._end_query(generation)
+
+    def _start_query(self) -> Tuple[int, Optional[int]]:
+        '''Counts a query running on the current generation, returns it with the generation of the results cache'''
+        with self._queries_lock:
+            self._running[self.generation] = self._running.get(self.generation, 0) + 1
+            return self.generation, self.results_cache.generation if self.results_cache != None else None
+
+    def _end_query(self, generation: int) -> None:
+        with self._queries_lock:
+            self._running[generation] -= 1
+            if self._running[generation] == 0:
+                del self._running[generation]
+                close_all(self._retired.pop(generation, []))
+
+    def _exec_query(self, query_string: str, mode='term', k=10) -> Dict[str, dict]:
+        if mode == 'term':
+            return query.exec_query(query_string, self.index)
+        if mode == 'boolean':
+            return boolean_query.exec_boolean_query(query_string, self.index, self.positional_index)
+        if mode == 'ranked':
+            if self.ranked_index == None:
+                raise ValueError('No ranked index was built next to the index, see indexer.py --ranked')
+            return ranking.exec_ranked_query(query_string, self.ranked_index, k)
+        if mode == 'wildcard':
+            return term_dictionary.exec_wildcard_query(query_string, self.index, self.dictionary)
+        raise ValueError(f'Unknown query mode {mode}')
+
+    def log(self, mode: str, result: Dict[str, dict]) -> None:
+        '''Queues the answered queries for the log, never waits on the disk'''
+        if self.query_log == None:
+            return
+        for query_string, hits in result.items():
+            self.query_log.append({'time': time.time(), 'mode': mode, 'query': query_string, 'frequency': hits['frequency']})
+
+
+class QueryServer:
+
+    def __init__(self, service: QueryService, threads=4):
+        self.service = service
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    async def run_query(self, query_string: str, mode: str, k: int) -> Dict[str, dict]:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self.executor, self.service.exec_query, query_string, mode, k)
+        self.service.log(mode, result)
+        return result
+
+    async def route(self, method: str, target: str, body: bytes) -> Tuple[int, dict]:
+        url = urlsplit(target)
+        params: Dict[str, List[str]] = parse_qs(url.query)
+
+        if url.path == '/health':
+            return 200, {'terms': len(self.service.index)}
+
+        if url.path == '/stats':
+            return 200, self.service.cache_stats()
+
+        if url.path == '/metrics':
+            return 200, instrumentation.RECORDER.prometheus()
+
+        if url.path == '/query':
+            if method != 'GET':
+                return 405, {'error': 'use GET'}
+            if 'q' not in params:
+                return 400, {'error': 'missing q parameter'}
+            mode = params.get('mode', ['term'])[0]
+            k = int(params.get('k', ['10'])[0])
+            return 200, await self.run_query(params['q'][0], mode, k)
+
+        if url.path == '/batch':
+            if method != 'POST':
+                return 405, {'error': 'use POST'}
+            request: dict = json.loads(body or b'{}')
+            mode = request.get('mode', 'term')
+            k = int(request.get('k', 10))
+            results = await asyncio.gather(*[self.run_query(q, mode, k) for q in request.get('queries', [])])
+            merged: Dict[str, dict] = {}
+            for result in results:
+                merged.update(result)
+            return 200, merged
+
+        return 404, {'error': f'no route {url.path}'}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        '''Serves the HTTP/1.1 requests of one connection, keep-alive included'''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers: Dict[str, str] = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1').strip()
+                    if not line:
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                try:
+                    status, payload = await self.route(method, target, body)
+                except (ValueError, KeyError, boolean_query.QuerySyntaxError) as e:
+                    status, payload = 400, {'error': str(e)}
+                except Exception as e:
+                    status, payload = 500, {'error': repr(e)}
+
+                if isinstance(payload, str):
+                    content, content_type = payload.encode('UTF-8'), 'text/plain; version=0.0.4'
+                else:
+                    content, content_type = json.dumps(payload).encode('UTF-8'), 'application/json'
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                             f'Content-Type: {content_type}\r\n'
+                             f'Content-Length: {len(content)}\r\n'
+                             f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + content)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # client went away or sent garbage, nothing to answer
+
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8080, socket_path=None) -> asyncio.AbstractServer:
+        '''Starts listening, port 0 picks a free port (see server.sockets)'''
+        if socket_path != None:
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+            print(f'\nServing queries on unix socket {socket_path}')
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            print(f'\nServing queries on http://{host}:{server.sockets[0].getsockname()[1]}')
+        return server
+
+    async def serve(self, host='127.0.0.1', port=8080, socket_path=None) -> None:
+        server = await self.start(host, port, socket_path)
+        async with server:
+            await server.serve_forever()
+
+
+def run():
+    args = init_params()
+    utils.ensure_dir_exists('output')
+    instrumentation.enable()
+
+    service = QueryService(args.input_file, args.output_file, args.compact, args.cache_size * 2**20, args.cache_policy)
+    server = QueryServer(service, args.threads)
+
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    run()
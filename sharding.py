@@ -0,0 +1,198 @@
+'''
+Document sharded index. The documents of the corpus are dealt round robin to N
+shards, each one an independent index file whose docIDs are local to the
+shard (numbered from 1). The shards are listed in a manifest written next to
+them, <output file>.shards:
+
+    {"doc_count": 21578,
+     "shards": [{"file": "inverted_index.txt.shard0", "docIDs": [1, 3, 5, ...]}, ...]}
+
+where docIDs maps the local docIDs of a shard (their position + 1) to the
+global docIDs of the corpus. The mapping is increasing, so the postings of a
+shard stay sorted once mapped and the shards hold disjoint documents: the
+postings of a query are merged with a k-way merge and the counts are added.
+
+The coordinator keeps one worker process per shard, which loads its shard
+once and answers the queries fanned out to it, so queries use as many cores
+as there are shards.
+'''
+
+import argparse
+import json
+import os
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+from tqdm import tqdm
+import boolean_query
+import query
+import utils
+
+MODES = ('term', 'boolean')  # query modes the shards can answer
+
+
+def init_params():
+    parser = argparse.ArgumentParser(description='Process command line arguments')
+    parser.add_argument('-i', '--input_file', default='output/inverted_index.txt.shards', help='Shard manifest')
+    parser.add_argument('-q', '--query_string', required=True, help='Query')
+    parser.add_argument('-m', '--mode', default='term', choices=MODES, help='single term lookup or boolean query')
+    args = parser.parse_args()
+
+    return args
+
+
+def shards_filename(index_file: str) -> str:
+    return f'{index_file}.shards'
+
+
+def shard_filename(index_file: str, shard: int) -> str:
+    return f'{index_file}.shard{shard}'
+
+
+def is_shard_manifest(filename: str) -> bool:
+    return filename.endswith('.shards') and os.path.isfile(filename)
+
+
+def build_shards(input_dir: str, outfile: str, shards: int, binary=False, codec='raw', normalizers: List[str] = ()) -> None:
+    '''
+    Indexes the corpus in <input_dir> into <shards> shard files next to
+    <outfile>, in a single pass over the documents, and writes their manifest.
+    '''
+    import indexer  # only needed to build the shards
+    import pipeline
+
+    normalizer_functions = indexer.normalizer_functions(normalizers)
+    shard_docIDs: List[List[int]] = [[] for _ in range(shards)]
+    shard_postings: List[Dict[str, List[int]]] = [{} for _ in range(shards)]
+
+    def shard_documents():
+        '''Deals the documents to the shards, their docIDs become (shard, local docID)'''
+        for docID, doc in pipeline.extract_documents(pipeline.read_files(input_dir)):
+            shard = (docID - 1) % shards
+            shard_docIDs[shard].append(docID)
+            yield (shard, len(shard_docIDs[shard])), doc
+
+    print(f'Indexing documents into {shards} shards')
+    pairs = pipeline.normalize(pipeline.tokenize_documents(shard_documents(), unique=True), normalizer_functions)
+
+    for token, (shard, local_docID) in tqdm(pairs):
+        postings_list = shard_postings[shard].get(token)
+        if postings_list == None:
+            shard_postings[shard][token] = [local_docID]
+        elif postings_list[-1] != local_docID:
+            postings_list.append(local_docID)
+
+    manifest = {'doc_count': sum([len(docIDs) for docIDs in shard_docIDs]), 'shards': []}
+    for shard in range(shards):
+        filename = shard_filename(outfile, shard)
+        index = {token: (len(postings_list), postings_list) for token, postings_list in shard_postings[shard].items()}
+        utils.save_index_to_disk(index, filename, binary=binary, codec=codec)
+        shard_postings[shard] = None  # lets the shard go before writing the next one
+        manifest['shards'].append({'file': os.path.basename(filename), 'docIDs': shard_docIDs[shard]})
+
+    utils.write_json_obj_2_disk(manifest, shards_filename(outfile))
+
+
+class Shard(Mapping):
+    '''
+    Index of a shard, with local docIDs. <live_documents> gives the local
+    docIDs of all its documents, which boolean NOT queries need.
+    '''
+
+    def __init__(self, index, docIDs: List[int]):
+        self.index = index
+        self.docIDs = docIDs
+
+    def live_documents(self) -> List[int]:
+        return list(range(1, len(self.docIDs) + 1))
+
+    def to_global(self, postings_list: List[int]) -> List[int]:
+        return [self.docIDs[docID - 1] for docID in postings_list]
+
+    def __getitem__(self, term: str) -> Tuple[int, List[int]]:
+        return self.index[term]
+
+    def __contains__(self, term) -> bool:
+        return term in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+_shard: Shard = None  # shard of the current worker process
+
+
+def _load_shard(filename: str, docIDs: List[int]) -> None:
+    '''Initializer of the worker process of a shard'''
+    global _shard
+    _shard = Shard(utils.open_index(filename), docIDs)
+
+
+def _exec_shard_query(query_string: str, mode: str) -> Tuple[int, List[int]]:
+    '''Answers <query_string> on the shard of the worker, returns the frequency and the global postings'''
+    if mode == 'boolean':
+        result = boolean_query.exec_boolean_query(query_string, _shard)
+    elif mode == 'term':
+        result = query.exec_query(query_string, _shard)
+    else:
+        raise ValueError(f'Sharded indexes answer {" and ".join(MODES)} queries, not {mode} queries')
+
+    hits = result[query_string]
+    return hits['frequency'], _shard.to_global(hits['postings'])
+
+
+class QueryCoordinator:
+    '''Scatters queries to the worker processes of the shards of <manifest_file> and gathers their answers'''
+
+    def __init__(self, manifest_file: str):
+        manifest: dict = utils.load_json_from_disk(manifest_file)
+        directory = os.path.dirname(manifest_file)
+        self.doc_count: int = manifest['doc_count']
+        self.workers: List[ProcessPoolExecutor] = []
+
+        for shard in manifest['shards']:
+            worker = ProcessPoolExecutor(max_workers=1, initializer=_load_shard, initargs=(os.path.join(directory, shard['file']), shard['docIDs']))
+            self.workers.append(worker)
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def exec_query(self, query_string: str, mode='term') -> Dict[str, dict]:
+        '''Same result format as query.exec_query'''
+        if mode not in MODES:
+            raise ValueError(f'Sharded indexes answer {" and ".join(MODES)} queries, not {mode} queries')
+
+        futures = [worker.submit(_exec_shard_query, query_string, mode) for worker in self.workers]
+        answers = [future.result() for future in futures]
+
+        frequency = sum([shard_frequency for shard_frequency, _ in answers])
+        postings_list = boolean_query.union([shard_postings for _, shard_postings in answers])
+
+        return {
+            query_string: {'frequency': frequency,
+                           'postings': postings_list,
+                           'message': 'successful' if postings_list else 'unsuccessful'}
+        }
+
+
+def run():
+    args = init_params()
+
+    with QueryCoordinator(args.input_file) as coordinator:
+        result = coordinator.exec_query(args.query_string, args.mode)
+
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,128 @@
+'''
+Single-pass in-memory indexing (SPIMI). Documents are streamed one .sgm file
+at a time and their terms are added straight to a dict of postings lists. When
+the estimated size of that dict reaches the memory budget, it is sorted and
+flushed to disk as a block. The blocks are then merged with a k-way merge into
+the final index, so the memory used stays flat whatever the size of the corpus.
+
+Blocks use the same JSON lines as the final text index.
+'''
+
+import heapq
+import itertools
+import json
+import os
+import sys
+import tempfile
+from typing import Dict, Iterable, Iterator, List, Tuple
+from tqdm import tqdm
+import binary_index
+import indexer
+import pipeline
+import utils
+
+# Rough cost of the python objects held by the block dict, used to decide when to flush
+TERM_OVERHEAD = 200  # dict slot, key str and postings list
+POSTING_OVERHEAD = 36  # list slot and boxed int
+
+
+def write_block(block: Dict[str, list], directory: str, number: int, prefix='block') -> str:
+    '''Sorts <block> by term and writes it into <directory>, returns the block filename'''
+
+    filename = os.path.join(directory, f'{prefix}{number:05}.txt')
+    with open(filename, mode='w', encoding='UTF-8') as f:
+        for term in sorted(block):
+            postings_list = block[term]
+            print(json.dumps([term, [len(postings_list), postings_list]]), file=f)
+
+    return filename
+
+
+def spimi_invert(docs: Iterable[Tuple[int, str]], directory: str, memory_budget: int, normalizers: List[str] = ()) -> List[str]:
+    '''
+    Builds sorted blocks out of <docs>, a stream of (docID, doc) in increasing
+    docID order, flushing to <directory> every time the block reaches roughly
+    <memory_budget> bytes. Terms go through the compressor.NORMALIZERS named in
+    <normalizers>. Returns the block filenames in creation order.
+    '''
+
+    print(f'Inverting documents into blocks of at most {memory_budget} bytes')
+    blocks: List[str] = []
+    block: Dict[str, List[int]] = {}
+    block_size = 0
+    pairs = pipeline.normalize(pipeline.tokenize_documents(docs), indexer.normalizer_functions(normalizers))
+
+    for docID, group in itertools.groupby(pairs, key=lambda pair: pair[1]):
+        for term, _ in group:
+            postings_list = block.get(term)
+
+            if postings_list == None:
+                block[term] = [docID]
+                block_size += TERM_OVERHEAD + sys.getsizeof(term)
+
+            elif postings_list[-1] != docID:  # docs come in order so the list stays sorted and unique
+                postings_list.append(docID)
+                block_size += POSTING_OVERHEAD
+
+        if block_size >= memory_budget:
+            blocks.append(write_block(block, directory, len(blocks)))
+            block = {}
+            block_size = 0
+
+    if block:
+        blocks.append(write_block(block, directory, len(blocks)))
+
+    print(f'{len(blocks)} blocks written')
+    return blocks
+
+
+def read_block(filename: str) -> Iterator[Tuple[str, List[int]]]:
+    with open(filename, mode='r', encoding='UTF-8') as f:
+        for line in f:
+            term, (_, postings_list) = json.loads(line)
+            yield term, postings_list
+
+
+def merge_blocks(blocks: List[str]) -> Iterator[Tuple[str, Tuple[int, List[int]]]]:
+    '''
+    k-way merge of sorted blocks. Blocks hold increasing docID ranges and
+    heapq.merge keeps equal terms in block order, so the postings of a term
+    are merged by simple concatenation.
+    '''
+
+    merged = heapq.merge(*[read_block(block) for block in blocks], key=lambda entry: entry[0])
+
+    for term, entries in itertools.groupby(merged, key=lambda entry: entry[0]):
+        postings_list: List[int] = []
+        for _, block_postings in entries:
+            postings_list += block_postings
+        yield term, (len(postings_list), postings_list)
+
+
+def build_index(input_dir: str, outfile: str, memory_budget: int, binary=False, codec='raw', normalizers: List[str] = (), with_positions=False) -> None:
+    '''
+    Creates the index of the corpus in <input_dir> with SPIMI and writes it
+    into <outfile>. With <with_positions>, the positional index is built from
+    the same pass over the corpus into blocks of its own, each kind of block
+    getting half of <memory_budget>, and written next to <outfile>.
+    '''
+
+    output_dir = os.path.dirname(outfile) or '.'
+    with tempfile.TemporaryDirectory(dir=output_dir, prefix='spimi_blocks_') as directory:
+        docs = pipeline.extract_documents(pipeline.read_files(input_dir))
+        if with_positions:
+            import positional
+            memory_budget //= 2
+            positions = positional.PositionalIndexBuilder(normalizers, memory_budget, directory)
+            docs = positions.observe(docs)
+
+        blocks = spimi_invert(docs, directory, memory_budget, normalizers)
+
+        if binary:
+            print(f'\nWriting binary index into file {outfile}')
+            binary_index.write_binary_index(tqdm(merge_blocks(blocks)), outfile, codec=codec)
+        else:
+            utils.write2disk(merge_blocks(blocks), outfile)
+
+        if with_positions:
+            positions.write(outfile)
@@ -0,0 +1,310 @@
+'''
+Compact term dictionary of an index, written next to it as <index file>.dict,
+plus a bigram index of its terms (<index file>.kgram) for wildcard queries.
+
+The terms are front coded: they are sorted and cut in blocks of BLOCK_SIZE,
+the first term of a block is stored in full and every other one as the length
+of the prefix it shares with the previous term followed by the rest of its
+bytes. The number of a term in sorted order is its term ID, which is also its
+line in the text index and its entry in the binary index.
+
+Layout of the .dict file (every integer is little endian):
+
+    header              magic, version, block size, term count, offset of the block offsets
+    blocks              variable byte encoded lengths and utf-8 bytes of the terms
+    block offsets       one uint64 per block + 1
+
+A lookup binary searches the first terms of the blocks, then decodes a single
+block, so the dictionary is memory mapped and never loaded as a whole.
+
+The .kgram file is a binary index (see binary_index.py) whose terms are the
+bigrams of $term$ and whose postings are term IDs, which narrows the terms a
+wildcard like *oil or o*l can match before comparing them with the pattern.
+'''
+
+import argparse
+import fnmatch
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, Iterator, List, Tuple
+from tqdm import tqdm
+import binary_index
+import boolean_query
+import instrumentation
+import postings_codec
+import utils
+
+MAGIC = b'NIID'
+VERSION = 1
+BLOCK_SIZE = 16
+K = 2  # size of the grams of the .kgram file
+BOUNDARY = '$'  # marks the start and end of a term in its grams, tokens never contain it
+
+HEADER = struct.Struct('<4sIIQQ')  # magic, version, block size, term count, offset of the block offsets
+OFFSET = struct.Struct('<Q')
+
+
+def init_params():
+    parser = argparse.ArgumentParser(description='Process command line arguments')
+    parser.add_argument('-i', '--input_file', default='output/inverted_index.txt', help='Index whose term dictionary is built')
+    args = parser.parse_args()
+
+    return args
+
+
+def dictionary_filename(index_file: str) -> str:
+    return f'{index_file}.dict'
+
+
+def kgram_filename(index_file: str) -> str:
+    return f'{index_file}.kgram'
+
+
+def _shared_prefix(a: bytes, b: bytes) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def kgrams(term: str) -> List[str]:
+    '''Bigrams of $term$'''
+    bounded = BOUNDARY + term + BOUNDARY
+    return [bounded[i:i + K] for i in range(len(bounded) - K + 1)]
+
+
+def write_term_dictionary(terms: Iterable[str], outfile: str) -> int:
+    '''Front codes <terms>, sorted and unique, into <outfile>. Returns the number of terms.'''
+
+    count = 0
+    previous = b''
+    block_offsets: List[int] = []
+    blocks = bytearray()
+
+    for term in terms:
+        encoded = term.encode('UTF-8')
+        if count % BLOCK_SIZE == 0:
+            block_offsets.append(len(blocks))
+            blocks += postings_codec.vbyte_encode_number(len(encoded)) + encoded
+        else:
+            assert previous < encoded, f'terms must be unique and sorted, got {term} after {previous.decode("UTF-8")}'
+            shared = _shared_prefix(previous, encoded)
+            blocks += postings_codec.vbyte_encode_numbers([shared, len(encoded) - shared]) + encoded[shared:]
+        previous = encoded
+        count += 1
+
+    block_offsets.append(len(blocks))
+
+    with open(outfile, mode='wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, BLOCK_SIZE, count, HEADER.size + len(blocks)))
+        f.write(blocks)
+        f.write(b''.join([OFFSET.pack(offset) for offset in block_offsets]))
+
+    return count
+
+
+def write_kgram_index(terms: Iterable[str], outfile: str) -> None:
+    '''Bigram -> term IDs index of <terms>, in the binary index format'''
+
+    grams: Dict[str, List[int]] = {}
+    for term_id, term in enumerate(terms):
+        for gram in kgrams(term):
+            term_ids = grams.setdefault(gram, [])
+            if not term_ids or term_ids[-1] != term_id:  # a gram can occur twice in a term
+                term_ids.append(term_id)
+
+    items = [(gram, (len(term_ids), term_ids)) for gram, term_ids in sorted(grams.items())]
+    binary_index.write_binary_index(items, outfile, codec='vbyte')
+
+
+def build_term_dictionary(index_file: str) -> None:
+    '''Writes the .dict and .kgram files of the index stored in <index_file>'''
+
+    terms = [term for term, _ in tqdm(utils.iter_index_file(index_file))]
+
+    outfile = dictionary_filename(index_file)
+    print(f'\nWriting term dictionary into file {outfile}')
+    write_term_dictionary(terms, outfile)
+    write_kgram_index(terms, kgram_filename(index_file))
+
+    json_keys = sum([len(json.dumps(term).encode('UTF-8')) for term in terms])
+    print(f'{len(terms)} terms in {os.path.getsize(outfile)} bytes, against {json_keys} bytes of JSON keys')
+
+
+class TermDictionary:
+    '''Read only view over the .dict file of an index, with its .kgram file when given'''
+
+    def __init__(self, filename: str, kgram_file=None):
+        self.filename = filename
+        self._file = open(filename, mode='rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.block_size, self._count, self._block_offsets = HEADER.unpack_from(self._mm, 0)
+        assert magic == MAGIC, f'{filename} is not a term dictionary'
+        assert version == VERSION, f'{filename} uses version {version} of the format, expected {VERSION}'
+        self._blocks = (self._count + self.block_size - 1) // self.block_size
+
+        self.kgrams = binary_index.MmapIndex(kgram_file) if kgram_file != None and os.path.isfile(kgram_file) else None
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+        if self.kgrams != None:
+            self.kgrams.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _block_start(self, block: int) -> int:
+        return HEADER.size + OFFSET.unpack_from(self._mm, self._block_offsets + 8 * block)[0]
+
+    def _first_term(self, block: int) -> str:
+        (length,), i = postings_codec.vbyte_decode_numbers(self._mm, 1, self._block_start(block))
+        return self._mm[i:i + length].decode('UTF-8')
+
+    def _block(self, block: int) -> List[str]:
+        '''Decodes the terms of <block>'''
+        count = min(self.block_size, self._count - block * self.block_size)
+        (length,), i = postings_codec.vbyte_decode_numbers(self._mm, 1, self._block_start(block))
+        previous = self._mm[i:i + length]
+        i += length
+        terms = [previous]
+
+        for _ in range(count - 1):
+            (shared, length), i = postings_codec.vbyte_decode_numbers(self._mm, 2, i)
+            previous = previous[:shared] + self._mm[i:i + length]
+            i += length
+            terms.append(previous)
+
+        return [term.decode('UTF-8') for term in terms]
+
+    def _find_block(self, term: str) -> int:
+        '''Last block whose first term is <= <term>, -1 when <term> comes before every term'''
+        lo, hi = 0, self._blocks
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._first_term(mid) <= term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+
+    def find(self, term: str) -> int:
+        '''Term ID of <term>, -1 when it is not in the dictionary'''
+        block = self._find_block(term)
+        if block < 0:
+            return -1
+
+        terms = self._block(block)
+        if term in terms:
+            return block * self.block_size + terms.index(term)
+        return -1
+
+    def __contains__(self, term) -> bool:
+        return isinstance(term, str) and self.find(term) >= 0
+
+    def term(self, term_id: int) -> str:
+        return self._block(term_id // self.block_size)[term_id % self.block_size]
+
+    def terms(self, term_ids: Iterable[int]) -> List[str]:
+        '''Terms of sorted <term_ids>, decoding every block once'''
+        terms: List[str] = []
+        block, decoded = -1, []
+        for term_id in term_ids:
+            if term_id // self.block_size != block:
+                block = term_id // self.block_size
+                decoded = self._block(block)
+            terms.append(decoded[term_id % self.block_size])
+        return terms
+
+    def __iter__(self) -> Iterator[str]:
+        for block in range(self._blocks):
+            yield from self._block(block)
+
+    def prefix(self, prefix: str) -> Iterator[Tuple[int, str]]:
+        '''(term ID, term) of the terms starting with <prefix>, in sorted order'''
+        block = max(self._find_block(prefix), 0)
+        for block in range(block, self._blocks):
+            for i, term in enumerate(self._block(block)):
+                if term.startswith(prefix):
+                    yield block * self.block_size + i, term
+                elif term > prefix:
+                    return
+
+    def wildcard(self, pattern: str) -> List[str]:
+        '''
+        Terms matching <pattern>, where * stands for any number of characters
+        and ? for one. Patterns ending with their only * are prefix scans,
+        other patterns intersect the term IDs of their bigrams (when the .kgram
+        file is there) and the candidates are checked against the pattern.
+        '''
+        if '*' not in pattern and '?' not in pattern:
+            return [pattern] if pattern in self else []
+
+        if pattern.endswith('*') and '*' not in pattern[:-1] and '?' not in pattern:
+            return [term for _, term in self.prefix(pattern[:-1])]
+
+        if self.kgrams == None:
+            return [term for term in self if fnmatch.fnmatchcase(term, pattern)]
+
+        bounded = BOUNDARY + pattern + BOUNDARY
+        pieces = [piece for part in bounded.split('*') for piece in part.split('?')]
+        grams = [piece[i:i + K] for piece in pieces for i in range(len(piece) - K + 1)]
+
+        if grams:
+            postings = sorted([self.kgrams[gram][1] if gram in self.kgrams else [] for gram in set(grams)], key=len)
+            term_ids = postings[0]
+            for term_ids2 in postings[1:]:
+                term_ids = boolean_query.intersect(term_ids, term_ids2)
+            candidates = self.terms(term_ids)
+        else:
+            candidates = list(self)  # only wildcards, e.g. * or ?*
+
+        return [term for term in candidates if fnmatch.fnmatchcase(term, pattern)]
+
+
+@instrumentation.instrumented('query.wildcard')
+def exec_wildcard_query(query: str, index, dictionary) -> Dict[str, dict]:
+    '''
+    Same result format as query.exec_query, the postings being those of every
+    term of <dictionary> matching the wildcard <query>, listed under 'terms'.
+    '''
+    if dictionary == None:
+        raise ValueError('No term dictionary was built next to the index, see indexer.py --dictionary')
+
+    terms = dictionary.wildcard(query)
+    postings_list = boolean_query.union([index[term][1] for term in terms if term in index])
+
+    return {
+        query: {'frequency': len(postings_list),
+                'postings': postings_list,
+                'terms': terms,
+                'message': 'successful' if postings_list else 'unsuccessful'}
+    }
+
+
+def open_term_dictionary(index_file: str):
+    '''Memory maps the term dictionary of <index_file>, None if it was not built'''
+
+    filename = dictionary_filename(index_file)
+    if not os.path.isfile(filename):
+        return None
+    return TermDictionary(filename, kgram_filename(index_file))
+
+
+def run():
+    args = init_params()
+    build_term_dictionary(args.input_file)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,28 @@
+import benchmark
+import copy
+import tempfile
+
+
+def test_benchmark_pipeline():
+    '''
+    Ensure that the benchmark of a tiny synthetic corpus times every stage,
+    and that compare flags the timings that got slower, and only those.
+    '''
+
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark.generate_synthetic_corpus(directory, files=2, docs_per_file=10, words_per_doc=20, vocabulary_size=100)
+        stages = benchmark.benchmark_pipeline(directory, repeat=1, query_count=50, seed=0)
+
+    assert(set(stages) >= {'unpack_corpus_step1', 'document_extracter', 'generate_term_docID_pairs', 'generate_inverted_index',
+                           'sorted_postings', 'load_index', 'compressor.case_fold', 'compressor.compress',
+                           'exec_query', 'exec_query.binary_vbyte'})
+    assert('query_cold_start' not in stages)
+    assert(stages['document_extracter']['items'] == 20 and stages['document_extracter']['runs'] == 1)
+    assert(all(key in stages['exec_query'] for key in ['p50_us', 'p95_us', 'p99_us']))
+
+    old = {'stages': copy.deepcopy(stages)}
+    new = {'stages': copy.deepcopy(stages)}
+    old['stages']['load_index']['median_s'], new['stages']['load_index']['median_s'] = 1.0, 2.0
+    flagged = [line.split()[:2] for line in benchmark.compare(old, new).splitlines() if line.endswith('regression')]
+    assert(flagged == [['load_index', 'median_s']])
+    assert(benchmark.compare(old, old).count('regression') == 0)
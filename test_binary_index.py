@@ -0,0 +1,37 @@
+import binary_index
+import postings_codec
+import query
+import utils
+import os
+
+def test_binary_index_round_trip():
+    '''
+    Ensure that an index written in the binary format answers queries exactly
+    like the dict it was written from.
+    '''
+
+    utils.ensure_dir_exists('output/')
+
+    index_file = 'output/test_binary_index.bin'
+    inverted_index = {
+        'Oil': (2, [3, 17]),
+        'oil': (3, [1, 2, 17]),
+        'prices': (1, [2]),
+        'été': (1, [40000]),
+    }
+
+    for codec in postings_codec.DOCID_CODECS:
+        utils.save_index_to_disk(inverted_index, index_file, binary=True, codec=codec)
+
+        with binary_index.MmapIndex(index_file) as loaded_index:
+            assert(loaded_index.codec == codec)
+            assert(loaded_index.doc_count == 40000)
+            assert(len(loaded_index) == len(inverted_index))
+            assert(list(loaded_index) == sorted(inverted_index))
+            assert('gas' not in loaded_index)
+            for term in inverted_index:
+                assert(query.exec_query(term, loaded_index) == query.exec_query(term, inverted_index))
+            assert(query.exec_query('gas', loaded_index) == query.exec_query('gas', inverted_index))
+
+        assert(utils.load_index(index_file) == inverted_index), f'The loaded index is not equivalent to the original one'
+        os.remove(index_file)
@@ -0,0 +1,27 @@
+import bitset
+import boolean_query
+import postings_codec
+import random
+
+
+def test_hybrid_set_operations():
+    '''
+    Ensure that intersections, unions and differences give the same postings
+    whether their operands are bitsets, sorted lists or a mix of both, and that
+    the hybrid codec stores dense lists as bitsets.
+    '''
+
+    rng = random.Random(0)
+    lists = [sorted(rng.sample(range(1, 5000), n)) for n in [0, 1, 30, 400, 2500, 4000]]
+
+    dense = postings_codec.hybrid_encode(lists[-1])
+    assert(postings_codec.hybrid_decode_postings(dense) == bitset.Bitset.from_postings(lists[-1]))
+    assert(isinstance(postings_codec.hybrid_decode_postings(postings_codec.hybrid_encode(lists[2])), list))
+
+    for p1 in lists:
+        for p2 in lists:
+            expected = [boolean_query.intersect(p1, p2), boolean_query.union([p1, p2]), boolean_query.difference(p1, p2)]
+            for h1, h2 in [(bitset.Bitset.from_postings(p1), p2), (p1, bitset.Bitset.from_postings(p2)),
+                           (bitset.Bitset.from_postings(p1), bitset.Bitset.from_postings(p2))]:
+                results = [boolean_query.intersect(h1, h2), boolean_query.union([h1, h2]), boolean_query.difference(h1, h2)]
+                assert([bitset.as_list(result) for result in results] == expected)
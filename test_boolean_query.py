@@ -0,0 +1,53 @@
+import boolean_query
+import random
+import pytest
+
+def make_index(seed=0, doc_count=500):
+    rng = random.Random(seed)
+    index = {}
+    for term, density in [('oil', 0.5), ('prices', 0.2), ('rates', 0.05), ('opec', 0.01), ('and', 0.9)]:
+        postings_list = [docID for docID in range(1, doc_count + 1) if rng.random() < density]
+        index[term] = (len(postings_list), postings_list)
+    return index
+
+def test_boolean_query_matches_set_operations():
+    '''
+    Ensure that skip pointer intersections, unions and negations give the
+    same documents as python set operations.
+    '''
+
+    index = make_index()
+    docs = set(range(1, 501))
+    s = {term: set(index[term][1]) for term in index}
+
+    expectations = {
+        'oil': s['oil'],
+        'oil AND prices': s['oil'] & s['prices'],
+        'oil prices rates': s['oil'] & s['prices'] & s['rates'],
+        'oil OR opec': s['oil'] | s['opec'],
+        'NOT oil': docs - s['oil'],
+        'oil AND NOT prices': s['oil'] - s['prices'],
+        '(oil OR rates) AND NOT (prices OR opec)': (s['oil'] | s['rates']) - (s['prices'] | s['opec']),
+        'oil AND missing': set(),
+        'oil OR missing': s['oil'],
+        'and AND oil': s['and'] & s['oil'],
+        'NOT NOT opec': s['opec'],
+    }
+
+    for query, expected in expectations.items():
+        result = boolean_query.exec_boolean_query(query, index)[query]
+        assert(result['postings'] == sorted(expected)), query
+        assert(result['frequency'] == len(expected)), query
+
+def test_intersect_with_skips():
+    rng = random.Random(1)
+    for _ in range(50):
+        p1 = sorted(rng.sample(range(10000), rng.randint(0, 2000)))
+        p2 = sorted(rng.sample(range(10000), rng.randint(0, 50)))
+        assert(boolean_query.intersect(p1, p2) == sorted(set(p1) & set(p2)))
+        assert(boolean_query.intersect(p2, p1) == sorted(set(p1) & set(p2)))
+
+def test_syntax_errors():
+    for query in ['oil AND', '(oil OR prices', 'oil )', 'OR oil', '']:
+        with pytest.raises(boolean_query.QuerySyntaxError):
+            boolean_query.parse(query)
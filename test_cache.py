@@ -0,0 +1,78 @@
+import cache
+import query
+
+
+def test_cache_eviction():
+    '''
+    Ensure that the caches stay within their budget, evict the least recently
+    (lru) or least frequently (lfu) used entry and count hits and misses.
+    '''
+
+    for policy, evicted in [('lru', 'b'), ('lfu', 'c')]:
+        c = cache.Cache(3 * cache.postings_size(1), policy)
+        for key in ['a', 'b', 'c']:
+            c.put(key, key.upper(), cache.postings_size(1))
+        assert(c.get('a') == 'A')
+        assert(c.get('b') == 'B')
+        assert(c.get('a') == 'A')  # lru order: c b a, lfu counts: a 3, b 2, c 1
+        assert(c.get('b') == 'B' if policy == 'lfu' else c.get('c') == 'C')
+
+        c.put('d', 'D', cache.postings_size(1))
+        assert(evicted not in c and 'd' in c and len(c) == 3)
+        assert(c.size <= c.memory_budget)
+        assert(c.get(evicted) is cache.MISSING)
+
+        stats = c.stats()
+        assert((stats['hits'], stats['misses'], stats['evictions']) == (4, 1, 1))
+
+
+def test_cached_index():
+    '''Ensure that lookups through the cache answer like the index and hit after the first one'''
+
+    index = {'oil': (3, [1, 4, 9]), 'grain': (1, [2])}
+    cached = cache.CachedIndex(index, cache.Cache(10**6))
+
+    for _ in range(3):
+        for term in ['oil', 'grain', 'missing']:
+            assert(query.exec_query(term, cached) == query.exec_query(term, index))
+
+    assert((cached.cache.hits, cached.cache.misses) == (4, 2))
+
+    new_index = {'oil': (1, [5])}
+    cached.cache.clear()
+    new_cached = cache.CachedIndex(new_index, cached.cache)
+    assert(cached['oil'] == index['oil'] and 'oil' not in cached.cache)  # the old index doesn't fill the cleared cache
+    assert(new_cached['oil'] == new_index['oil'] and cached['oil'] == index['oil'])
+    assert(cached.cache.get_or_compute('key', lambda: 'stale', len, cached.generation) == 'stale' and 'key' not in cached.cache)
+
+
+def test_cached_hybrid_postings():
+    '''
+    Ensure that boolean queries over a binary index decode the postings of a
+    term once, lists and bitsets alike, and then hit the postings cache.
+    '''
+    import binary_index
+    import bitset
+    import boolean_query
+    import os
+    import tempfile
+    import utils
+
+    index = {'the': (900, list(range(1, 901))), 'oil': (3, [1, 4, 9]), 'grain': (2, [4, 700])}
+    query_string = '(oil OR grain) AND the'
+
+    with tempfile.TemporaryDirectory() as directory:
+        for codec in ['vbyte', 'hybrid']:
+            index_file = os.path.join(directory, f'index_{codec}.bin')
+            utils.save_index_to_disk(index, index_file, binary=True, codec=codec)
+            with binary_index.MmapIndex(index_file) as mmap_index:
+                cached = cache.CachedIndex(mmap_index, cache.Cache(10**6))
+                expected = boolean_query.exec_boolean_query(query_string, index)
+                assert(boolean_query.exec_boolean_query(query_string, cached) == expected)
+                misses = cached.cache.misses
+                hits = cached.cache.hits
+
+                for _ in range(3):
+                    assert(boolean_query.exec_boolean_query(query_string, cached) == expected)
+                assert(cached.cache.misses == misses and cached.cache.hits >= hits + 9)
+                assert(isinstance(cached.cache.get(('hybrid', 'the')), bitset.Bitset) == (codec == 'hybrid'))
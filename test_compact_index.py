@@ -0,0 +1,54 @@
+import compact_index
+import compressor
+import query
+import random
+
+
+def test_compact_index():
+    '''
+    Ensure that the compact index answers like the dict it was built from,
+    before and after the compressor steps modify it.
+    '''
+
+    rng = random.Random(0)
+    vocabulary = ['Oil', 'oil', 'the', 'grain', 'Grain', 'rates', 'of']
+    index = {}
+    for token in vocabulary:
+        postings_list = sorted(rng.sample(range(1, 500), rng.randint(1, 50)))
+        index[token] = (len(postings_list), postings_list)
+
+    compact = compact_index.CompactIndex(index.items())
+    assert(len(compact) == len(index))
+    assert(sorted(compact) == sorted(index))
+    for token in vocabulary + ['missing']:
+        assert(query.exec_query(token, compact) == query.exec_query(token, index))
+
+    expected = compressor.remove_stop_words(compressor.case_fold(dict(index)), compressor.stop_words)
+    normalized = compressor.remove_stop_words(compressor.case_fold(compact.copy()), compressor.stop_words)
+    assert(dict(normalized.items()) == expected)
+    assert(len(compact) == len(index))  # the copy was modified, not the original
+
+    normalized.compact()
+    assert(dict(normalized.items()) == expected)
+    assert(normalized.doc_count == max(postings_list[-1] for _, postings_list in expected.values()))
+
+
+def test_compact_index_updates():
+    '''
+    Ensure that the terms set after the build are iterated in sorted order with
+    the others, and that removed terms no longer count in doc_count.
+    '''
+
+    compact = compact_index.CompactIndex([('grain', (2, [1, 9])), ('oil', (1, [4])), ('rates', (1, [2]))])
+    compact['aardvark'] = (1, [3])
+    compact['opec'] = (1, [5])
+    compact['oil'] = (2, [4, 6])
+    assert(list(compact) == ['aardvark', 'grain', 'oil', 'opec', 'rates'])
+
+    assert(compact.doc_count == 9)
+    del compact['grain']
+    assert(compact.doc_count == 6)
+    del compact['oil']
+    assert(compact.doc_count == 5)
+    compact.compact()
+    assert(list(compact) == ['aardvark', 'opec', 'rates'] and compact.doc_count == 5)
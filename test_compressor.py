@@ -0,0 +1,57 @@
+import compressor
+import random
+
+
+def test_fused_compression():
+    '''
+    Ensure that the single pass compression gives the same index and counts
+    as applying the compressor steps one after the other.
+    '''
+
+    rng = random.Random(0)
+    vocabulary = ['Oil', 'oil', 'OIL', 'the', 'The', 'of', 'grain', 'Grain', 'rates', '1987', 'we', 'new']
+    index = {}
+    for token in vocabulary:
+        postings_list = sorted(rng.sample(range(1, 300), rng.randint(1, 40)))
+        index[token] = (len(postings_list), postings_list)
+
+    final, table = compressor.compress(index, 'vbyte')
+    assert(len(index) == len(vocabulary))  # not modified
+
+    no_numbers = compressor.remove_numbers(dict(index))
+    case_folded = compressor.case_fold(dict(no_numbers))
+    remove30 = compressor.remove_stop_words(dict(case_folded), compressor.stop_words[:30])
+    remove150 = compressor.remove_stop_words(dict(case_folded), compressor.stop_words)
+    assert(final == remove150)
+
+    for stage, stage_index in zip(compressor.STAGES, [index, no_numbers, case_folded, remove30, remove150]):
+        assert(table[stage]['tokens']['number'] == len(stage_index))
+        assert(table[stage]['non-positional postings']['number'] == sum(frequency for frequency, _ in stage_index.values()))
+        assert(table[stage]['compressed postings'] == compressor.compressed_size(stage_index, 'vbyte'))
+
+
+def test_streaming_compression():
+    '''
+    Ensure that compressing a sorted index stream through sorted runs gives
+    the same index and table as the in memory compression, even when every
+    case variant spills into its own run.
+    '''
+    import os
+    import tempfile
+    import utils
+
+    rng = random.Random(1)
+    words = [''.join(rng.choices('abc', k=rng.randint(1, 4))) for _ in range(200)]
+    tokens = set(words + [word.upper() for word in words[:80]] + [word.capitalize() for word in words[40:120]] + ['The', 'OF', '42', '1987'])
+    index = {}
+    for token in tokens:
+        postings_list = sorted(rng.sample(range(1, 500), rng.randint(1, 30)))
+        index[token] = (len(postings_list), postings_list)
+
+    final, table = compressor.compress(index, 'vbyte')
+
+    with tempfile.TemporaryDirectory() as directory:
+        outfile = os.path.join(directory, 'compressed.txt')
+        stream_table = compressor.compress_stream(sorted(index.items()), outfile, memory_budget=1)
+        assert(stream_table == table)
+        assert(dict(utils.iter_index_file(outfile)) == {term: tuple(entry) for term, entry in final.items()})
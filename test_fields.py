@@ -0,0 +1,71 @@
+import boolean_query
+import bitset
+import fields
+import pipeline
+import os
+import random
+import tempfile
+
+
+def test_docvalues_filters():
+    '''
+    Ensure that the doc values survive the round trip to disk and that the
+    filter bitmaps select the same documents as checking every record.
+    '''
+
+    rng = random.Random(0)
+    topics, places = ['grain', 'crude', 'acq', 'earn'], ['usa', 'uk', 'japan']
+    records = [pipeline.ReutersRecord(docID, docID, '', '', '', rng.sample(topics, rng.randint(0, 2)), rng.sample(places, rng.randint(0, 2)),
+                                     f'{rng.randint(1, 28)}-{rng.choice(["FEB", "MAR"])}-1987 10:00:00.00', '')
+               for docID in range(1, 301)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'index.txt.docvalues')
+        fields.DocValues.build(records).save(filename)
+        docvalues = fields.DocValues.load(filename)
+
+    for record in records:
+        assert(docvalues.values('topic', record.docID) == record.topics)
+        assert(docvalues.date(record.docID) == fields.parse_date(record.date))
+
+    query, filters = fields.split_filters('oil topic:grain  place:usa date:1987-03..1987-03-10')
+    assert(query == 'oil')
+    expected = [r.docID for r in records if 'grain' in r.topics and 'usa' in r.places and 19870301 <= fields.parse_date(r.date) <= 19870310]
+    assert(bitset.docIDs(fields.filter_bitmap(filters, docvalues)) == expected)
+
+    postings_list = list(range(1, 301, 3))
+    result = fields.apply_filters({'oil': {'frequency': len(postings_list), 'postings': postings_list}}, 'q', filters, docvalues)
+    assert(result['q']['postings'] == [docID for docID in expected if docID % 3 == 1])
+    assert(bitset.filter_postings(postings_list, bitset.from_docIDs(expected)) == result['q']['postings'])
+
+
+def test_boolean_filters():
+    '''
+    Ensure that filters are operands of boolean queries, next to operators,
+    parentheses and negations, and that split_filters leaves parentheses alone.
+    '''
+
+    rng = random.Random(1)
+    records = [pipeline.ReutersRecord(docID, docID, '', '', '', rng.sample(['grain', 'crude'], rng.randint(0, 2)), rng.sample(['usa', 'uk'], rng.randint(0, 1)),
+                                     f'{rng.randint(1, 28)}-MAR-1987 10:00:00.00', '')
+               for docID in range(1, 201)]
+    docvalues = fields.DocValues.build(records)
+    index = {term: (len(postings_list), postings_list) for term, postings_list in
+             [('oil', list(range(1, 201, 2))), ('gas', list(range(1, 201, 5)))]}
+
+    oil, gas = set(index['oil'][1]), set(index['gas'][1])
+    grain = {r.docID for r in records if 'grain' in r.topics}
+    usa = {r.docID for r in records if 'usa' in r.places}
+    expectations = {
+        'oil AND topic:grain': oil & grain,
+        '(oil AND topic:grain)': oil & grain,
+        '(oil OR gas) AND NOT place:usa': (oil | gas) - usa,
+        'topic:grain OR place:usa': grain | usa,
+        'NOT topic:grain': set(range(1, 201)) - grain,
+    }
+    for query, expected in expectations.items():
+        result = boolean_query.exec_boolean_query(query, index, docvalues=docvalues)[query]
+        assert(result['postings'] == sorted(expected)), query
+
+    assert(boolean_query.parse('(oil AND topic:grain)') == ('and', [('term', 'oil'), ('filter', ['topic', 'grain'])]))
+    assert(fields.split_filters('(oil topic:grain)')[1] == [('topic', 'grain')])
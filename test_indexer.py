@@ -0,0 +1,136 @@
+import indexer
+import pipeline
+
+SGM = '''<!DOCTYPE lewis SYSTEM "lewis.dtd">
+<REUTERS TOPICS="YES" LEWISSPLIT="TRAIN" CGISPLIT="TRAINING-SET" OLDID="5544" NEWID="1">
+<DATE>26-FEB-1987 15:01:01.79</DATE>
+<TOPICS><D>cocoa</D><D>grain</D></TOPICS>
+<PLACES><D>el-salvador</D><D>usa</D></PLACES>
+<PEOPLE></PEOPLE>
+<TEXT>&#2;
+<TITLE>BAHIA COCOA REVIEW</TITLE>
+<DATELINE>    SALVADOR, Feb 26 - </DATELINE><BODY>Showers continued throughout the week in
+the Bahia cocoa zone, alleviating the drought &lt;since> early January.
+ Reuter
+&#3;</BODY></TEXT>
+</REUTERS>
+<REUTERS TOPICS="NO" LEWISSPLIT="TRAIN" CGISPLIT="TRAINING-SET" OLDID="5545" NEWID="2">
+<DATE> 26-FEB-1987 15:02:20.00</DATE>
+<TOPICS></TOPICS>
+<PLACES><D>usa</D></PLACES>
+<TEXT TYPE="UNPROC">&#2;
+U.S. grain carloadings fell in the week, said the Association of
+American Railroads.
+&#3;
+
+</TEXT>
+</REUTERS>
+<REUTERS TOPICS="YES" LEWISSPLIT="TEST" CGISPLIT="TRAINING-SET" OLDID="5546" NEWID="3">
+<DATE>26-FEB-1987 15:03:27.51</DATE>
+<TOPICS><D>crude</D></TOPICS>
+<PLACES></PLACES>
+<TEXT TYPE="BRIEF">&#2;
+******<TITLE>TEXACO CANADA CUTS CRUDE PRICES</TITLE>
+Blah blah blah.
+&#3;
+
+</TEXT>
+</REUTERS>
+'''
+
+
+def old_document_extracter(contents: str):
+    '''The extraction path indexer.py had before iter_reuters_records'''
+
+    def remove_tags(doc):
+        tag_start = doc.find('<')
+        while tag_start >= 0:
+            tag_end = doc.find('>', tag_start)
+            if doc[tag_start+1:tag_end] != '/TEXT':
+                doc = doc[:tag_start] + doc[tag_end+1:]
+            else:
+                doc = doc[:tag_start]
+            tag_start = doc.find('<')
+        return doc
+
+    def clean_reccuring_patterns(doc):
+        for pattern in ['&#2;', '&#3;']:
+            start = doc.find(pattern)
+            doc = doc[:start] + ' ' + doc[start + len(pattern) + 1:]
+        return doc
+
+    docs = []
+    start_idx = contents.find('<REUTERS')
+    while start_idx >= 0:
+        end_idx = contents.find('</REUTERS>', start_idx) + len('</REUTERS>')
+        document = contents[start_idx:end_idx]
+        text = document[document.find('<TEXT'):document.find('</TEXT>')+len('</TEXT>')]
+        docs.append(clean_reccuring_patterns(remove_tags(text)))
+        start_idx = contents.find('<REUTERS', end_idx)
+    return docs
+
+
+def test_reuters_records_match_old_extraction():
+    '''
+    Ensure that the single pass over the tags extracts the same text as the
+    original find and slice extraction, with nested tags, documents without
+    TITLE or BODY and entities, and that the fields of every document are read.
+    '''
+
+    records = list(pipeline.iter_reuters_records(SGM, first_docID=10))
+    assert([record.text for record in records] == old_document_extracter(SGM))
+    assert(indexer.document_extracter([SGM, SGM]) == old_document_extracter(SGM) * 2)
+    assert('&lt;since>' in records[0].text and '&#' not in ''.join([record.text for record in records]))
+
+    assert([(record.docID, record.newid) for record in records] == [(10, 1), (11, 2), (12, 3)])
+    assert(records[0].title == 'BAHIA COCOA REVIEW' and records[0].dateline == '    SALVADOR, Feb 26 - ')
+    assert(records[0].body.startswith('Showers continued') and records[0].body.endswith('Reuter\n&#3;'))
+    assert((records[0].topics, records[0].places) == (['cocoa', 'grain'], ['el-salvador', 'usa']))
+    assert([record.date for record in records] == ['26-FEB-1987 15:01:01.79', '26-FEB-1987 15:02:20.00', '26-FEB-1987 15:03:27.51'])
+
+    assert((records[1].title, records[1].dateline, records[1].body) == ('', '', ''))
+    assert((records[1].topics, records[1].places) == ([], ['usa']))
+    assert((records[2].title, records[2].body, records[2].topics, records[2].places) == ('TEXACO CANADA CUTS CRUDE PRICES', '', ['crude'], []))
+
+
+def test_clean_reccuring_patterns():
+    '''
+    Ensure that each pattern and the character after it are replaced by a
+    space, and that a document missing a pattern is otherwise left as it is.
+    '''
+
+    assert(pipeline.clean_reccuring_patterns('&#2;\noil prices\n&#3;\n') == ' oil prices\n ')
+    assert(pipeline.clean_reccuring_patterns('&#2;&#3;oil') == ' #3;oil')  # the & of &#3; went with &#2;
+    assert(pipeline.clean_reccuring_patterns('oil prices\n&#3;\n') == 'oil prices\n ')
+    assert(pipeline.clean_reccuring_patterns('oil prices') == 'oil prices')
+
+
+def test_parallel_index_creation():
+    '''
+    Ensure that indexing the .sgm files with a pool of workers gives the same
+    index and positional index as the sequential build, the local docIDs of
+    every file being shifted by the documents of the files before it.
+    '''
+    import benchmark
+    import os
+    import positional
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark.generate_synthetic_corpus(directory, files=4, docs_per_file=15, words_per_doc=20, vocabulary_size=100)
+
+        sequential_positions = positional.PositionalIndexBuilder(['case_fold'])
+        sequential = indexer.from_scratch_index_creation(directory, ['case_fold'], sequential_positions)
+        parallel_positions = positional.PositionalIndexBuilder(['case_fold'])
+        parallel = indexer.parallel_index_creation(directory, 3, ['case_fold'], parallel_positions)
+
+        assert(parallel == sequential)
+        assert(list(parallel_positions.items()) == list(sequential_positions.items()))
+        assert(max(docID for _, postings_list in parallel.values() for docID in postings_list) == 60)
+
+        doc_count, partial_index, partial_positions = indexer.index_corpus_file(pipeline.corpus_files(directory)[1], ['case_fold'], with_positions=True)
+        assert(doc_count == 15 and max(docID for _, (_, postings_list) in partial_index for docID in postings_list) == 15)
+        assert([(token, [docID + 15 for docID in postings_list]) for token, (_, postings_list) in partial_index]
+               == [(token, [docID for docID in postings_list if 15 < docID <= 30]) for token, (_, postings_list) in sorted(sequential.items())
+                   if any(15 < docID <= 30 for docID in postings_list)])
+        assert(len(partial_positions) == len(partial_index))
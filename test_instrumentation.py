@@ -0,0 +1,41 @@
+import instrumentation
+import time
+
+
+def test_stage_metrics():
+    '''
+    Ensure that nested stages and lazy stages are measured without counting
+    the time of their nested stages twice, that the resident memory of a
+    stage covers its nested stages, and that every stage is exported.
+    '''
+
+    recorder = instrumentation.Recorder()
+    recorder.enabled = True
+
+    def produce():
+        for i in range(5):
+            time.sleep(0.002)
+            yield i
+
+    with recorder.stage('outer', items=1) as stage:
+        time.sleep(0.01)
+        consumed = list(recorder.iterate('inner', produce(), item_size=lambda item: 4))
+        stage.bytes_out = 10
+
+    assert(consumed == list(range(5)))
+    metrics = recorder.as_dict()
+    outer, inner = metrics['outer'], metrics['inner']
+    assert((outer['calls'], outer['items'], outer['bytes_out']) == (1, 1, 10))
+    assert((inner['calls'], inner['items'], inner['bytes_out']) == (1, 5, 20))
+    assert(inner['wall_seconds'] >= 0.01 and outer['self_seconds'] >= 0.01)
+    assert(abs(outer['wall_seconds'] - outer['self_seconds'] - inner['wall_seconds']) <= 1.5e-6 + 1e-12)  # each is rounded to 6 decimals
+    assert(inner['peak_rss_bytes'] > 0 and outer['peak_rss_bytes'] >= inner['peak_rss_bytes'])  # sampled in /proc
+
+    prometheus = recorder.prometheus()
+    assert('niix_stage_wall_seconds_total{stage="inner"}' in prometheus)
+    assert('# TYPE niix_stage_peak_rss_bytes gauge' in prometheus)
+
+    disabled = instrumentation.Recorder()
+    with disabled.stage('outer'):
+        list(disabled.iterate('inner', produce()))
+    assert(disabled.as_dict() == {})
@@ -0,0 +1,98 @@
+import loadgen
+import json
+import os
+import tempfile
+import time
+import utils
+
+
+def test_zipf_workload():
+    '''
+    Ensure that the synthetic queries are drawn from the vocabulary with the
+    most frequent terms drawn most often, and that the log formats are read.
+    '''
+
+    index = {f'term{i}': (1000 - i, list(range(1, 1001 - i))) for i in range(200)}
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_file = os.path.join(directory, 'index.txt')
+        utils.save_index_to_disk(index, index_file)
+
+        workload = loadgen.zipf_workload(index_file, 5000, exponent=1.2, seed=1)
+        assert(len(workload) == 5000 and all([mode == 'term' and query in index for mode, query in workload]))
+        counts = {}
+        for _, query in workload:
+            counts[query] = counts.get(query, 0) + 1
+        assert(counts['term0'] > counts.get('term1', 0) > counts.get('term50', 0))
+
+        boolean = loadgen.zipf_workload(index_file, 10, mode='boolean', terms_per_query=3)
+        assert(all([len(query.split(' AND ')) == 3 for _, query in boolean]))
+
+        log_file = os.path.join(directory, 'queryLog.jsonl')
+        for mode, query in [('boolean', 'oil AND grain'), ('term', 'oil')]:
+            utils.append_json_line({'time': time.time(), 'mode': mode, 'query': query, 'frequency': 1}, log_file)
+        assert(loadgen.read_query_log(log_file) == [('boolean', 'oil AND grain'), ('term', 'oil')])
+
+        sample_file = os.path.join(directory, 'sampleQueries.json')
+        with open(sample_file, mode='w') as f:
+            json.dump({'oil': {}, 'grain': {}}, f)
+        assert(loadgen.read_query_log(sample_file, 'wildcard') == [('wildcard', 'oil'), ('wildcard', 'grain')])
+
+
+def test_load_report():
+    '''
+    Ensure that every scheduled query is sent once by the concurrent clients
+    and accounted for in the report, its histogram and its timeline.
+    '''
+
+    class Target:
+        def __init__(self):
+            self.queries = []
+
+        def query(self, mode, query_string, k):
+            if query_string == 'bad':
+                raise ValueError(query_string)
+            self.queries.append(query_string)
+
+    workload = [('term', 'oil'), ('term', 'grain'), ('term', 'bad')]
+    for run_model in [loadgen.run_threads, loadgen.run_asyncio]:
+        target = Target()
+        start = time.time()
+        records = run_model(target, loadgen.Schedule(workload, start, count=30), 10, 4)
+        report = loadgen.summarize(records, [(time.time(), {'loadgen': 1})], start, 0.5)
+
+        assert(sorted(target.queries) == sorted(['oil', 'grain'] * 10))
+        assert((report['queries'], report['errors']) == (30, 10))
+        assert(report['latency']['count'] == 20 and report['modes']['term']['count'] == 20)
+        assert(sum([bucket['count'] for bucket in report['histogram']]) == 20)
+        assert(sum([point['queries'] + point['errors'] for point in report['timeline']]) == 30)
+        assert(report['peak_rss_bytes'] == {'loadgen': 1})
+
+    assert(loadgen.histogram([1e-6, 3e-6, 4e-6, 4.5e-6]) == [{'le_us': 1, 'count': 1}, {'le_us': 2, 'count': 0},
+                                                             {'le_us': 4, 'count': 2}, {'le_us': 8, 'count': 1}])
+
+
+def test_run_processes():
+    '''
+    Ensure that the worker processes answer every scheduled query, and that a
+    worker which cannot open its target fails the run instead of leaving the
+    others waiting for it at the barrier.
+    '''
+    import pytest
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_file = os.path.join(directory, 'index.txt')
+        utils.save_index_to_disk({'oil': (2, [1, 2]), 'grain': (1, [3])}, index_file)
+        workload = [('term', 'oil'), ('term', 'grain')]
+
+        sampler = loadgen.MemorySampler(10.0, {})
+        start, records = loadgen.run_processes((None, index_file), workload, {'count': 20}, 10, 2, sampler)
+        sampler.stop()
+        assert(len(records) == 20 and start > 0)
+
+        sampler = loadgen.MemorySampler(10.0, {})
+        began = time.time()
+        with pytest.raises(RuntimeError) as error:
+            loadgen.run_processes((None, os.path.join(directory, 'missing.txt')), workload, {'count': 20}, 10, 2, sampler)
+        sampler.stop()
+        assert('could not open its target' in str(error.value) and time.time() - began < 30)
@@ -0,0 +1,82 @@
+import pipeline
+import compressor
+import random
+
+
+def test_pipeline_matches_compressor():
+    '''
+    Ensure that normalizing the term-docID stream while indexing gives the
+    same index as indexing first and running the compressor steps after.
+    '''
+
+    rng = random.Random(0)
+    vocabulary = ['The', 'the', 'Oil', 'oil', 'prices', 'Prices', 'of', 'Grain', '1987', 'rates']
+    pairs = [(token, docID) for docID in range(1, 101) for token in rng.choices(vocabulary, k=rng.randint(0, 20))]
+
+    index = pipeline.accumulate_postings(pairs)
+    for token, (frequency, postings_list) in index.items():
+        assert(postings_list == sorted(set(docID for t, docID in pairs if t == token)))
+        assert(frequency == len(postings_list))
+
+    expected = compressor.remove_stop_words(compressor.case_fold(compressor.remove_numbers(dict(index))), compressor.stop_words)
+    normalizers = [compressor.NORMALIZERS[name] for name in ['numbers', 'case_fold', 'stop_words_150']]
+    assert(pipeline.accumulate_postings(pipeline.normalize(pairs, normalizers)) == expected)
+
+    tf_index, doc_lengths = pipeline.accumulate_tf_postings(pairs)
+    assert(sum(doc_lengths.values()) == len(pairs))
+    assert([docID for docID, _ in tf_index['oil'][1]] == index['oil'][1])
+
+
+def test_fast_tokenizer_matches_stripped_tokens():
+    '''
+    Ensure that the single regex of pipeline.tokenize finds the same terms as
+    TOKEN_PATTERN with the trailing - and ' stripped from every token.
+    '''
+    import re
+
+    def stripped_tokens(doc):
+        tokens = []
+        for token in re.findall(pipeline.TOKEN_PATTERN, doc):
+            while token[-1] == "-" or token[-1] == "'":
+                token = token[:-1]
+            tokens.append(token)
+        return tokens
+
+    rng = random.Random(0)
+    for _ in range(2000):
+        doc = ''.join(rng.choices("ab-' 1.", k=rng.randint(0, 30)))
+        assert(pipeline.tokenize(doc) == stripped_tokens(doc))
+        assert(pipeline.unique_terms(doc) == list(dict.fromkeys(stripped_tokens(doc))))
+
+
+def test_extract_documents_and_term_docID_pairs():
+    '''
+    Ensure that the documents of every .sgm file of a corpus get docIDs counted
+    across files, in file name order, and that the term-docID pairs are those
+    of their text, normalized, once per document with <unique>.
+    '''
+    import os
+    import tempfile
+
+    def sgm(texts):
+        return ''.join([f'<REUTERS NEWID="{i}">\n<TEXT>&#2;\n<TITLE>{title}</TITLE>\n<BODY>{body}\n&#3;</BODY></TEXT>\n</REUTERS>\n'
+                        for i, (title, body) in enumerate(texts, start=1)])
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, texts in [('reut2-001.sgm', [('Grain', 'wheat and grain')]), ('reut2-000.sgm', [('OIL', 'oil prices'), ('Rates', 'rates rise')])]:
+            with open(os.path.join(directory, name), mode='w') as f:
+                f.write(sgm(texts))
+        with open(os.path.join(directory, 'README.txt'), mode='w') as f:
+            f.write('<REUTERS NEWID="9"><TEXT>not a corpus file</TEXT></REUTERS>')
+
+        docs = list(pipeline.extract_documents(pipeline.read_files(directory)))
+        assert([docID for docID, _ in docs] == [1, 2, 3])
+        assert([doc.split() for _, doc in docs] == [['OIL', 'oil', 'prices'], ['Rates', 'rates', 'rise'], ['Grain', 'wheat', 'and', 'grain']])
+
+        pairs = list(pipeline.term_docID_pairs(directory))
+        assert(pairs == [(token, docID) for docID, doc in docs for token in doc.split()])
+
+        case_fold = [compressor.NORMALIZERS['case_fold']]
+        unique = list(pipeline.term_docID_pairs(directory, case_fold, unique=True))
+        assert(unique == [('oil', 1), ('oil', 1), ('prices', 1), ('rates', 2), ('rates', 2), ('rise', 2), ('grain', 3), ('wheat', 3), ('and', 3), ('grain', 3)])
+        assert(pipeline.accumulate_postings(unique)['oil'] == (1, [1]))
@@ -0,0 +1,98 @@
+import boolean_query
+import positional
+import binary_index
+import utils
+import random
+import os
+
+def brute_force(docs, query):
+    '''Documents matching a phrase (list of tokens) or a (token, token, k) proximity, by scanning the docs'''
+    if isinstance(query, list):
+        return [docID for docID, tokens in docs.items() if any(tokens[i:i + len(query)] == query for i in range(len(tokens)))]
+    a, b, k = query
+    return [docID for docID, tokens in docs.items()
+            if any(abs(i - j) <= k for i, x in enumerate(tokens) if x == a for j, y in enumerate(tokens) if y == b)]
+
+def test_phrase_and_proximity_queries():
+    '''
+    Ensure that positional intersections, read back from the .pos file, find
+    the same documents as scanning the token lists.
+    '''
+
+    utils.ensure_dir_exists('output/')
+
+    rng = random.Random(0)
+    vocabulary = ['interest', 'rates', 'oil', 'prices', 'rise', 'the']
+    docs = {docID: rng.choices(vocabulary, k=rng.randint(1, 30)) for docID in range(1, 201)}
+
+    positional_index = {}
+    for docID, tokens in docs.items():
+        for position, token in enumerate(tokens):
+            frequency, postings = positional_index.get(token, (0, []))
+            if not postings or postings[-1][0] != docID:
+                postings.append((docID, []))
+                frequency += 1
+            postings[-1][1].append(position)
+            positional_index[token] = (frequency, postings)
+
+    index_file = 'output/test_positional.txt'
+    binary_index.write_binary_index(sorted(positional_index.items()), positional.positional_index_filename(index_file), codec='positions')
+    index = {token: (frequency, [docID for docID, _ in postings]) for token, (frequency, postings) in positional_index.items()}
+
+    with positional.open_positional_index(index_file) as loaded:
+        queries = {
+            '"interest rates"': ['interest', 'rates'],
+            '"oil prices rise"': ['oil', 'prices', 'rise'],
+            '"the"': ['the'],
+            'oil /2 rates': ('oil', 'rates', 2),
+            'rates /0 rates': ('rates', 'rates', 0),
+            'interest /5 missing': ('interest', 'missing', 5),
+        }
+        for query, expected in queries.items():
+            assert(boolean_query.exec_boolean_query(query, index, loaded)[query]['postings'] == brute_force(docs, expected)), query
+
+        query = '"interest rates" AND NOT oil'
+        expected = sorted(set(brute_force(docs, ['interest', 'rates'])) - set(index['oil'][1]))
+        assert(boolean_query.exec_boolean_query(query, index, loaded)[query]['postings'] == expected)
+
+    os.remove(positional.positional_index_filename(index_file))
+
+
+def test_positional_index_builder():
+    '''
+    Ensure that the positions flushed into blocks and merged give the same
+    positional index as the ones held in memory, and that phrase queries are
+    refused on a segment directory, whose segments carry no positions.
+    '''
+    import pytest
+    import segments
+    import tempfile
+
+    rng = random.Random(1)
+    vocabulary = ['interest', 'rates', 'oil', 'prices', 'Rise', 'the']
+    docs = [(docID, ' '.join(rng.choices(vocabulary, k=rng.randint(1, 30)))) for docID in range(1, 101)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        in_memory = positional.PositionalIndexBuilder(['case_fold'])
+        blocks = positional.PositionalIndexBuilder(['case_fold'], memory_budget=2000, directory=directory)
+        assert([doc for doc in blocks.observe(docs)] == docs)
+        for docID, doc in docs:
+            in_memory.add(docID, doc)
+
+        assert(len(blocks.blocks) > 1)
+        assert(list(blocks.items()) == list(in_memory.items()))
+        assert(dict(in_memory.items()) == positional.generate_positional_index(docs, ['case_fold']))
+
+        index_file = os.path.join(directory, 'index.txt')
+        utils.save_index_to_disk({'rise': (1, [1])}, index_file)
+        blocks.write(index_file)
+        with positional.open_positional_index(index_file) as loaded:
+            assert([(token, loaded[token]) for token in loaded] == list(in_memory.items()))
+
+            segment_dir = os.path.join(directory, 'segments')
+            segments.create_segment_directory(segment_dir, index_file)
+            assert(positional.open_positional_index(segment_dir) == None)
+            segmented = segments.SegmentedIndex(segment_dir)
+            with pytest.raises(ValueError):
+                boolean_query.exec_boolean_query('"interest rates"', segmented, loaded)
+            segmented.close()
@@ -0,0 +1,32 @@
+import postings_codec
+import random
+
+def test_codecs_round_trip():
+    '''
+    Ensure that every codec decodes exactly the postings lists it encoded,
+    including empty lists, docID 0 and gaps too large for the PForDelta width.
+    '''
+
+    rng = random.Random(0)
+    postings_lists = [
+        [],
+        [0],
+        [1, 2, 3],
+        [7, 2 ** 31],
+        sorted(rng.sample(range(1, 22000), 300)),
+        sorted(rng.sample(range(1, 22000), 5000)),
+    ]
+
+    for codec in postings_codec.DOCID_CODECS:
+        for postings_list in postings_lists:
+            encoded = postings_codec.encode(postings_list, codec)
+            assert(postings_codec.decode(encoded, codec) == postings_list), f'{codec} failed on {postings_list[:10]}'
+
+def test_gap_codecs_are_smaller_than_raw():
+    '''Dense postings lists should take less space once gap encoded.'''
+
+    postings_list = list(range(1, 20000, 3))
+    raw_size = len(postings_codec.encode(postings_list, 'raw'))
+
+    for codec in ['vbyte', 'gamma', 'delta', 'pfor']:
+        assert(len(postings_codec.encode(postings_list, codec)) < raw_size / 3), codec
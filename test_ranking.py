@@ -0,0 +1,78 @@
+import ranking
+import bitset
+import random
+
+def make_ranked_index(seed=0, doc_count=300):
+    rng = random.Random(seed)
+    vocabulary = ['oil', 'prices', 'rates', 'opec', 'grain', 'the']
+    weights = [5, 3, 2, 1, 1, 20]
+    tf_index = {}
+    doc_lengths = {}
+
+    for docId in range(1, doc_count + 1):
+        words = rng.choices(vocabulary, weights, k=rng.randint(1, 40))
+        doc_lengths[docId] = len(words)
+        for word in words:
+            tf_index.setdefault(word, {})
+            tf_index[word][docId] = tf_index[word].get(docId, 0) + 1
+
+    tf_index = {token: (len(tf_index[token]), sorted(tf_index[token].items())) for token in tf_index}
+    return ranking.RankedIndex.build(tf_index, doc_lengths)
+
+def test_wand_matches_exhaustive_scoring():
+    '''
+    Ensure that WAND pruning returns the same top k documents, in the same
+    order, as scoring every posting.
+    '''
+
+    ranked = make_ranked_index()
+    queries = [['oil'], ['oil', 'prices'], ['the', 'opec', 'grain'], ['rates', 'missing'], ['missing']]
+
+    for query_terms in queries:
+        for k in [0, 1, 5, 20, 1000]:
+            assert(ranking.top_k_wand(query_terms, ranked, k) == ranking.top_k_exhaustive(query_terms, ranked, k)), (query_terms, k)
+    assert(ranking.exec_ranked_query('oil', ranked, 0)['oil']['postings'] == [])
+
+def test_max_scores_are_upper_bounds():
+    ranked = make_ranked_index(seed=1)
+
+    for token, (_, max_score, tf_postings) in ranked.postings.items():
+        assert(all([ranked.score(token, docId, tf) <= max_score for docId, tf in tf_postings]))
+
+def test_filtered_top_k():
+    '''
+    Ensure that a filter is applied during the top k search: the k best
+    documents among those of the filter are returned, not the filtered top k.
+    '''
+
+    ranked = make_ranked_index(seed=2)
+    kept = [docId for docId in range(1, 301) if docId % 7 == 0]
+    filter_bits = bitset.from_docIDs(kept)
+
+    for query_terms in [['oil'], ['oil', 'prices'], ['the', 'opec', 'grain']]:
+        everything = ranking.top_k_exhaustive(query_terms, ranked, 1000)
+        expected = [(docId, score) for docId, score in everything if docId % 7 == 0][:10]
+        assert(len(expected) == 10)
+        assert(ranking.top_k_wand(query_terms, ranked, 10, filter_bits) == expected), query_terms
+        assert(ranking.top_k_exhaustive(query_terms, ranked, 10, filter_bits) == expected), query_terms
+
+def test_ranked_index_on_disk():
+    '''
+    Ensure that the postings of a saved ranked index looked up on disk, past
+    its header line, give the same top k as the loaded index.
+    '''
+    import os
+    import tempfile
+
+    ranked = make_ranked_index(seed=3)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'index.txt.ranked')
+        ranking.save_ranked_index(ranked, filename)
+        loaded = ranking.load_ranked_index(filename)
+        on_disk = ranking.load_ranked_index(filename, on_disk=True)
+
+        assert(sorted(on_disk.postings) == sorted(ranked.postings) and 'k1' not in on_disk.postings and 'missing' not in on_disk.postings)
+        for query_terms in [['oil'], ['oil', 'prices'], ['the', 'opec', 'grain'], ['rates', 'missing'], ['missing']]:
+            expected = ranking.top_k_exhaustive(query_terms, ranked, 10)
+            assert(ranking.top_k_wand(query_terms, loaded, 10) == expected), query_terms
+            assert(ranking.top_k_wand(query_terms, on_disk, 10) == expected), query_terms
@@ -0,0 +1,140 @@
+import segments
+import boolean_query
+import os
+import tempfile
+import threading
+import utils
+
+
+def make_directory(directory: str) -> str:
+    '''Segment directory on top of a main index of docIDs 1 to 4'''
+    main_file = os.path.join(directory, 'main.txt')
+    utils.save_index_to_disk({'oil': (2, [1, 3]), 'grain': (3, [1, 2, 4]), 'wheat': (1, [4])}, main_file)
+    segment_dir = os.path.join(directory, 'segments')
+    segments.create_segment_directory(segment_dir, main_file)
+    return segment_dir
+
+
+def test_add_and_delete():
+    '''
+    Ensure that added documents get the next docIDs and are found with the
+    main index, that deleted documents disappear, and that both survive
+    reopening the directory.
+    '''
+
+    with tempfile.TemporaryDirectory() as directory:
+        segment_dir = make_directory(directory)
+        index = segments.SegmentedIndex(segment_dir)
+
+        assert(index.add_documents(['oil prices', 'grain and oil']) == [5, 6])
+        assert(index.add_documents(['rates']) == [7])
+        assert(index['oil'] == (4, [1, 3, 5, 6]))
+        assert(index['rates'] == (1, [7]))
+
+        index.delete([3, 6, 7])
+        assert(index['oil'] == (2, [1, 5]))
+        assert('rates' not in index and 'rates' not in list(index))
+        assert(boolean_query.exec_boolean_query('NOT oil', index)['NOT oil']['postings'] == [2, 4])
+
+        reopened = utils.open_index(segment_dir)
+        assert(reopened.doc_count == 7 and len(reopened.tombstones) == 3)
+        assert(dict(reopened.items()) == dict(index.items()))
+
+        index.delete([1])
+        reopened.reload()
+        assert(reopened['oil'] == (1, [5]))
+        reopened.close()
+        index.close()
+
+
+def test_logarithmic_merging():
+    '''
+    Ensure that segments of the same level are merged into one of the next
+    level with the same postings, dropping the deleted documents, and that
+    queries running during a merge keep reading the segments they started with.
+    '''
+
+    with tempfile.TemporaryDirectory() as directory:
+        segment_dir = make_directory(directory)
+        index = segments.SegmentedIndex(segment_dir)
+
+        for doc in ['oil one', 'oil two', 'grain three']:
+            index.add_documents([doc])
+            index.merge()
+        assert([segment['level'] for segment in index.manifest['segments']] == [1, 0])
+        index.add_documents(['oil four'])
+        index.delete([6])
+        before = dict(index.items())
+
+        parts = index._acquire()  # a query in flight during the merge
+        index.merge()
+        assert([segment['level'] for segment in index.manifest['segments']] == [2])
+        assert(dict(index.items()) == before)
+        assert(['oil' in part for part in parts[1:]] == [True, False, True])  # still open
+        index._release(parts)
+
+        assert(sorted(os.listdir(segment_dir)) == sorted([segments.MANIFEST, segments.TOMBSTONES, index.manifest['segments'][0]['file']]))
+        merged = utils.open_index(os.path.join(segment_dir, index.manifest['segments'][0]['file']))
+        assert(6 not in merged['oil'][1])
+
+        errors = []
+
+        def query():
+            try:
+                for _ in range(200):
+                    assert(index['oil'] == before['oil'])
+            except Exception as e:
+                errors.append(e)
+
+        readers = [threading.Thread(target=query) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for doc in ['wheat'] * 8:
+            index.add_documents([doc])
+            index.merge()
+        for reader in readers:
+            reader.join()
+        assert(errors == [])
+        index.close()
+
+
+def test_updates_are_checked():
+    '''
+    Ensure that docIDs outside of 1 to doc_count are refused without deleting
+    anything, that added documents get the normalizers of the main index, and
+    that merges started together merge every pair once.
+    '''
+
+    with tempfile.TemporaryDirectory() as directory:
+        main_file = os.path.join(directory, 'main.txt')
+        utils.save_index_to_disk({'oil': (2, [1, 3]), 'grain': (3, [1, 2, 4])}, main_file)
+        segment_dir = os.path.join(directory, 'segments')
+        segments.create_segment_directory(segment_dir, main_file, ['case_fold'])
+        index = segments.SegmentedIndex(segment_dir)
+
+        for docIDs in [[-1], [0], [2, 5], [10 ** 12]]:
+            try:
+                index.delete(docIDs)
+                assert(False)
+            except ValueError:
+                pass
+        assert(len(index.tombstones) == 0 and len(index.tombstones.bits) == 1)
+
+        assert(index.add_documents(['OIL Prices', 'Grain']) == [5, 6])
+        assert(index['oil'] == (3, [1, 3, 5]) and index['grain'] == (4, [1, 2, 4, 6]) and 'OIL' not in index)
+        assert(utils.load_json_from_disk(os.path.join(segment_dir, segments.MANIFEST))['normalizers'] == ['case_fold'])
+
+        errors, excepthook = [], threading.excepthook
+        threading.excepthook = lambda hook_args: errors.append(hook_args.exc_value)  # raised in merge_in_background
+        try:
+            for _ in range(20):
+                index.add_documents(['oil'])
+                background = index.merge_in_background()
+                index.merge()
+                background.join()
+        finally:
+            threading.excepthook = excepthook
+        assert(errors == [])
+        assert(sorted([segment['level'] for segment in index.manifest['segments']], reverse=True) == [4, 2, 0])
+        assert(index['oil'][1] == [1, 3, 5] + list(range(7, 27)))
+        index.close()
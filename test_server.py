@@ -0,0 +1,90 @@
+import server
+import os
+import tempfile
+import utils
+
+
+def test_reload_closes_previous_index():
+    '''
+    Ensure that a reload closes the previous index once the queries running
+    on it are done, and that their results don't go into the emptied cache.
+    '''
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_file = os.path.join(directory, 'index.bin')
+        utils.save_index_to_disk({'oil': (2, [1, 2])}, index_file, binary=True, codec='vbyte')
+        service = server.QueryService(index_file, cache_size=2**20)
+        assert(service.exec_query('oil')['oil']['postings'] == [1, 2])
+
+        old_index = service.index.index
+        generation, cache_generation = service._start_query()  # a query still running on the old index
+        utils.save_index_to_disk({'oil': (1, [3])}, index_file, binary=True, codec='vbyte')
+        service.load()
+
+        assert(not old_index._mm.closed)
+        service.results_cache.put(('term', 'oil', None), {'oil': {'postings': [1, 2]}}, 100, cache_generation)
+        assert(len(service.results_cache) == 0)
+        service._end_query(generation)
+        assert(old_index._mm.closed)
+
+        assert(service.exec_query('oil')['oil']['postings'] == [3])
+        service.close()
+
+
+def test_http_server():
+    '''
+    Ensure that the asyncio server answers /query and /health on an ephemeral
+    port, several requests on one kept alive connection, and that the answered
+    queries reach the log once the service is closed.
+    '''
+    import asyncio
+    import json
+
+    async def request(reader, writer, target, connection='keep-alive'):
+        writer.write(f'GET {target} HTTP/1.1\r\nHost: localhost\r\nConnection: {connection}\r\n\r\n'.encode('latin-1'))
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return status, headers, json.loads(await reader.readexactly(int(headers['content-length'])))
+
+    async def client(query_server):
+        listening = await query_server.start('127.0.0.1', 0)
+        port = listening.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+
+        responses = [await request(reader, writer, '/query?q=oil'),
+                     await request(reader, writer, '/query?q=oil+AND+grain&mode=boolean'),
+                     await request(reader, writer, '/health'),
+                     await request(reader, writer, '/nowhere', connection='close')]
+        assert(await reader.read() == b'')  # closed by the server after Connection: close
+
+        writer.close()
+        listening.close()
+        await listening.wait_closed()
+        return responses
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_file = os.path.join(directory, 'index.txt')
+        log_file = os.path.join(directory, 'queryLog.jsonl')
+        utils.save_index_to_disk({'grain': (2, [2, 3]), 'oil': (2, [1, 2])}, index_file)
+        service = server.QueryService(index_file, log_file)
+        query_server = server.QueryServer(service, threads=2)
+
+        responses = asyncio.run(client(query_server))
+        assert([status for status, _, _ in responses] == [200, 200, 200, 404])
+        assert([headers['connection'] for _, headers, _ in responses] == ['keep-alive'] * 3 + ['close'])
+        assert(responses[0][2]['oil']['postings'] == [1, 2])
+        assert(responses[1][2]['oil AND grain']['postings'] == [2])
+        assert(responses[2][2] == {'terms': 2})
+
+        service.close()
+        query_server.executor.shutdown()
+        with open(log_file) as f:
+            log = [json.loads(line) for line in f]
+        assert([(line['mode'], line['query'], line['frequency']) for line in log] == [('term', 'oil', 2), ('boolean', 'oil AND grain', 1)])
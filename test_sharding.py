@@ -0,0 +1,86 @@
+import sharding
+import benchmark
+import boolean_query
+import pipeline
+import query
+import utils
+import random
+import os
+import pytest
+import tempfile
+
+
+def test_scatter_gather():
+    '''
+    Ensure that querying round robin document shards through the coordinator
+    gives the same answers as querying the whole index.
+    '''
+
+    utils.ensure_dir_exists('output/')
+    index_file = 'output/test_sharding.txt'
+    shards = 3
+
+    rng = random.Random(0)
+    vocabulary = ['oil', 'grain', 'rates', 'bank', 'dollar']
+    docs = {docID: set(rng.sample(vocabulary, rng.randint(1, 3))) for docID in range(1, 101)}
+    index = {}
+    for term in vocabulary:
+        postings_list = [docID for docID in docs if term in docs[docID]]
+        index[term] = (len(postings_list), postings_list)
+
+    manifest = {'doc_count': len(docs), 'shards': []}
+    for shard in range(shards):
+        docIDs = [docID for docID in docs if (docID - 1) % shards == shard]
+        local = {docID: i for i, docID in enumerate(docIDs, start=1)}
+        shard_index = {}
+        for term, (_, postings_list) in index.items():
+            local_postings = [local[docID] for docID in postings_list if docID in local]
+            if local_postings:
+                shard_index[term] = (len(local_postings), local_postings)
+        utils.save_index_to_disk(shard_index, sharding.shard_filename(index_file, shard), binary=shard == 0, codec='vbyte')
+        manifest['shards'].append({'file': os.path.basename(sharding.shard_filename(index_file, shard)), 'docIDs': docIDs})
+    utils.write_json_obj_2_disk(manifest, sharding.shards_filename(index_file))
+
+    with sharding.QueryCoordinator(sharding.shards_filename(index_file)) as coordinator:
+        for term in vocabulary + ['missing']:
+            assert(coordinator.exec_query(term) == query.exec_query(term, index))
+        for q in ['oil AND NOT grain', 'NOT bank', '(rates OR dollar) AND oil']:
+            assert(coordinator.exec_query(q, 'boolean') == boolean_query.exec_boolean_query(q, index))
+
+    for shard in range(shards):
+        os.remove(sharding.shard_filename(index_file, shard))
+    os.remove(sharding.shards_filename(index_file))
+
+
+def test_build_shards():
+    '''
+    Ensure that the shards built from a corpus hold, once their docIDs are
+    mapped back to the corpus, the postings of the unsharded index, and that
+    the modes the shards cannot answer are refused.
+    '''
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus_dir = os.path.join(directory, 'corpus')
+        os.mkdir(corpus_dir)
+        benchmark.generate_synthetic_corpus(corpus_dir, files=2, docs_per_file=25, words_per_doc=20, vocabulary_size=100)
+        index = pipeline.accumulate_postings(pipeline.term_docID_pairs(corpus_dir, unique=True))
+
+        index_file = os.path.join(directory, 'index.txt')
+        sharding.build_shards(corpus_dir, index_file, 3, binary=True, codec='vbyte')
+        manifest = utils.load_json_from_disk(sharding.shards_filename(index_file))
+        assert(manifest['doc_count'] == 50)
+
+        merged = {}
+        for shard in manifest['shards']:
+            local = sharding.Shard(utils.open_index(os.path.join(directory, shard['file'])), shard['docIDs'])
+            for term, (frequency, postings_list) in local.items():
+                assert(frequency == len(postings_list))
+                merged.setdefault(term, []).extend(local.to_global(postings_list))
+            local.index.close()
+        assert({term: (len(postings_list), sorted(postings_list)) for term, postings_list in merged.items()} == index)
+
+        with sharding.QueryCoordinator(sharding.shards_filename(index_file)) as coordinator:
+            term = next(iter(index))
+            assert(coordinator.exec_query(term) == query.exec_query(term, index))
+            with pytest.raises(ValueError):
+                coordinator.exec_query(term, 'ranked')
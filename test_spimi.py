@@ -0,0 +1,40 @@
+import spimi
+import benchmark
+import binary_index
+import indexer
+import pipeline
+import positional
+import os
+import tempfile
+import utils
+
+
+def test_spimi_matches_in_memory_build():
+    '''
+    Ensure that blocks flushed under a tiny memory budget and merged give the
+    same text and binary index as the in memory build, and the same
+    positional index when positions are built from the same pass.
+    '''
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus_dir = os.path.join(directory, 'corpus')
+        benchmark.generate_synthetic_corpus(corpus_dir, files=3, docs_per_file=20, words_per_doc=30, vocabulary_size=200)
+        expected = indexer.from_scratch_index_creation(corpus_dir, ['case_fold'])
+        reference = positional.PositionalIndexBuilder(['case_fold'])
+        indexer.from_scratch_index_creation(corpus_dir, ['case_fold'], reference)
+
+        blocks = spimi.spimi_invert(pipeline.extract_documents(pipeline.read_files(corpus_dir)), directory, 20000, ['case_fold'])
+        assert(len(blocks) > 2)
+        assert(dict(spimi.merge_blocks(blocks)) == expected)
+
+        text_file = os.path.join(directory, 'index.txt')
+        spimi.build_index(corpus_dir, text_file, 20000, normalizers=['case_fold'], with_positions=True)
+        assert(utils.load_index(text_file) == expected)
+        with positional.open_positional_index(text_file) as loaded:
+            assert([(token, loaded[token]) for token in loaded] == list(reference.items()))
+
+        binary_file = os.path.join(directory, 'index.bin')
+        spimi.build_index(corpus_dir, binary_file, 20000, binary=True, codec='vbyte', normalizers=['case_fold'])
+        with binary_index.MmapIndex(binary_file) as loaded:
+            assert(dict(loaded.items()) == expected)
+        assert(not [name for name in os.listdir(directory) if name.startswith('spimi_blocks_')])  # the blocks of both builds are gone
@@ -0,0 +1,36 @@
+import term_dictionary
+import utils
+import fnmatch
+import random
+import os
+
+
+def test_term_dictionary():
+    '''
+    Ensure that the front coded dictionary finds every term by its ID and that
+    prefix and wildcard queries match the same terms as scanning them all.
+    '''
+
+    utils.ensure_dir_exists('output/')
+    index_file = 'output/test_term_dictionary.txt'
+
+    rng = random.Random(0)
+    terms = sorted({''.join(rng.choices('abcdeo', k=rng.randint(1, 8))) for _ in range(2000)} | {'oil', 'Oil', 'soil', 'boil'})
+    index = {term: (1, [docID]) for docID, term in enumerate(terms, start=1)}
+    utils.save_index_to_disk(index, index_file)
+    term_dictionary.build_term_dictionary(index_file)
+
+    with term_dictionary.open_term_dictionary(index_file) as dictionary:
+        assert(list(dictionary) == terms)
+        assert(all(dictionary.find(term) == term_id for term_id, term in enumerate(terms)))
+        assert(dictionary.find('zzz') == -1 and dictionary.find('A') == -1)
+
+        for pattern in ['oil*', '*oil', 'o*l', '*', 'a?c*', 'b*e?', '*o*o*', 'zz*']:
+            assert(dictionary.wildcard(pattern) == [term for term in terms if fnmatch.fnmatchcase(term, pattern)])
+
+        result = term_dictionary.exec_wildcard_query('*oil', index, dictionary)
+        assert(result['*oil']['terms'] == ['boil', 'oil', 'soil'])
+        assert(result['*oil']['postings'] == sorted(index[term][1][0] for term in ['boil', 'oil', 'soil']))
+
+    for filename in [index_file, term_dictionary.dictionary_filename(index_file), term_dictionary.kgram_filename(index_file)]:
+        os.remove(filename)
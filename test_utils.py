@@ -0,0 +1,26 @@
+import utils
+import os
+import random
+import tempfile
+
+
+def test_index_file_lookup():
+    '''
+    Ensure that looking terms up on disk in a text index gives the same
+    entries as the loaded index, and misses the terms around them.
+    '''
+
+    rng = random.Random(0)
+    terms = set(''.join(rng.choices('abcXY-', k=rng.randint(1, 8))) for _ in range(500))
+    index = {term: (n, sorted(rng.sample(range(1, 1000), n))) for term in terms for n in [rng.randint(1, 300)]}
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'index.txt')
+        utils.save_index_to_disk(index, filename)
+        index_file = utils.open_index(filename, on_disk=True)
+
+        assert(len(index_file) == len(index))
+        for term, (frequency, postings_list) in index.items():
+            assert(index_file[term] == (frequency, postings_list))
+            for missing in ['', term + 'z', '-' + term, term[:-1] + '~']:
+                assert((missing in index_file) == (missing in index))
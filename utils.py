@@ -1,11 +1,17 @@
-'''This file is just for common utilities that are reusable in different modules'''
+'''
+This file is just for common utilities that are reusable in different modules.
+It is imported by every script, query.py included, so tqdm is only imported by
+the functions that show progress.
+'''
 
 import argparse
 import json
 import sys
 import os
-from typing import Dict, Iterable, List, Tuple
-from tqdm import tqdm
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Tuple
+import binary_index
+import instrumentation
 
 
 def common_params():
@@ -23,11 +29,54 @@ def common_params():
     return common_params.args
 
 
+def iter_index_file(filename: str) -> Iterable[Tuple[str, Tuple[int, List[int]]]]:
+    '''(term, (frequency, postings list)) of the index stored in <filename>, in the order of the file'''
+
+    if binary_index.is_binary_index(filename):
+        with binary_index.MmapIndex(filename) as index:
+            yield from index.items()
+        return
+
+    with open(filename, mode='r') as file:
+        for line in file:
+            token, (frequency, postings_list) = json.loads(line)
+            yield token, (frequency, postings_list)
+
+
+def load_compact_index(filename: str):
+    '''
+    Loads the inverted index stored in <filename> into a CompactIndex (see
+    compact_index.py). Index files are sorted by term, so the entries are
+    streamed into the buffers without building the dict first.
+    '''
+    from tqdm import tqdm
+    import compact_index
+
+    print(f"\nLoading compact inverted index from {filename}")
+    with instrumentation.stage('load', bytes_in=os.path.getsize(filename)) as stage:
+        index = compact_index.CompactIndex.from_sorted_items(tqdm(iter_index_file(filename)))
+        stage.items = len(index)
+    return index
+
+
 def load_index(filename: str) -> Dict[str, Tuple[int, List[int]]]:
     '''Loads the inverted index stored in <filename>.'''
 
     print(f"\nLoading inverted index from {filename}")
 
+    with instrumentation.stage('load', bytes_in=os.path.getsize(filename)) as stage:
+        inverted_index = _load_index(filename)
+        stage.items = len(inverted_index)
+
+    return inverted_index
+
+
+def _load_index(filename: str) -> Dict[str, Tuple[int, List[int]]]:
+    from tqdm import tqdm
+    if binary_index.is_binary_index(filename):
+        with binary_index.MmapIndex(filename) as index:
+            return dict(tqdm(index.items(), total=len(index)))
+
     inv_idx = []                                           # as loaded by json.loads(), type(inv_idx) == List[str, List[int,List[int]]]
     inverted_index: Dict[str, Tuple[int, List[int]]] = {}  # This will contain the correct format and type
 
@@ -44,11 +93,114 @@ def load_index(filename: str) -> Dict[str, Tuple[int, List[int]]]:
     return inverted_index
 
 
-def save_index_to_disk(inverted_index: Dict[str, Tuple[int, set]], outfile: str,) -> None:
-    
+class IndexFile(Mapping):
+    '''
+    Text index stored in <filename>, looked up on disk without loading it.
+    The lines are sorted by term, so a lookup binary searches the byte offsets
+    of the file: it seeks, skips to the next line and decodes only the term
+    at its start, about log2(file size) times, then decodes the postings of
+    the single line it was looking for. Meant for a few lookups, e.g. a single
+    query.py call, where loading the whole index would cost far more. The
+    sorted lines start at byte <start>, after the header of files that have one.
+    '''
+
+    def __init__(self, filename: str, start=0):
+        self.filename = filename
+        self.start = start
+        self.size = os.path.getsize(filename)
+        self._decoder = json.JSONDecoder()
+        self._last = (None, None)  # (term, line) of the last lookup, `term in index` is followed by index[term]
+
+    def _line_from(self, file, offset: int) -> bytes:
+        '''First line starting at or after <offset>'''
+        if offset > self.start:
+            file.seek(offset - 1)
+            file.readline()
+        else:
+            file.seek(self.start)
+        return file.readline()
+
+    def _term(self, line: bytes) -> str:
+        return self._decoder.raw_decode(line.decode('UTF-8'), 1)[0]  # the line is ["term", [frequency, [docIDs]]]
+
+    def get_line(self, term: str):
+        '''Line of <term>, None when it is not in the index'''
+        if self._last[0] == term:
+            return self._last[1]
+
+        with open(self.filename, mode='rb') as file:
+            lo, hi = self.start, self.size
+            while lo < hi:
+                mid = (lo + hi) // 2
+                line = self._line_from(file, mid)
+                if line and self._term(line) < term:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            line = self._line_from(file, lo)
+
+        if not line or self._term(line) != term:
+            line = None
+        self._last = (term, line)
+        return line
+
+    def __getitem__(self, term: str) -> Tuple[int, List[int]]:
+        line = self.get_line(term) if isinstance(term, str) else None
+        if line == None:
+            raise KeyError(term)
+        _, (frequency, postings_list) = json.loads(line)
+        return frequency, postings_list
+
+    def __contains__(self, term) -> bool:
+        return isinstance(term, str) and self.get_line(term) != None
+
+    def __iter__(self) -> Iterator[str]:
+        for term, _ in iter_index_file(self.filename):
+            yield term
+
+    def __len__(self) -> int:
+        with open(self.filename, mode='rb') as file:
+            return sum([1 for _ in file])
+
+
+def open_index(filename: str, compact=False, on_disk=False):
+    '''
+    Opens the inverted index stored in <filename> for lookups. Binary indexes
+    are memory mapped and decoded one term at a time, text indexes are fully
+    loaded with <load_index>, or <load_compact_index> with <compact>, or
+    searched on disk with <on_disk> (see IndexFile). A segment directory (see
+    segments.py) gives the main index merged with its delta segments.
+    '''
+    if os.path.isdir(filename):
+        import segments  # segments imports this module
+        return segments.SegmentedIndex(filename)
+
+    if binary_index.is_binary_index(filename):
+        return binary_index.MmapIndex(filename)
+
+    if on_disk:
+        return IndexFile(filename)
+
+    if compact:
+        return load_compact_index(filename)
+
+    return load_index(filename)
+
+
+def save_index_to_disk(inverted_index: Dict[str, Tuple[int, set]], outfile: str, binary=False, codec='raw') -> None:
+    from tqdm import tqdm
+
     assert type(outfile) == str, "When using function save_index_to_disk you have to provide an outfile arg."
-    printable: Tuple[str, Tuple[int, List[int]]] = sorted(inverted_index.items(), key=lambda token: token[0])
-    write2disk(printable, outfile)
+    with instrumentation.stage('sort', items=len(inverted_index)):
+        printable: Tuple[str, Tuple[int, List[int]]] = sorted(inverted_index.items(), key=lambda token: token[0])
+
+    with instrumentation.stage('serialize', items=len(printable)) as stage:
+        if binary:
+            print(f'\nWriting binary index into file {outfile}')
+            binary_index.write_binary_index(tqdm(printable), outfile, codec=codec)
+        else:
+            write2disk(printable, outfile)
+        stage.bytes_out = os.path.getsize(outfile)
 
 
 def write2disk(lines: Iterable, outfile) -> None:
@@ -56,6 +208,7 @@ def write2disk(lines: Iterable, outfile) -> None:
     This is a general utility for writing intermediate and final computations
     into output files. The <lines> argument needs to be iterable.
     '''
+    from tqdm import tqdm
 
     print(f'\nWriting output into file {outfile}')
 
@@ -79,6 +232,16 @@ def write_json_obj_2_disk(obj: dict, outfile, indentation=None):
         json.dump(obj, outfile, indent=indentation)
 
 
+def append_json_line(obj, outfile: str) -> None:
+    '''
+    Appends obj as a single JSON line to outfile. Unlike write_json_obj_2_disk
+    the file is never reread nor rewritten, so logging costs the same whatever
+    the size of the log.
+    '''
+    with open(outfile, mode='a', encoding='UTF-8') as f:
+        print(json.dumps(obj), file=f)
+
+
 def load_json_from_disk(infile):
     '''Reads json obj from infile.'''
 